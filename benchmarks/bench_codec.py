@@ -0,0 +1,130 @@
+"""
+Benchmark for the frame codecs in chat.codec.
+
+Encodes each kind of server frame with the generic json.dumps-per-dict encoding the
+consumer used before chat.codec (json-dumps), the JSON codec, the binary subprotocol codec
+and the binary codec with deflate forced on (--deflate-threshold, 0 compresses every
+frame it can shrink), and reports bytes per frame and microseconds per frame. Also
+times counting the messages of an inbound batch frame in each format. The JSON codec uses
+orjson when it is installed; the backend in use is printed first.
+
+    python -m benchmarks.bench_codec --iterations 100000
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+import timeit
+import uuid
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
+django.setup()
+
+from chat.codec import BATCH, JSON_BACKEND, BinaryCodec, JsonCodec, encode_varint  # noqa: E402
+from chat.consumers import ChatConsumer  # noqa: E402
+from chat.resume_tokens import issue_token  # noqa: E402
+
+
+class DictJsonCodec(JsonCodec):
+    """
+    The JSON encoding the consumer used before chat.codec: build a dict, json.dumps it.
+    """
+    @staticmethod
+    def _send(payload):
+        return {"type": "websocket.send", "text": json.dumps(payload)}
+
+    def hello(self, session_uuid, resume_token=None, batch=False, ack_window_ms=0):
+        hello = {"session_uuid": session_uuid}
+        if resume_token is not None:
+            hello["resume_token"] = resume_token
+        if batch:
+            hello["batch"] = True
+        if ack_window_ms:
+            hello["ack_window"] = ack_window_ms
+        return self._send(hello)
+
+    def ack(self, count, resume_token=None):
+        ack = {"count": count}
+        if resume_token is not None:
+            ack["resume_token"] = resume_token
+        return self._send(ack)
+
+    def bye(self, total):
+        return self._send({"bye": True, "total": total})
+
+    def heartbeat(self, timestamp):
+        return self._send({"ts": datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()})
+
+    def ping(self, timestamp):
+        return self._send({"ping": timestamp})
+
+    def event(self, message):
+        return self._send(message)
+
+
+def frame_size(message):
+    return len(message["text"].encode()) if "text" in message else len(message["bytes"])
+
+
+def server_frames(session_uuid, token):
+    now = time.time()
+    return {
+        "hello": lambda codec: codec.hello(session_uuid, token, True, 200),
+        "ack": lambda codec: codec.ack(123),
+        "ack 4096": lambda codec: codec.ack(4096),
+        "ack+token": lambda codec: codec.ack(1234, token),
+        "heartbeat": lambda codec: codec.heartbeat(now),
+        "bye": lambda codec: codec.bye(1234),
+        "event": lambda codec: codec.event({"notice": "maintenance at 02:00 UTC " * 20}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--deflate-threshold", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    session_uuid = str(uuid.uuid4())
+    token = issue_token(uuid.UUID(session_uuid).bytes, 1234)
+    codecs = {
+        "json-dumps": DictJsonCodec(),
+        "json": JsonCodec(),
+        "binary": BinaryCodec(),
+        "binary+deflate": BinaryCodec(compress_threshold=args.deflate_threshold),
+    }
+    results = {}
+    print(f"json backend: {JSON_BACKEND}")
+    print(f"{'frame':<11}" + "".join(f"{name:>26}" for name in codecs))
+    for frame, build in server_frames(session_uuid, token).items():
+        row = results[frame] = {}
+        for name, codec in codecs.items():
+            size = frame_size(build(codec))
+            seconds = timeit.timeit(lambda: build(codec), number=args.iterations) / args.iterations
+            row[name] = {"bytes": size, "microseconds": seconds * 1e6}
+        print(f"{frame:<11}" + "".join(
+            f"{row[name]['bytes']:>10} B {row[name]['microseconds']:>8.2f} us/frame" for name in codecs))
+
+    batch = json.dumps(["m"] * 10)
+    inbound = {
+        "json-dumps": lambda: len(json.loads(batch)),
+        "json": lambda: ChatConsumer.batch_size(batch),
+        "binary": lambda: ChatConsumer.binary_batch_size(bytes((BATCH,)) + encode_varint(10)),
+    }
+    results["inbound_batch"] = {}
+    for name, parse in inbound.items():
+        seconds = timeit.timeit(parse, number=args.iterations) / args.iterations
+        results["inbound_batch"][name] = {"microseconds": seconds * 1e6}
+        print(f"inbound batch of 10 ({name}): {seconds * 1e6:.2f} us/frame")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"iterations": args.iterations, "json_backend": JSON_BACKEND, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark for broadcasting to the global group through the Redis channel layer.
+
+Adds --members channels to the global group, once as the single "chat-global"
+group and once split into --shards shard groups (chat.groups.ShardedGroup), and
+times broadcasts to all members. While each broadcast runs, a thread keeps sending
+PING to every Redis server from another process, to measure how long other clients'
+commands are held up behind the broadcast.
+
+Needs one or more Redis servers (--redis host:port ...), which are flushed before each run.
+
+    python -m benchmarks.bench_group_broadcast --members 50000 --shards 16
+    python -m benchmarks.bench_group_broadcast --redis 127.0.0.1:6379 127.0.0.1:6380
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import multiprocessing
+import time
+
+import redis
+from channels_redis.core import RedisChannelLayer
+
+from chat.groups import ShardedGroup
+
+
+def ping(hosts, ready, done, results):
+    """
+    Send PING to every server in turn until `done` is set and report the longest round trip.
+    Runs in its own process so the latencies reflect the servers, not the benchmark's event loop.
+    """
+    clients = [redis.Redis(host=host, port=port) for host, port in hosts]
+    longest = 0.0
+    ready.set()
+    while not done.is_set():
+        for client in clients:
+            start = time.perf_counter()
+            client.ping()
+            longest = max(longest, time.perf_counter() - start)
+    results.put(longest)
+
+
+async def run(hosts, members, shards, broadcasts, batch_size):
+    layer = RedisChannelLayer(hosts=hosts, capacity=broadcasts + 1)
+    clients = [redis.Redis(host=host, port=port) for host, port in hosts]
+    for client in clients:
+        client.flushall()
+    group = ShardedGroup("bench-global", shards=shards)
+    channels = [await layer.new_channel() for _ in range(members)]
+    for offset in range(0, members, batch_size):
+        await asyncio.gather(*(group.add(layer, channel, channel) for channel in channels[offset:offset + batch_size]))
+
+    durations, pings = [], []
+    for i in range(broadcasts):
+        ready, done, results = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Queue()
+        pinger = multiprocessing.Process(target=ping, args=(hosts, ready, done, results))
+        pinger.start()
+        ready.wait()
+        start = time.perf_counter()
+        await group.send(layer, {"type": "heartbeat.message", "message": {"ts": i}})
+        durations.append(time.perf_counter() - start)
+        done.set()
+        pings.append(results.get())
+        pinger.join()
+
+    await layer.flush()
+    for client in clients:
+        client.close()
+    return {
+        "shards": shards,
+        "members_per_shard": [min(group.members), max(group.members)],
+        "broadcast_median_seconds": statistics.median(durations),
+        "broadcast_max_seconds": max(durations),
+        "ping_max_seconds": max(pings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis", nargs="+", default=["127.0.0.1:6379"], help="Redis servers as host:port")
+    parser.add_argument("--members", type=int, default=50_000)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--broadcasts", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Concurrent group_add calls while joining")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    hosts = [(host, int(port)) for host, port in (address.rsplit(":", 1) for address in args.redis)]
+    results = []
+    for shards in (1, args.shards):
+        result = asyncio.run(run(hosts, args.members, shards, args.broadcasts, args.batch_size))
+        results.append(result)
+        print(f"{shards:>3} shard(s) of {result['members_per_shard'][0]}-{result['members_per_shard'][1]} members: "
+              f"broadcast to {args.members} members median {result['broadcast_median_seconds'] * 1000:.0f} ms, "
+              f"max {result['broadcast_max_seconds'] * 1000:.0f} ms, "
+              f"longest PING meanwhile {result['ping_max_seconds'] * 1000:.1f} ms")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"members": args.members, "redis": args.redis, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark for handshake latency with and without batched group membership updates.
+
+Opens --connections in-process WebSocket connections to the chat consumer at --rate
+connects per second, against a Redis channel layer, and times each handshake from the
+connect until the hello frame. Runs once with every connection awaiting its own
+group_add, and once with the joins queued on a chat.groups.MembershipBatcher that sends
+them every --interval seconds, one pipeline per shard.
+
+Needs a Redis server (--redis host:port), which is flushed before each run.
+
+    python -m benchmarks.bench_membership --rate 5000 --connections 10000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+
+import django
+import redis
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
+# Admission control would turn most of the connects away at this rate
+os.environ.setdefault('CHAT_ADMISSION', '0')
+django.setup()
+
+from channels.layers import channel_layers  # noqa: E402
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from channels_redis.core import RedisChannelLayer  # noqa: E402
+
+from chat.consumers import broadcast_group  # noqa: E402
+from chat.groups import MembershipBatcher  # noqa: E402
+from mywebsite.asgi import application  # noqa: E402
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def handshake(durations, communicators):
+    communicator = WebsocketCommunicator(application, "/ws/chat/")
+    start = time.perf_counter()
+    connected, _ = await communicator.connect(timeout=30)
+    assert connected
+    await communicator.receive_from(timeout=30)
+    durations.append(time.perf_counter() - start)
+    communicators.append(communicator)
+
+
+async def run(host, port, connections, rate, interval):
+    client = redis.Redis(host=host, port=port)
+    client.flushall()
+    layer = channel_layers.backends["default"] = RedisChannelLayer(hosts=[(host, port)])
+    broadcast_group.batcher = MembershipBatcher(interval) if interval else None
+    commands = client.info("commandstats").get("cmdstat_zadd", {}).get("calls", 0)
+
+    durations, communicators, tasks = [], [], []
+    start = time.perf_counter()
+    for i in range(connections):
+        # Pace the connects; sleeping per connection would be far too coarse at this rate
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(handshake(durations, communicators)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await broadcast_group.flush()
+    members = sum(client.zcard(layer._group_key(name)) for name in broadcast_group.names)
+    zadds = client.info("commandstats")["cmdstat_zadd"]["calls"] - commands
+
+    await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+    await broadcast_group.flush()
+    await layer.flush()
+    client.close()
+    return {
+        "batch_interval": interval,
+        "connects_per_second": connections / elapsed,
+        "handshake_p50_seconds": statistics.median(durations),
+        "handshake_p99_seconds": percentile(durations, 0.99),
+        "handshake_max_seconds": max(durations),
+        "group_members": members,
+        "zadd_calls": zadds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis", default="127.0.0.1:6379", help="Redis server as host:port")
+    parser.add_argument("--connections", type=int, default=10_000)
+    parser.add_argument("--rate", type=float, default=5000, help="Connects per second")
+    parser.add_argument("--interval", type=float, default=0.005, help="Batch interval in seconds")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    host, port = args.redis.rsplit(":", 1)
+    logging.getLogger('chat').setLevel(logging.WARNING)
+    results = []
+    for interval in (0, args.interval):
+        result = asyncio.run(run(host, int(port), args.connections, args.rate, interval))
+        results.append(result)
+        label = f"batched every {interval * 1000:g} ms" if interval else "one group_add per connect"
+        print(f"{label:>26}: {result['connects_per_second']:.0f} connects/s, "
+              f"handshake p50 {result['handshake_p50_seconds'] * 1000:.2f} ms, "
+              f"p99 {result['handshake_p99_seconds'] * 1000:.2f} ms, "
+              f"max {result['handshake_max_seconds'] * 1000:.1f} ms, "
+              f"{result['zadd_calls']} ZADDs for {result['group_members']} members")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"connections": args.connections, "rate": args.rate, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
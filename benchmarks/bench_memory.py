@@ -0,0 +1,180 @@
+"""
+Memory cost of an idle WebSocket connection.
+
+Opens --connections idle connections against the in-process mywebsite.asgi.application
+and reports the bytes each one keeps allocated, measured with tracemalloc and broken down
+by allocation site. A site is the innermost frame of the allocation's traceback that is in
+this project or in an installed package, so memory allocated by asyncio or the stdlib on
+behalf of, say, the channel layer is counted there. Sites are grouped by owner:
+
+- chat: this project (chat/, mywebsite/), the consumer-side state
+- client: the in-process test client (channels.testing, asgiref.testing), this script and
+  pytest, standing in for the server's protocol objects; not counted against the budget
+- every other installed package by name (channels, asgiref, django, ...)
+
+Fails with a non-zero exit status when the cost is over settings.CHAT_MEMORY_BUDGET;
+tests/test_memory.py runs the same check.
+
+    python -m benchmarks.bench_memory --connections 2000 --top 30
+"""
+import argparse
+import asyncio
+import collections
+import gc
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
+# Admission control would turn most of the connections away
+os.environ.setdefault('CHAT_ADMISSION', '0')
+django.setup()
+
+from channels.testing import WebsocketCommunicator  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from chat.consumers import broadcast_group  # noqa: E402
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+PROJECT_PACKAGES = ('chat', 'mywebsite')
+CLIENT_MODULES = ('channels/testing/', 'asgiref/testing.py', 'benchmarks/', 'tests/', '_pytest/', 'pytest_asyncio/')
+# Frames kept per allocation, enough to get from asyncio internals back to their caller
+TRACEBACK_LIMIT = 40
+
+
+def allocation_site(traceback):
+    """
+    Return (owner, "file:line") for an allocation, see the module docstring.
+    """
+    for frame in reversed(traceback):
+        filename = frame.filename
+        if filename.startswith(PROJECT_DIR):
+            path = filename[len(PROJECT_DIR):]
+        elif '/site-packages/' in filename:
+            path = filename.rsplit('/site-packages/', 1)[1]
+        else:
+            continue
+        site = f'{path}:{frame.lineno}'
+        if path.startswith(CLIENT_MODULES):
+            return 'client', site
+        package = path.split('/', 1)[0]
+        return ('chat' if package in PROJECT_PACKAGES else package), site
+    frame = traceback[-1]
+    return 'stdlib', f'{os.path.basename(frame.filename)}:{frame.lineno}'
+
+
+async def open_idle_connection(application):
+    communicator = WebsocketCommunicator(application, "/ws/chat/")
+    connected, _ = await communicator.connect()
+    assert connected, "connection refused"
+    await communicator.receive_from()
+    return communicator
+
+
+async def settle():
+    # Queued group joins and the writers of the hello frames finish, garbage is collected
+    await broadcast_group.flush()
+    await asyncio.sleep(0.05)
+    gc.collect()
+
+
+async def measure(connections, application=None, warmup=50):
+    """
+    Open `connections` idle connections and return the bytes they keep allocated per
+    connection: in total, per owner and per allocation site.
+    The connections are closed again before returning. Admission control should be off,
+    or it turns most of them away.
+    """
+    if application is None:
+        from mywebsite.asgi import application
+    # Log records are only queued for the log thread while they are written
+    chat_logger = logging.getLogger('chat')
+    level = chat_logger.level
+    chat_logger.setLevel(logging.WARNING)
+    # Warm-up connections fill the caches and lazily created state every connection shares
+    communicators = [await open_idle_connection(application) for _ in range(warmup)]
+    await settle()
+    tracemalloc.start(TRACEBACK_LIMIT)
+    try:
+        before = tracemalloc.take_snapshot()
+        opened = [await open_idle_connection(application) for _ in range(connections)]
+        communicators += opened
+        await settle()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+        await broadcast_group.flush()
+        chat_logger.setLevel(level)
+
+    owners = collections.Counter()
+    sites = collections.Counter()
+    for stat in after.compare_to(before, 'traceback'):
+        owner, site = allocation_site(stat.traceback)
+        owners[owner] += stat.size_diff
+        sites[owner, site] += stat.size_diff
+    client = owners['client']
+    return {
+        "connections": connections,
+        "bytes_per_connection": round((sum(owners.values()) - client) / connections),
+        "client_bytes_per_connection": round(client / connections),
+        "owners": {owner: round(size / connections) for owner, size in owners.most_common()},
+        "sites": [
+            {"owner": owner, "site": site, "bytes": round(size / connections)}
+            for (owner, site), size in sites.most_common()
+        ],
+    }
+
+
+def over_budget(result, budget=None):
+    """
+    Return a description of every budget in settings.CHAT_MEMORY_BUDGET the result exceeds:
+    CONNECTION for the whole cost of a connection except the client's, CONSUMER for the chat code's.
+    """
+    budget = budget if budget is not None else getattr(settings, 'CHAT_MEMORY_BUDGET', {})
+    measured = {
+        'CONNECTION': result["bytes_per_connection"],
+        'CONSUMER': result["owners"].get('chat', 0),
+    }
+    return [
+        f'{name}: {measured[name]} bytes per connection, budget {limit}'
+        for name, limit in budget.items() if measured[name] > limit
+    ]
+
+
+def report(result, top=20):
+    lines = [
+        f'{result["bytes_per_connection"]} bytes per idle connection over {result["connections"]} connections, '
+        f'plus {result["client_bytes_per_connection"]} for the test client',
+        'by owner: ' + ', '.join(f'{owner} {size}' for owner, size in result["owners"].items()),
+    ]
+    for site in result["sites"][:top]:
+        lines.append(f'{site["bytes"]:>8}  {site["owner"]:<10} {site["site"]}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--top", type=int, default=20, help="Number of allocation sites to list")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(measure(args.connections))
+    print(report(result, args.top))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(result, f, indent=2)
+    failures = over_budget(result)
+    for failure in failures:
+        print(f'over budget: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
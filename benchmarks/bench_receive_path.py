@@ -0,0 +1,128 @@
+"""
+Benchmark for the ChatConsumer.receive hot path.
+
+Drives many in-process ChatConsumer instances concurrently and compares the current
+lock-free receive path against the previous one, which awaited session_store_lock
+and metrics_lock on every frame.
+
+    python -m benchmarks.bench_receive_path --connections 1000 10000 --messages 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
+django.setup()
+
+from chat import consumers  # noqa: E402
+from chat.consumers import ChatConsumer, metrics, session_store  # noqa: E402
+from chat.outbound import OutboundQueue  # noqa: E402
+
+
+session_store_lock = asyncio.Lock()
+metrics_lock = asyncio.Lock()
+
+
+class LockedChatConsumer(ChatConsumer):
+    """
+    ChatConsumer with the receive path as it was before the locks were removed. It goes
+    through the same liveness touch, rate limits and sampled receive log as ChatConsumer,
+    so the two only differ in the locks and the synchronous store write.
+    """
+    async def receive(self, text_data):
+        if consumers.liveness_enabled:
+            consumers.LivenessMonitor.touch(self)
+            if self.is_pong(text_data, None):
+                return
+        if consumers.rate_limit_enabled and not await self.within_rate_limits(1):
+            return
+        if (consumers.receive_log_sample_rate and consumers.logger.isEnabledFor(logging.INFO)
+                and next(consumers.receive_log_counter) % consumers.receive_log_sample_rate == 0):
+            consumers.logger.info('Receiving message for session %s on channel %s', self.session_uuid,
+                                  self.channel_name, extra={'event': 'receive', 'session': self.session_uuid,
+                                                            'channel': self.channel_name, 'sampled': True})
+        self.message_count += 1
+        async with session_store_lock:
+            await session_store.set(self.session_uuid, self.message_count)
+        async with metrics_lock:
+            metrics["total_messages"] += 1
+        await super(ChatConsumer, self).send(text_data=json.dumps({
+            "count": self.message_count
+        }))
+
+
+async def yielding_send(message):
+    # A real transport write hands control back to the event loop
+    await asyncio.sleep(0)
+
+
+def make_consumer(consumer_class, index):
+    consumer = consumer_class()
+    consumer.scope = {"type": "websocket", "path": "/ws/chat/"}
+    consumer.channel_name = f"bench.{index}"
+    consumer.base_send = yielding_send
+    consumer.outbound = OutboundQueue(yielding_send)
+    consumer.session_uuid = str(consumers.uuid.uuid4())
+    consumer.message_count = 0
+    return consumer
+
+
+async def drive(consumer, messages):
+    for _ in range(messages):
+        await consumer.receive(text_data="m")
+
+
+async def run(consumer_class, connections, messages):
+    session_store.clear()
+    clients = [make_consumer(consumer_class, i) for i in range(connections)]
+    start = time.perf_counter()
+    await asyncio.gather(*(drive(consumer, messages) for consumer in clients))
+    await asyncio.gather(*(consumer.outbound.flush() for consumer in clients))
+    elapsed = time.perf_counter() - start
+    await consumers.session_writes.flush()
+    return connections * messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--messages", type=int, default=20, help="Messages sent per connection")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    # Both variants run the same per-message work apart from the locks
+    print(
+        f"both variants: rate limits {'on' if consumers.rate_limit_enabled else 'off'}, "
+        f"receive logs {logging.getLevelName(consumers.logger.getEffectiveLevel())} "
+        f"sampled 1 in {consumers.receive_log_sample_rate}, liveness {'on' if consumers.liveness_enabled else 'off'}"
+    )
+    results = []
+    for connections in args.connections:
+        locked = asyncio.run(run(LockedChatConsumer, connections, args.messages))
+        lock_free = asyncio.run(run(ChatConsumer, connections, args.messages))
+        results.append({
+            "connections": connections,
+            "messages_per_connection": args.messages,
+            "locked_msgs_per_sec": round(locked),
+            "lock_free_msgs_per_sec": round(lock_free),
+            "speedup": round(lock_free / locked, 3),
+            "rate_limits": consumers.rate_limit_enabled,
+            "receive_log_sample_rate": consumers.receive_log_sample_rate,
+        })
+        print(
+            f"{connections:>6} connections: locked {locked:>10.0f} msg/s, "
+            f"lock-free {lock_free:>10.0f} msg/s ({lock_free / locked:.2f}x)"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
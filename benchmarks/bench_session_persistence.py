@@ -0,0 +1,125 @@
+"""
+Benchmark for chat.session_store.PersistentSessionStore.
+
+- startup: writes a snapshot of --sessions sessions plus a log of --log-records
+  updates, then times opening the store on them and looking sessions up.
+- write amplification: --connections sessions each send --messages-per-tick messages
+  for --ticks write-behind flushes (every flush is one sync) and reports the bytes
+  written to the log and snapshots against 24 bytes (one log record) per message
+  and per count actually written to the store after write-behind coalescing.
+
+    python -m benchmarks.bench_session_persistence --sessions 2000000 --log-records 50000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from chat import persistence
+from chat.session_store import PersistentSessionStore, WriteBehindBuffer
+
+
+def write_state(path, sessions, log_records):
+    now = time.time()
+    keys = sorted(os.urandom(16) for _ in range(sessions))
+    persistence.write_snapshot(
+        os.path.join(path, PersistentSessionStore.SNAPSHOT_NAME),
+        keys, list(range(sessions)), [int(now)] * sessions, generation=0, written_at=now,
+    )
+    log = persistence.SessionLog(os.path.join(path, f'{PersistentSessionStore.LOG_PREFIX}0'))
+    updated = random.sample(keys, min(log_records, sessions))
+    for offset in range(0, len(updated), 1000):
+        log.append([(key, 1) for key in updated[offset:offset + 1000]], now)
+    log.close()
+    return keys
+
+
+async def lookups(store, keys, count):
+    sample = random.sample(keys, count)
+    start = time.perf_counter()
+    for key in sample:
+        await store.get(key)
+    return (time.perf_counter() - start) / count
+
+
+def bench_startup(sessions, log_records, lookup_count):
+    with tempfile.TemporaryDirectory() as path:
+        keys = write_state(path, sessions, log_records)
+        start = time.perf_counter()
+        store = PersistentSessionStore(path, max_size=max(log_records, lookup_count) * 2)
+        startup = time.perf_counter() - start
+        assert len(store) == sessions
+        lookup = asyncio.run(lookups(store, keys, lookup_count))
+        snapshot_bytes = os.path.getsize(os.path.join(path, PersistentSessionStore.SNAPSHOT_NAME))
+    return {"startup_seconds": startup, "lookup_microseconds": lookup * 1e6, "snapshot_bytes": snapshot_bytes}
+
+
+async def write_load(path, connections, messages_per_tick, ticks, compact_after):
+    store = PersistentSessionStore(path, max_size=connections, compact_after=compact_after)
+    buffer = WriteBehindBuffer(store)
+    session_ids = [os.urandom(16) for _ in range(connections)]
+    counts = dict.fromkeys(session_ids, 0)
+    for _ in range(ticks):
+        for session_uuid in session_ids:
+            for _ in range(messages_per_tick):
+                counts[session_uuid] += 1
+                buffer.mark(session_uuid, counts[session_uuid])
+        await buffer.flush()
+    if store._compaction is not None:
+        await store._compaction
+    return store
+
+
+def bench_write_amplification(connections, messages_per_tick, ticks, compact_after):
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        store = asyncio.run(write_load(path, connections, messages_per_tick, ticks, compact_after))
+        elapsed = time.perf_counter() - start
+    messages = connections * messages_per_tick * ticks
+    return {
+        "messages": messages,
+        "store_updates": store.updates,
+        "bytes_written": store.bytes_written,
+        "compactions": store.compactions,
+        "bytes_per_message": store.bytes_written / messages,
+        "write_amplification": store.bytes_written / (messages * persistence.RECORD.size),
+        "update_write_amplification": store.bytes_written / (store.updates * persistence.RECORD.size),
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2_000_000, help="Sessions in the snapshot")
+    parser.add_argument("--log-records", type=int, default=50_000, help="Records in the log replayed on startup")
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--connections", type=int, default=10_000)
+    parser.add_argument("--messages-per-tick", type=int, default=5, help="Messages per connection per flush")
+    parser.add_argument("--ticks", type=int, default=30, help="Write-behind flushes")
+    parser.add_argument("--compact-after", type=int, default=100_000)
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file as JSON")
+    args = parser.parse_args()
+
+    startup = bench_startup(args.sessions, args.log_records, args.lookups)
+    print(f"startup with {args.sessions} sessions and {args.log_records} log records: "
+          f"{startup['startup_seconds'] * 1000:.1f} ms")
+    print(f"lookup of a session from the snapshot: {startup['lookup_microseconds']:.1f} us")
+    print(f"snapshot size: {startup['snapshot_bytes'] / 2 ** 20:.1f} MiB")
+
+    writes = bench_write_amplification(args.connections, args.messages_per_tick, args.ticks, args.compact_after)
+    print(f"{writes['messages']} messages -> {writes['store_updates']} store updates, "
+          f"{writes['bytes_written'] / 2 ** 20:.1f} MiB written, {writes['compactions']} compactions")
+    print(f"bytes per message: {writes['bytes_per_message']:.2f}, "
+          f"write amplification: {writes['write_amplification']:.3f} per message, "
+          f"{writes['update_write_amplification']:.3f} per store update")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "startup": startup, "writes": writes}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
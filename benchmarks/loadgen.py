@@ -0,0 +1,410 @@
+"""
+Load generator and latency benchmark for the /ws/chat/ endpoint.
+
+Opens many concurrent client connections against the ASGI application, either
+in-process through the channels test communicator or over real sockets against a
+local Daphne or uvicorn (uvloop, httptools, wsproto) subprocess, drives a configurable message rate and reports:
+
+- connect rate, handshakes turned away by admission control and handshake latency percentiles
+- ack round-trip p50/p95/p99
+- acknowledged messages per second, and messages dropped by the rate limit or never acked
+- heartbeat fan-out duration
+- server RSS per connection
+
+Results are printed and, with --output, written as JSON. --compare checks a run
+against an earlier result file and exits non-zero on regressions.
+
+The server's per-session rate limit is off unless CHAT_RATE_LIMIT is set in the
+environment, since at high --rate it would measure the limit rather than the server.
+Throttle frames are counted as dropped messages and the client backs off for their
+retry_after; a message without an ack within --ack-timeout seconds counts as dropped too.
+
+    python -m benchmarks.loadgen --server inprocess --connections 2000 --duration 10
+    python -m benchmarks.loadgen --server daphne --connections 5000 --rate 2 --output run.json
+    python -m benchmarks.loadgen --server daphne --compare run.json
+    python -m benchmarks.loadgen --server uvicorn --compare run.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
+# Benchmark servers run without the per-session rate limit, the subprocesses inherit this
+os.environ.setdefault('CHAT_RATE_LIMIT', '0')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(values):
+    return {
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3) if values else None,
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3) if values else None,
+        "max_ms": round(max(values) * 1000, 3) if values else None,
+    }
+
+
+def rss_bytes(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class InProcessClient:
+    """
+    Client driving the ASGI application directly through the channels test communicator.
+    """
+    def __init__(self, application, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise ConnectionError("handshake rejected")
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def recv(self, timeout=30):
+        return await self.communicator.receive_from(timeout=timeout)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """
+    Client talking to a real server over a WebSocket connection.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.connection = None
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+        self.connection = await connect(self.url, compression=None, ping_interval=None, open_timeout=60)
+
+    async def send(self, text):
+        await self.connection.send(text)
+
+    async def recv(self, timeout=30):
+        return await asyncio.wait_for(self.connection.recv(), timeout)
+
+    async def close(self):
+        await self.connection.close()
+
+
+class InProcessServer:
+    name = "inprocess"
+
+    def __init__(self, args):
+        django.setup()
+        from mywebsite.asgi import application
+        self.application = application
+        self.pid = os.getpid()
+
+    def client(self, query=""):
+        return InProcessClient(self.application, f"/ws/chat/{query}")
+
+    async def heartbeat_fanout(self, connections):
+        from chat.consumers import heartbeat
+        await heartbeat.tick()
+        return heartbeat.last_fanout_duration
+
+    def stop(self):
+        pass
+
+
+class DaphneServer:
+    """
+    A local Daphne subprocess serving mywebsite.asgi:application.
+    """
+    name = "daphne"
+    command = ["daphne", "-b", "127.0.0.1", "-p", "{port}", "mywebsite.asgi:application"]
+
+    def __init__(self, args):
+        self.port = free_port()
+        self.heartbeat_interval = args.heartbeat_interval
+        env = dict(os.environ, TESTING=os.environ.get("TESTING", "1"), CHAT_HEARTBEAT_INTERVAL=str(args.heartbeat_interval))
+        command = [part.format(port=self.port) for part in self.command]
+        self.process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.pid = self.process.pid
+        self.wait_ready()
+
+    def wait_ready(self, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with code {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.name} did not start listening")
+
+    def client(self, query=""):
+        return SocketClient(f"ws://127.0.0.1:{self.port}/ws/chat/{query}")
+
+    def scrape_metric(self, name):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/chat/metrics/", timeout=10) as response:
+            for line in response.read().decode().splitlines():
+                if line.startswith(name + " "):
+                    return float(line.split()[1])
+        return None
+
+    async def heartbeat_fanout(self, connections):
+        # Wait for at least one heartbeat to reach every connection, then read the server's timing
+        await asyncio.sleep(self.heartbeat_interval * 1.5)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.scrape_metric, "websocket_heartbeat_fanout_seconds"
+        )
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class UvicornServer(DaphneServer):
+    """
+    A local uvicorn subprocess with uvloop, httptools and wsproto, see mywebsite.uvicorn_server.
+    """
+    name = "uvicorn"
+    command = [sys.executable, "-m", "mywebsite.uvicorn_server", "-p", "{port}", "--log-level", "warning"]
+
+
+SERVERS = {
+    "inprocess": InProcessServer,
+    "daphne": DaphneServer,
+    "uvicorn": UvicornServer,
+}
+
+
+async def read_ack(client, timeout):
+    """
+    Wait for the next ack or throttle frame, skipping heartbeats and other server frames.
+    Raises asyncio.TimeoutError when neither arrives within `timeout` seconds.
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        frame = json.loads(await client.recv(max(deadline - time.perf_counter(), 0)))
+        if "count" in frame or frame.get("throttled"):
+            return frame
+
+
+async def open_clients(server, count, concurrency, query):
+    clients = []
+    handshakes = []
+    failures = 0
+    rejections = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def open_one():
+        nonlocal failures, rejections
+        while True:
+            client = server.client(query)
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await client.connect()
+                    hello = json.loads(await client.recv())  # hello frame with the session UUID
+                except Exception:
+                    failures += 1
+                    return
+                if "retry_after" not in hello:
+                    handshakes.append(time.perf_counter() - start)
+                    clients.append(client)
+                    return
+            # Turned away by admission control, back off with jitter like a real client
+            rejections += 1
+            await client.close()
+            await asyncio.sleep(hello["retry_after"] * (1 + random.random()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(open_one() for _ in range(count)))
+    return clients, handshakes, failures, rejections, time.perf_counter() - start
+
+
+async def drive_client(client, rate, deadline, ack_timeout, round_trips, dropped):
+    interval = 1.0 / rate if rate else 0
+    next_send = time.perf_counter()
+    sent = 0
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            return sent
+        if interval and now < next_send:
+            await asyncio.sleep(next_send - now)
+        start = time.perf_counter()
+        await client.send("benchmark")
+        next_send += interval
+        try:
+            frame = await read_ack(client, ack_timeout)
+        except asyncio.TimeoutError:
+            dropped["timeout"] += 1
+            continue
+        if frame.get("throttled"):
+            # Rate limited, back off like a real client; the schedule restarts from here
+            dropped["throttled"] += 1
+            await asyncio.sleep(min(frame["retry_after"], max(deadline - time.perf_counter(), 0)))
+            next_send = time.perf_counter()
+            continue
+        round_trips.append(time.perf_counter() - start)
+        sent += 1
+
+
+async def run_benchmark(server, args):
+    baseline_rss = rss_bytes(server.pid)
+    clients, handshakes, failures, rejections, connect_elapsed = await open_clients(
+        server, args.connections, args.connect_concurrency, args.query
+    )
+    connected = len(clients)
+    connected_rss = rss_bytes(server.pid)
+
+    round_trips = []
+    dropped = collections.Counter()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    sent = await asyncio.gather(*(
+        drive_client(client, args.rate, deadline, args.ack_timeout, round_trips, dropped) for client in clients
+    ))
+    drive_elapsed = time.perf_counter() - start
+
+    fanout = await server.heartbeat_fanout(connected)
+    await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    return {
+        "server": server.name,
+        "connections": connected,
+        "connect_failures": failures,
+        "connect_rejections": rejections,
+        "connect_rate_per_sec": round(connected / connect_elapsed, 1) if connect_elapsed else None,
+        "handshake": latency_summary(handshakes),
+        "ack_round_trip": latency_summary(round_trips),
+        "messages": sum(sent),
+        "messages_per_sec": round(sum(sent) / drive_elapsed, 1) if drive_elapsed else None,
+        "messages_throttled": dropped["throttled"],
+        "messages_timed_out": dropped["timeout"],
+        "heartbeat_fanout_ms": round(fanout * 1000, 3) if fanout is not None else None,
+        "rss_per_connection_bytes": round((connected_rss - baseline_rss) / connected) if connected else None,
+    }
+
+
+# Metrics compared by --compare, with whether a higher value is better
+COMPARED = {
+    ("connect_rate_per_sec",): True,
+    ("messages_per_sec",): True,
+    ("ack_round_trip", "p50_ms"): False,
+    ("ack_round_trip", "p99_ms"): False,
+    ("heartbeat_fanout_ms",): False,
+    ("rss_per_connection_bytes",): False,
+}
+
+
+def lookup(result, path):
+    for key in path:
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """
+    Return a description of every compared metric that got worse by more than `tolerance`.
+    """
+    regressions = []
+    for path, higher_is_better in COMPARED.items():
+        current, previous = lookup(result, path), lookup(baseline, path)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{'.'.join(path)}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="inprocess")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--connect-concurrency", type=int, default=200,
+                        help="Handshakes in flight at the same time")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="Messages per second per connection (0 sends as fast as acks come back)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to drive messages for")
+    parser.add_argument("--ack-timeout", type=float, default=10.0,
+                        help="Seconds to wait for an ack before counting the message as dropped")
+    parser.add_argument("--heartbeat-interval", type=float, default=2.0,
+                        help="Heartbeat interval of the server subprocess in seconds")
+    parser.add_argument("--query", default="", help="Query string added to the WebSocket URL, e.g. '?batch=1'")
+    parser.add_argument("--output", help="Write the results to this file as JSON")
+    parser.add_argument("--compare", help="Compare against an earlier JSON result and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative regression for --compare")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    raise_fd_limit()
+    server = SERVERS[args.server](args)
+    try:
+        results = asyncio.run(run_benchmark(server, args))
+    finally:
+        server.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
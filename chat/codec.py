@@ -0,0 +1,215 @@
+import datetime
+import json
+import math
+import uuid
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the stdlib json module is the fallback
+    orjson = None
+
+
+# Subprotocol a client asks for in Sec-WebSocket-Protocol to get binary frames
+BINARY_SUBPROTOCOL = 'chat.binary.v1'
+
+# Binary frames start with one byte: the frame type, with DEFLATED set if the rest of
+# the frame is raw-deflate compressed
+DEFLATED = 0x80
+TYPE_MASK = 0x7f
+
+# Server frames
+HELLO = 0x01      # 16-byte session UUID, flags byte, varint ack window (ms), resume token
+ACK = 0x02        # varint count, resume token
+HEARTBEAT = 0x03  # varint unix time (ms)
+BYE = 0x04        # varint total count
+PING = 0x05       # varint unix time (ms)
+EVENT = 0x06      # any other message, as UTF-8 JSON
+THROTTLE = 0x07   # varint milliseconds until messages are accepted again
+
+# Client frames
+MESSAGE = 0x10    # one message, payload ignored
+BATCH = 0x11      # varint number of messages, payload ignored
+PONG = 0x12       # varint unix time (ms) of the ping
+
+# Hello flags
+HELLO_BATCH = 0x01
+
+# Close code for a client that breaks the protocol, e.g. with a batch over the size limit
+PROTOCOL_ERROR_CLOSE_CODE = 4400
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+else:
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+    loads = json.loads
+    JSON_BACKEND = 'json'
+
+# Ack frames for counts below this are built once and reused
+CACHED_ACKS = 1024
+
+
+def encode_varint(value):
+    """
+    Encode a non-negative integer as an unsigned LEB128 varint, 7 bits per byte.
+    """
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(data, offset=0):
+    """
+    Decode a varint from `data` at `offset`. Returns (value, offset after it).
+    """
+    value = shift = 0
+    while True:
+        try:
+            byte = data[offset]
+        except IndexError:
+            raise ValueError("Truncated varint") from None
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class JsonCodec:
+    """
+    Encodes server frames as compact JSON text frames. Used unless the client negotiated
+    the binary subprotocol.
+
+    The fixed-shape frames (hello, ack, bye, heartbeat, ping, throttle) are formatted from string
+    templates, their values are numbers, UUIDs, timestamps and base64url tokens which
+    never need escaping. Ack frames without a token for small counts are cached, every
+    session sends the same ones. Other events go through `dumps`, which is orjson when it
+    is installed and the stdlib json module otherwise.
+    """
+    subprotocol = None
+
+    def __init__(self):
+        self._acks = [self._text('{"count":%d}' % count) for count in range(CACHED_ACKS)]
+
+    @staticmethod
+    def _text(text):
+        return {"type": "websocket.send", "text": text}
+
+    def hello(self, session_uuid, resume_token=None, batch=False, ack_window_ms=0):
+        text = '{"session_uuid":"%s"' % session_uuid
+        if resume_token is not None:
+            text += ',"resume_token":"%s"' % resume_token
+        # Confirm the ack options the server accepted
+        if batch:
+            text += ',"batch":true'
+        if ack_window_ms:
+            text += ',"ack_window":%d' % ack_window_ms
+        return self._text(text + '}')
+
+    def ack(self, count, resume_token=None):
+        if resume_token is None:
+            if count < CACHED_ACKS:
+                return self._acks[count]
+            return self._text('{"count":%d}' % count)
+        return self._text('{"count":%d,"resume_token":"%s"}' % (count, resume_token))
+
+    def bye(self, total):
+        return self._text('{"bye":true,"total":%d}' % total)
+
+    def heartbeat(self, timestamp):
+        iso = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+        return self._text('{"ts":"%s"}' % iso)
+
+    def ping(self, timestamp):
+        return self._text('{"ping":%r}' % float(timestamp))
+
+    def throttle(self, retry_after):
+        return self._text('{"throttled":true,"retry_after":%r}' % round(retry_after, 3))
+
+    def event(self, message):
+        return self._text(dumps(message))
+
+
+class BinaryCodec:
+    """
+    Encodes server frames for the binary subprotocol: a frame type byte followed by
+    fixed-size fields and varints, e.g. an ack for count 300 is 3 bytes instead of the
+    13 of {"count":300}. Frames whose body is at least `compress_threshold` bytes are
+    deflated when that makes them smaller; small frames never are, since deflate only
+    adds overhead to them.
+    """
+    subprotocol = BINARY_SUBPROTOCOL
+
+    def __init__(self, compress_threshold=256, compress_level=6, max_inflated_size=64 * 1024):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.max_inflated_size = max_inflated_size
+
+    def frame(self, frame_type, body=b''):
+        if self.compress_threshold is not None and len(body) >= self.compress_threshold:
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+            compressed = compressor.compress(body) + compressor.flush()
+            if len(compressed) < len(body):
+                return {"type": "websocket.send", "bytes": bytes((frame_type | DEFLATED,)) + compressed}
+        return {"type": "websocket.send", "bytes": bytes((frame_type,)) + body}
+
+    def hello(self, session_uuid, resume_token=None, batch=False, ack_window_ms=0):
+        body = uuid.UUID(session_uuid).bytes + bytes((HELLO_BATCH if batch else 0,)) + encode_varint(ack_window_ms)
+        if resume_token is not None:
+            body += resume_token.encode()
+        return self.frame(HELLO, body)
+
+    def ack(self, count, resume_token=None):
+        body = encode_varint(count)
+        if resume_token is not None:
+            body += resume_token.encode()
+        return self.frame(ACK, body)
+
+    def bye(self, total):
+        return self.frame(BYE, encode_varint(total))
+
+    def heartbeat(self, timestamp):
+        return self.frame(HEARTBEAT, encode_varint(int(timestamp * 1000)))
+
+    def ping(self, timestamp):
+        return self.frame(PING, encode_varint(int(timestamp * 1000)))
+
+    def throttle(self, retry_after):
+        return self.frame(THROTTLE, encode_varint(math.ceil(retry_after * 1000)))
+
+    def event(self, message):
+        return self.frame(EVENT, dumps(message).encode())
+
+    def read(self, data):
+        """
+        Split a binary frame from a client into (frame type, body), inflating the body if
+        needed. Raises ValueError for an empty or corrupt frame, or one that inflates to
+        more than `max_inflated_size` bytes.
+        """
+        if not data:
+            raise ValueError("Empty frame")
+        frame_type, body = data[0], data[1:]
+        if frame_type & DEFLATED:
+            decompressor = zlib.decompressobj(-15)
+            try:
+                body = decompressor.decompress(body, self.max_inflated_size)
+            except zlib.error as e:
+                raise ValueError(f"Corrupt deflated frame: {e}") from None
+            if decompressor.unconsumed_tail:
+                raise ValueError(f"Frame inflates to more than {self.max_inflated_size} bytes")
+        return frame_type & TYPE_MASK, body
+
+
+json_codec = JsonCodec()
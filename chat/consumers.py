@@ -1,45 +1,166 @@
-import json
 import asyncio
-import datetime
+import itertools
 import logging
+import time
 import uuid
 from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.layers import get_channel_layer
+from channels.consumer import get_handler_name
 
+from django.conf import settings
 
-logger = logging.getLogger('__name__')
+from .codec import (
+    BATCH, PONG, PROTOCOL_ERROR_CLOSE_CODE, TYPE_MASK, BinaryCodec, decode_varint, json_codec, loads,
+)
+from .groups import GLOBAL_GROUP, MembershipBatcher, ShardedGroup
+from .heartbeat import HeartbeatEngine
+from .instruments import connect_duration, disconnects, receive_duration, throttled_messages
+from .liveness import PONG_PREFIX, REAPED_CLOSE_CODE, LivenessMonitor
+from .loopmonitor import LoopLagMonitor, SlowCallbackProfiler, current_handler
+from .outbound import OutboundQueue, stats as outbound_stats
+from .ratelimit import RATE_LIMITED_CLOSE_CODE, KeyedTokenBuckets, TokenBucket
+from .registry import connections
+from .resume_tokens import issue_token, read_token
+from .session_store import WriteBehindBuffer, get_session_store, session_key
+from .sharedmetrics import get_shared_metrics
+from .shutdown import SHUTDOWN_CLOSE_CODE, GracefulShutdown
 
-# In-memory store for session data (session_uuid -> message_count)
-session_store = {}  # Dictionary to store session UUIDs and their message counts
-session_store_lock = asyncio.Lock()  # Lock to ensure thread-safe access to the session store
+
+logger = logging.getLogger(__name__)
+
+# Bounded store for session data (session_uuid -> message_count), see settings.CHAT_SESSION_STORE
+session_store = get_session_store()
+# Message counts are written to the store write-behind, on disconnect or every flush interval.
+# Everything runs on a single event loop, so the buffer and the metrics are plain
+# dict updates that never yield and need no locks.
+session_writes = WriteBehindBuffer(
+    session_store,
+    interval=getattr(settings, 'CHAT_SESSION_FLUSH_INTERVAL', 1.0),
+)
+# Optional signed resume tokens, see settings.CHAT_RESUME_TOKENS
+resume_tokens = getattr(settings, 'CHAT_RESUME_TOKENS', {})
+resume_tokens_enabled = resume_tokens.get('ENABLED', False)
+resume_token_max_age = resume_tokens.get('MAX_AGE')
+# Receive records are sampled before they are built, see settings.CHAT_LOG_RECEIVE_SAMPLE_RATE
+receive_log_sample_rate = getattr(settings, 'CHAT_LOG_RECEIVE_SAMPLE_RATE', 1)
+receive_log_counter = itertools.count()
 # Metrics
 metrics = {
     "total_messages": 0,
     "active_connections": 0,
     "error_count": 0
 }
-metrics_lock = asyncio.Lock()
-heartbeat_task_started = False
+# Binary subprotocol clients can negotiate instead of JSON, see settings.CHAT_BINARY
+binary_settings = getattr(settings, 'CHAT_BINARY', {})
+binary_enabled = binary_settings.get('ENABLED', True)
+binary_codec = BinaryCodec(
+    compress_threshold=binary_settings.get('COMPRESS_THRESHOLD', 256),
+    compress_level=binary_settings.get('COMPRESS_LEVEL', 6),
+)
+# Every connection joins one shard of the global broadcast group, see settings.CHAT_BROADCAST
+broadcast_settings = getattr(settings, 'CHAT_BROADCAST', {})
+membership_batch_interval = broadcast_settings.get('BATCH_INTERVAL', 0)
+broadcast_group = ShardedGroup(
+    broadcast_settings.get('GROUP', GLOBAL_GROUP),
+    shards=broadcast_settings.get('SHARDS', 1),
+    batcher=MembershipBatcher(membership_batch_interval) if membership_batch_interval else None,
+)
+shard_by_session = broadcast_settings.get('SHARD_BY', 'session') == 'session'
+# Heartbeats go straight to the consumers registered in this process, see settings.CHAT_HEARTBEAT
+heartbeat_settings = getattr(settings, 'CHAT_HEARTBEAT', {})
+heartbeat = HeartbeatEngine(
+    connections,
+    interval=heartbeat_settings.get('INTERVAL', 30),
+    chunk_size=heartbeat_settings.get('CHUNK_SIZE', 500),
+)
+# Per-connection outbound queue limits and slow-consumer policy, see settings.CHAT_OUTBOUND
+outbound_settings = getattr(settings, 'CHAT_OUTBOUND', {})
+# Negotiable ack options, see settings.CHAT_ACKS
+ack_settings = getattr(settings, 'CHAT_ACKS', {})
+max_ack_window_ms = ack_settings.get('MAX_COALESCE_WINDOW_MS', 0)
+max_batch_size = ack_settings.get('MAX_BATCH_SIZE', 1000)
+# Dead connection detection and reaping, see settings.CHAT_LIVENESS
+liveness_settings = getattr(settings, 'CHAT_LIVENESS', {})
+liveness_enabled = liveness_settings.get('ENABLED', False)
+liveness = LivenessMonitor(
+    connections,
+    interval=liveness_settings.get('INTERVAL', 30),
+    max_missed=liveness_settings.get('MAX_MISSED', 3),
+    jitter=liveness_settings.get('JITTER', 0.2),
+)
+# Inbound message rate limits per session and per worker, see settings.CHAT_RATE_LIMIT
+rate_limit_settings = getattr(settings, 'CHAT_RATE_LIMIT', {})
+rate_limit_enabled = rate_limit_settings.get('ENABLED', False)
+session_rate = rate_limit_settings.get('SESSION_RATE', 50)
+session_limits = (
+    KeyedTokenBuckets(session_rate, rate_limit_settings.get('SESSION_BURST', 100)) if session_rate else None
+)
+worker_rate = rate_limit_settings.get('WORKER_RATE', 0)
+worker_limit = TokenBucket(worker_rate, rate_limit_settings.get('WORKER_BURST') or worker_rate) if worker_rate else None
+close_when_throttled = rate_limit_settings.get('POLICY', 'throttle') == 'close'
+
+loop_monitor_settings = getattr(settings, 'CHAT_LOOP_MONITOR', {})
+loop_monitor_enabled = loop_monitor_settings.get('ENABLED', False)
+loop_monitor = LoopLagMonitor(interval=loop_monitor_settings.get('INTERVAL', 0.5))
+slow_callbacks_enabled = loop_monitor_settings.get('SLOW_CALLBACKS', False)
+slow_callbacks = SlowCallbackProfiler(
+    threshold=loop_monitor_settings.get('SLOW_CALLBACK_THRESHOLD', 0.01),
+    window=loop_monitor_settings.get('SLOW_CALLBACK_WINDOW', 300),
+)
 
-async def heartbeat_broadcast():
+# Set when running under the multi-worker launcher (mywebsite.workers)
+shared_metrics = get_shared_metrics(settings)
+
+
+def worker_metrics():
     """
-    Broadcast a heartbeat message every 30 seconds to all connected clients.
-    This function runs indefinitely and sends a timestamp to the "chat-global" group.
-    It is started when the first client connects.
-    The heartbeat message is used to keep the connection alive and to check the health of the server.
+    This worker's counters and gauges, as published to the other workers through shared_metrics.
     """
-    channel_layer = get_channel_layer()
-    while True:
-        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        await channel_layer.group_send(
-            "chat-global",
-            {
-                "type": "heartbeat_message",
-                "message": {"ts": timestamp}
-            }
-        )
-        await asyncio.sleep(30)
+    store_stats = session_store.stats()
+    return {
+        'total_messages': metrics["total_messages"],
+        'active_connections': metrics["active_connections"],
+        'error_count': metrics["error_count"],
+        'session_store_hits': store_stats["hits"],
+        'session_store_misses': store_stats["misses"],
+        'session_store_evictions': store_stats["evictions"],
+        'session_store_size': store_stats["size"],
+        'heartbeat_send_errors': heartbeat.send_errors,
+        'liveness_pings_sent': liveness.pings_sent,
+        'reaped_connections': liveness.reaped,
+        'liveness_timers': len(liveness.wheel),
+        'outbound_dropped_frames': outbound_stats["dropped"],
+        'outbound_coalesced_heartbeats': outbound_stats["coalesced"],
+        'slow_consumer_disconnects': outbound_stats["slow_consumer_disconnects"],
+    }
+
+
+shutdown_settings = getattr(settings, 'CHAT_SHUTDOWN', {})
+shutdown = GracefulShutdown(
+    connections,
+    deadline=shutdown_settings.get('DEADLINE', 8),
+    batch_size=shutdown_settings.get('BATCH_SIZE', 500),
+    batch_interval=shutdown_settings.get('BATCH_INTERVAL', 0.05),
+)
+
+
+def start_background_tasks():
+    """
+    Start the heartbeat engine and the other per-process background tasks that are enabled.
+    Called on ASGI lifespan startup and again on every connect, for servers without lifespan
+    support; tasks that are already running are left alone.
+    """
+    heartbeat.start()
+    if liveness_enabled:
+        liveness.start()
+    if loop_monitor_enabled:
+        loop_monitor.start()
+    if slow_callbacks_enabled:
+        slow_callbacks.install()
+    if shared_metrics is not None:
+        shared_metrics.start(worker_metrics)
+    session_writes.start()
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     """
@@ -50,115 +171,325 @@ class ChatConsumer(AsyncWebsocketConsumer):
     The consumer uses an in-memory store to keep track of session UUIDs and message counts.
     The session UUID is passed as a query parameter during the WebSocket handshake.
     The consumer also handles graceful disconnection and broadcasts a shutdown message when the server is shutting down.
-    The heartbeat broadcast is started when the first client connects, ensuring that all clients receive periodic updates.
+    The heartbeat engine is started when the first client connects and writes the timestamp to every
+    connection registered in this process, ensuring that all clients receive periodic updates.
+    When liveness tracking is enabled, idle connections are pinged and reaped after missing too many pings.
+    Outbound frames go through a bounded per-connection queue, so a slow client cannot stall the handlers.
+    Joining and leaving the broadcast group are queued and sent to the channel layer in batches
+    (chat.groups.MembershipBatcher), so the handshake does not wait for a channel layer round-trip.
+    Clients can negotiate two ack options in the query string: `batch=1` lets a frame carry a JSON array
+    of messages acknowledged with a single ack, and `ack_window=<ms>` coalesces the acks of messages
+    received within that window into one frame with the latest count. By default every frame is one
+    message and gets its own ack.
+    Inbound messages are rate limited per session and per worker (settings.CHAT_RATE_LIMIT); messages
+    over a limit are neither counted nor acked, and the client gets one throttle frame until a message
+    is accepted again, or is disconnected with code 4429.
+    Clients that ask for the chat.binary.v1 subprotocol get compact binary frames instead of JSON
+    (see chat.codec) and can send binary frames, where a BATCH frame carries its message count.
     """
+    codec = json_codec
+    disconnected = False
+    group_shard = None
+    batch_messages = False
+    ack_window = 0
+    ack_timer = None
+    throttled = False
+
     async def connect(self):
         # This method is called when the WebSocket is handshaking as part of the connection process.
-        logger.info(f'Connecting session on channel {self.channel_name}')
-        global heartbeat_task_started
-        # Parse query string for session_uuid
+        start = time.perf_counter()
+        logger.info('Connecting session on channel %s', self.channel_name,
+                    extra={'event': 'connect', 'channel': self.channel_name})
+        # Parse query string for session_uuid or, when enabled, a signed resume_token
         query_string = self.scope.get("query_string", b"").decode()
         query_params = parse_qs(query_string)
         session_uuid = query_params.get("session_uuid", [None])[0]
+        if session_uuid is not None:
+            # Any spelling uuid.UUID accepts names the same session; only the canonical one is
+            # echoed in the hello, logged and used as a key, so it cannot smuggle in other text
+            try:
+                session_uuid = str(uuid.UUID(session_uuid))
+            except ValueError:
+                session_uuid = None
+        resume_token = query_params.get("resume_token", [None])[0] if resume_tokens_enabled else None
+        self.negotiate_acks(query_params)
+        if binary_enabled and binary_codec.subprotocol in self.scope.get("subprotocols", ()):
+            self.codec = binary_codec
+        self.outbound = OutboundQueue(
+            self.base_send,
+            max_size=outbound_settings.get('MAX_SIZE', 256),
+            policy=outbound_settings.get('POLICY', 'coalesce_heartbeats'),
+            high_water=outbound_settings.get('HIGH_WATER'),
+        )
 
         try:
-            async with session_store_lock:
-                if session_uuid and session_uuid in session_store:
-                    self.message_count = session_store[session_uuid]
-                    self.session_uuid = session_uuid
-                else:
-                    self.session_uuid = str(uuid.uuid4())
-                    self.message_count = 0
-                    session_store[self.session_uuid] = self.message_count
+            # A valid resume token carries the session and its count, so no store lookup is needed
+            resumed = read_token(resume_token, resume_token_max_age) if resume_token else None
+            if resumed is not None:
+                session_uuid, message_count = resumed
+            else:
+                message_count = await session_writes.get(session_uuid) if session_uuid else None
+            if message_count is not None:
+                self.message_count = message_count
+                self.session_uuid = session_uuid
+            else:
+                self.session_uuid = str(uuid.uuid4())
+                self.message_count = 0
+                session_writes.mark(self.session_uuid, self.message_count)
 
-            async with metrics_lock:
-                metrics["active_connections"] += 1
+            metrics["active_connections"] += 1
 
-            await self.channel_layer.group_add("chat-global", self.channel_name)
-            await self.accept()
+            shard_key = self.session_uuid if shard_by_session else self.channel_name
+            self.group_shard = await broadcast_group.add(self.channel_layer, shard_key, self.channel_name)
+            await self.accept(self.codec.subprotocol)
 
-            await self.send(text_data=json.dumps({
-                "session_uuid": self.session_uuid
-            }))
+            resume_token = None
+            if resume_tokens_enabled:
+                self.session_key = session_key(self.session_uuid)
+                resume_token = issue_token(self.session_key, self.message_count)
+            # The hello frame confirms the ack options the server accepted
+            self.outbound.put(self.codec.hello(
+                self.session_uuid, resume_token, self.batch_messages, round(self.ack_window * 1000),
+            ))
 
-            if not heartbeat_task_started:
-                asyncio.create_task(heartbeat_broadcast())
-                heartbeat_task_started = True
+            connections.add(self)
+            if liveness_enabled:
+                liveness.track(self)
+            start_background_tasks()
+            connect_duration.observe(time.perf_counter() - start)
 
         except Exception as e:
-            logger.exception(f"Error during WebSocket connection for session {self.session_uuid}: {e}")
-            async with metrics_lock:
-                metrics["error_count"] += 1
+            logger.exception('Error during WebSocket connection for session %s: %s', self.session_uuid, e,
+                             extra={'event': 'connect', 'session': self.session_uuid, 'channel': self.channel_name})
+            metrics["error_count"] += 1
             raise
 
     async def disconnect(self, close_code):
         """
         This method is called when the WebSocket closes for any reason.
-        It handles the disconnection process, updates the session store with the message count,
+        It handles the disconnection process, flushes the message count to the session store,
         and decrements the active connections metric.
-        If the disconnection is not due to a normal closure (close code 1001),
-        it sends a goodbye message back to the client with the total message count for the session.
+        If the disconnection is not due to the client going away (close code 1001), to a server
+        shutdown or to the connection being reaped as dead, it sends a goodbye message back to the
+        client with the total message count for the session.
+        The cleanup runs only once, since a reaped connection is cleaned up before the server
+        reports the close.
         """
-        logger.info(f'Disconnecting session {self.session_uuid} on channel {self.channel_name} with close code {close_code}')
+        if self.disconnected:
+            return
+        self.disconnected = True
+        disconnects.inc(close_code)
+        logger.info('Disconnecting session %s on channel %s with close code %s',
+                    self.session_uuid, self.channel_name, close_code,
+                    extra={'event': 'disconnect', 'session': self.session_uuid,
+                           'channel': self.channel_name, 'close_code': close_code})
         try:
-            await self.channel_layer.group_discard("chat-global", self.channel_name)
-            async with session_store_lock:
-                session_store[self.session_uuid] = self.message_count
-            async with metrics_lock:
-                metrics["active_connections"] = max(0, metrics["active_connections"] - 1)
-            if close_code != 1001:
-                await self.send(text_data=json.dumps({
-                    "bye": True,
-                    "total": self.message_count
-                }))
+            connections.remove(self)
+            if liveness_enabled:
+                liveness.untrack(self)
+            if self.ack_timer is not None:
+                self.ack_timer.cancel()
+                if close_code != REAPED_CLOSE_CODE:
+                    self.send_ack()
+            if self.group_shard is not None:
+                await broadcast_group.discard(self.channel_layer, self.group_shard, self.channel_name)
+            await session_writes.flush_session(self.session_uuid, self.message_count)
+            metrics["active_connections"] = max(0, metrics["active_connections"] - 1)
+            if close_code not in (1001, SHUTDOWN_CLOSE_CODE, REAPED_CLOSE_CODE):
+                self.outbound.put(self.codec.bye(self.message_count))
+            await self.outbound.flush()
         except Exception as e:
-            logger.exception(f"Error during WebSocket disconnection for session {self.session_uuid}: {e}")
-            async with metrics_lock:
-                metrics["error_count"] += 1
+            logger.exception('Error during WebSocket disconnection for session %s: %s', self.session_uuid, e,
+                             extra={'event': 'disconnect', 'session': self.session_uuid,
+                                    'channel': self.channel_name, 'close_code': close_code})
+            metrics["error_count"] += 1
             raise
 
-    async def receive(self, text_data):
+    async def dispatch(self, message):
+        if slow_callbacks_enabled:
+            # Lets the slow-callback profiler name the handler a slow task step was running
+            current_handler.set(f'{type(self).__name__}.{get_handler_name(message)}')
+        await super().dispatch(message)
+
+    def negotiate_acks(self, query_params):
+        """
+        Apply the ack options requested in the query string.
+        The coalescing window is capped by settings.CHAT_ACKS['MAX_COALESCE_WINDOW_MS'].
+        """
+        self.batch_messages = query_params.get("batch", ["0"])[0] == "1"
+        try:
+            ack_window_ms = int(query_params.get("ack_window", ["0"])[0])
+        except ValueError:
+            ack_window_ms = 0
+        self.ack_window = max(0, min(ack_window_ms, max_ack_window_ms)) / 1000
+
+    def send_ack(self):
+        """
+        Queue an ack carrying the current message count.
+        """
+        self.ack_timer = None
+        resume_token = issue_token(self.session_key, self.message_count) if resume_tokens_enabled else None
+        self.outbound.put(self.codec.ack(self.message_count, resume_token))
+
+    def queue_message(self, message, heartbeat=False):
+        """
+        Put an ASGI message on this connection's outbound queue without waiting for it to be sent.
+        Heartbeats are flagged so the queue can coalesce them.
+        """
+        return self.outbound.put(message, heartbeat=heartbeat)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        """
+        Queue a frame on the outbound queue instead of writing it to the socket inline.
+        """
+        if text_data is not None:
+            self.outbound.put({"type": "websocket.send", "text": text_data})
+        elif bytes_data is not None:
+            self.outbound.put({"type": "websocket.send", "bytes": bytes_data})
+        if close:
+            await self.close(close)
+
+    async def close(self, code=None):
+        """
+        Close the WebSocket from the server end once the frames queued before, such as a
+        final ack or throttle frame, have been sent. Does not wait for them to be sent.
+        """
+        self.outbound.close(None if code is True else code)
+
+    async def receive(self, text_data=None, bytes_data=None):
         """
         This method is called when a message is received from the WebSocket.
-        It increments the message count for the session, updates the session store,
+        It increments the message count for the session, queues the new count for the
+        session store and acknowledges the message with the current count.
+        With batching negotiated a JSON array frame or a binary BATCH frame counts as one message
+        per element, and with an ack window the ack is deferred so that acks within the window are sent as one.
+        A batch of more than max_batch_size messages closes the connection with PROTOCOL_ERROR_CLOSE_CODE.
+        Nothing in this path awaits a lock; the store is updated write-behind.
+        Any frame counts as liveness activity; pong replies to liveness pings are not counted as messages.
         """
-        logger.info(f'Receiving message for session {self.session_uuid} on channel {self.channel_name}')
+        start = time.perf_counter()
+        if liveness_enabled:
+            LivenessMonitor.touch(self)
+            if self.is_pong(text_data, bytes_data):
+                return
         try:
-            self.message_count += 1
-            async with session_store_lock:
-                session_store[self.session_uuid] = self.message_count
-            async with metrics_lock:
-                metrics["total_messages"] += 1
-            await self.send(text_data=json.dumps({
-                "count": self.message_count
-            }))
+            received = 1
+            if self.batch_messages:
+                received = self.batch_size(text_data) if bytes_data is None else self.binary_batch_size(bytes_data)
+                if received > max_batch_size:
+                    logger.warning('Closing session %s for a batch of %d messages', self.session_uuid, received,
+                                   extra={'event': 'protocol_error', 'session': self.session_uuid,
+                                          'channel': self.channel_name})
+                    await self.send(close=PROTOCOL_ERROR_CLOSE_CODE)
+                    return
+            # Checked before logging, so that a flood is not written to the logs as well
+            if rate_limit_enabled and not await self.within_rate_limits(received):
+                return
+            # Unsampled messages never build a record, so they cost a counter increment
+            if (receive_log_sample_rate and logger.isEnabledFor(logging.INFO)
+                    and next(receive_log_counter) % receive_log_sample_rate == 0):
+                logger.info('Receiving message for session %s on channel %s', self.session_uuid, self.channel_name,
+                            extra={'event': 'receive', 'session': self.session_uuid, 'channel': self.channel_name,
+                                   'sampled': True})
+            self.message_count += received
+            session_writes.mark(self.session_uuid, self.message_count)
+            metrics["total_messages"] += received
+            if not self.ack_window:
+                self.send_ack()
+            elif self.ack_timer is None:
+                self.ack_timer = asyncio.get_running_loop().call_later(self.ack_window, self.send_ack)
+            receive_duration.observe(time.perf_counter() - start)
         except Exception as e:
-            logger.exception(f"Error receiving message for session {self.session_uuid} {text_data}: {e} ")
-            async with metrics_lock:
-                metrics["error_count"] += 1
+            logger.exception('Error receiving message for session %s %s: %s', self.session_uuid, text_data, e,
+                             extra={'event': 'receive', 'session': self.session_uuid, 'channel': self.channel_name})
+            metrics["error_count"] += 1
             raise
 
+    async def within_rate_limits(self, received):
+        """
+        Take `received` messages from this session's and this worker's token buckets.
+        Returns False when a limit is exceeded, after sending a throttle frame or closing the
+        connection, depending on the policy; only the first message over the limit in a row does.
+        A batch counts as all of its messages, so one larger than the burst is never accepted.
+        The session bucket is checked first, so a flooding session does not use up the worker's.
+        """
+        # Keyed on the canonical session id, so reconnecting with another spelling gets the same bucket
+        bucket = session_limits.get(self.session_uuid) if session_limits is not None else None
+        if bucket is None or bucket.consume(received):
+            if worker_limit is None or worker_limit.consume(received):
+                self.throttled = False
+                return True
+            if bucket is not None:
+                bucket.tokens += received
+            bucket, limit = worker_limit, 'worker'
+        else:
+            limit = 'session'
+        throttled_messages.inc(limit, received)
+        if not self.throttled:
+            self.throttled = True
+            if close_when_throttled:
+                logger.warning('Closing session %s for exceeding the %s rate limit', self.session_uuid, limit,
+                               extra={'event': 'rate_limit', 'session': self.session_uuid,
+                                      'channel': self.channel_name})
+                await self.send(close=RATE_LIMITED_CLOSE_CODE)
+            else:
+                self.outbound.put(self.codec.throttle(bucket.wait_time(received)))
+        return False
+
+    @staticmethod
+    def is_pong(text_data, bytes_data):
+        if bytes_data is not None:
+            return bool(bytes_data) and bytes_data[0] & TYPE_MASK == PONG
+        return text_data.startswith(PONG_PREFIX)
+
+    @staticmethod
+    def batch_size(text_data):
+        """
+        Number of messages in a batch frame. Frames that are not a valid JSON array count as one message.
+        """
+        if not text_data.startswith("["):
+            return 1
+        try:
+            batch = loads(text_data)
+        except ValueError:
+            return 1
+        return len(batch) if isinstance(batch, list) else 1
+
+    @staticmethod
+    def binary_batch_size(bytes_data):
+        """
+        Number of messages in a binary frame: the count carried by a BATCH frame, one for any other frame.
+        """
+        if not bytes_data or bytes_data[0] & TYPE_MASK != BATCH:
+            return 1
+        try:
+            _, body = binary_codec.read(bytes_data)
+            return decode_varint(body)[0]
+        except ValueError:
+            return 1
+
     async def heartbeat_message(self, event):
         """
-        This method handles heartbeat messages sent to the "chat-global" group.
+        This method handles heartbeat messages broadcast to the global group (broadcast_group.send).
+        Heartbeats from this process are written directly by the heartbeat engine,
+        this handler only serves group heartbeats sent by other processes.
         It sends a timestamp to the client to keep the connection alive and check the health of the server.
         """
         try:
-            await self.send(text_data=json.dumps(event["message"]))
+            self.queue_message(self.codec.event(event["message"]), heartbeat=True)
         except Exception:
-            async with metrics_lock:
-                metrics["error_count"] += 1
+            metrics["error_count"] += 1
             raise
 
     async def shutdown_message(self, event):
         """
-        This method handles shutdown messages sent to the "chat-global" group.
+        This method handles shutdown messages, sent by the graceful shutdown of this process
+        or broadcast to the global group.
         It attempts to close the WebSocket connection gracefully with a code indicating that the server is shutting down.
         If an error occurs during the shutdown process, it increments the error count in the metrics.
         """
         try:
-            await self.close(code=1001)
+            await self.close(code=SHUTDOWN_CLOSE_CODE)
         except Exception:
-            async with metrics_lock:
-                metrics["error_count"] += 1
+            metrics["error_count"] += 1
             raise
@@ -0,0 +1,125 @@
+from .consumers import heartbeat, session_store, shared_metrics, shutdown, worker_metrics
+from .instruments import registry
+from .sharedmetrics import format_value
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# Last rendered payload and the snapshot of values it was rendered from
+_cache = (None, b'')
+
+
+def snapshot(values, store_stats):
+    """
+    Cheap fingerprint of every value on the metrics page, compared between scrapes to
+    tell whether the cached payload is still current.
+    """
+    return (
+        tuple(values.values()),
+        store_stats.get("cache_hits"),
+        tuple(shutdown.timings.values()),
+        shutdown.remaining,
+        heartbeat.last_fanout_duration,
+        registry.state(),
+        shared_metrics.state() if shared_metrics is not None else None,
+    )
+
+
+def render_metrics():
+    """
+    Render the WebSocket metrics in the Prometheus text format, as bytes.
+    This collects metrics from the WebSocket consumer and ASGI application:
+    total messages received, active connections,
+    error counts, session store hit/miss/eviction counters and size, heartbeat fan-out timing,
+    liveness pings, reaped connections and timer wheel size, outbound queue depths and slow-consumer counters,
+    latency histograms for the connect, receive, send, heartbeat and group membership paths,
+    event loop lag,
+    channel layer round trips, timeouts, local fallbacks, replayed memberships and circuit breaker state,
+    disconnect counts per close code, messages throttled per rate limit,
+    and the phase timings and leftover connections of the last graceful shutdown.
+    Under the multi-worker launcher the counters and gauges shared between workers are
+    totals over all workers, followed by a per-worker breakdown; histograms and the other
+    values are those of the worker answering the scrape.
+    The payload is cached and only rendered again once one of the values has changed.
+    """
+    global _cache
+    values = worker_metrics()
+    if shared_metrics is not None and values != shared_metrics.published:
+        shared_metrics.publish(values)
+    store_stats = session_store.stats()
+    key = snapshot(values, store_stats)
+    if _cache[0] == key:
+        return _cache[1]
+
+    if shared_metrics is not None:
+        slots = shared_metrics.read()
+        values = {field: format_value(value) for field, value in shared_metrics.totals(slots).items()}
+
+    prometheus_metrics = (
+        '# HELP websocket_total_messages Total number of WebSocket messages received\n'
+        '# TYPE websocket_total_messages counter\n'
+        f'websocket_total_messages {values["total_messages"]}\n'
+        '# HELP websocket_active_connections Current number of active WebSocket connections\n'
+        '# TYPE websocket_active_connections gauge\n'
+        f'websocket_active_connections {values["active_connections"]}\n'
+        '# HELP websocket_error_count Total number of WebSocket errors\n'
+        '# TYPE websocket_error_count counter\n'
+        f'websocket_error_count {values["error_count"]}\n'
+        '# HELP websocket_shutdown_phase_seconds Time taken by each phase of the last graceful shutdown\n'
+        '# TYPE websocket_shutdown_phase_seconds gauge\n'
+        f'websocket_shutdown_phase_seconds{{phase="broadcast"}} {shutdown.timings["broadcast"]}\n'
+        f'websocket_shutdown_phase_seconds{{phase="drain"}} {shutdown.timings["drain"]}\n'
+        f'websocket_shutdown_phase_seconds{{phase="stop"}} {shutdown.timings["stop"]}\n'
+        '# HELP websocket_shutdown_remaining_connections Connections still open when the last shutdown deadline passed\n'
+        '# TYPE websocket_shutdown_remaining_connections gauge\n'
+        f'websocket_shutdown_remaining_connections {shutdown.remaining}\n'
+        '# HELP websocket_session_store_hits_total Session resume lookups that found the session\n'
+        '# TYPE websocket_session_store_hits_total counter\n'
+        f'websocket_session_store_hits_total {values["session_store_hits"]}\n'
+        '# HELP websocket_session_store_misses_total Session resume lookups that did not find the session\n'
+        '# TYPE websocket_session_store_misses_total counter\n'
+        f'websocket_session_store_misses_total {values["session_store_misses"]}\n'
+        '# HELP websocket_session_store_evictions_total Sessions evicted for exceeding the size limit or idle TTL\n'
+        '# TYPE websocket_session_store_evictions_total counter\n'
+        f'websocket_session_store_evictions_total {values["session_store_evictions"]}\n'
+        '# HELP websocket_session_store_size Current number of sessions held locally by the session store\n'
+        '# TYPE websocket_session_store_size gauge\n'
+        f'websocket_session_store_size {values["session_store_size"]}\n'
+        '# HELP websocket_heartbeat_fanout_seconds Time taken by the last heartbeat fan-out to local connections\n'
+        '# TYPE websocket_heartbeat_fanout_seconds gauge\n'
+        f'websocket_heartbeat_fanout_seconds {heartbeat.last_fanout_duration}\n'
+        '# HELP websocket_heartbeat_send_errors Heartbeats that could not be written to a connection\n'
+        '# TYPE websocket_heartbeat_send_errors counter\n'
+        f'websocket_heartbeat_send_errors {values["heartbeat_send_errors"]}\n'
+        '# HELP websocket_liveness_pings_sent Liveness pings sent to idle connections\n'
+        '# TYPE websocket_liveness_pings_sent counter\n'
+        f'websocket_liveness_pings_sent {values["liveness_pings_sent"]}\n'
+        '# HELP websocket_reaped_connections Connections closed for missing too many liveness pings\n'
+        '# TYPE websocket_reaped_connections counter\n'
+        f'websocket_reaped_connections {values["reaped_connections"]}\n'
+        '# HELP websocket_liveness_timers Connections with a pending timer on the liveness timer wheel\n'
+        '# TYPE websocket_liveness_timers gauge\n'
+        f'websocket_liveness_timers {values["liveness_timers"]}\n'
+        '# HELP websocket_outbound_dropped_frames Outbound frames dropped because a client queue was full\n'
+        '# TYPE websocket_outbound_dropped_frames counter\n'
+        f'websocket_outbound_dropped_frames {values["outbound_dropped_frames"]}\n'
+        '# HELP websocket_outbound_coalesced_heartbeats Queued heartbeats replaced by a newer one\n'
+        '# TYPE websocket_outbound_coalesced_heartbeats counter\n'
+        f'websocket_outbound_coalesced_heartbeats {values["outbound_coalesced_heartbeats"]}\n'
+        '# HELP websocket_slow_consumer_disconnects Connections closed for exceeding the outbound queue high-water mark\n'
+        '# TYPE websocket_slow_consumer_disconnects counter\n'
+        f'websocket_slow_consumer_disconnects {values["slow_consumer_disconnects"]}\n'
+    )
+    # Latency histograms, outbound queue depths and per-close-code disconnect counters
+    prometheus_metrics += registry.render()
+    if shared_metrics is not None:
+        prometheus_metrics += shared_metrics.render(slots)
+    if "cache_hits" in store_stats:
+        prometheus_metrics += (
+            '# HELP websocket_session_store_cache_hits_total Session lookups served from the local read cache\n'
+            '# TYPE websocket_session_store_cache_hits_total counter\n'
+            f'websocket_session_store_cache_hits_total {store_stats["cache_hits"]}\n'
+        )
+    payload = prometheus_metrics.encode()
+    _cache = (key, payload)
+    return payload
@@ -0,0 +1,73 @@
+import json
+
+from django.conf import settings
+
+from .consumers import loop_monitor, shutdown
+from .exposition import CONTENT_TYPE, render_metrics
+
+
+class FastPath:
+    """
+    ASGI application that answers metrics scrapes and health checks itself, without
+    going through Django's middleware and URL resolution, and passes every other
+    request on to `inner`:
+
+    - /chat/metrics/: the Prometheus metrics, as served by chat.views.metrics_view
+    - /healthz: liveness, 200 as long as the event loop gets to answer
+    - /readyz: readiness, 200 when the worker should get new connections and 503 when
+      it is draining for shutdown, turning handshakes away or its event loop lag is over
+      `max_loop_lag` seconds; the body lists the individual checks
+
+    `admission` is the AdmissionControl guarding WebSocket handshakes, if any.
+    max_loop_lag defaults to settings.CHAT_READINESS['MAX_LOOP_LAG'].
+    """
+    def __init__(self, inner, admission=None, max_loop_lag=None):
+        self.inner = inner
+        self.admission = admission
+        readiness_settings = getattr(settings, 'CHAT_READINESS', {})
+        self.max_loop_lag = max_loop_lag if max_loop_lag is not None else readiness_settings.get('MAX_LOOP_LAG', 0.25)
+        self.routes = {
+            '/chat/metrics/': self.metrics,
+            '/healthz': self.healthz,
+            '/readyz': self.readyz,
+        }
+
+    async def __call__(self, scope, receive, send):
+        route = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if route is None:
+            return await self.inner(scope, receive, send)
+        status, content_type, body = route()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", b"no-store"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+    @staticmethod
+    def metrics():
+        return 200, CONTENT_TYPE.encode(), render_metrics()
+
+    @staticmethod
+    def healthz():
+        return 200, b"text/plain", b"ok\n"
+
+    def readiness(self):
+        """
+        Return the readiness checks as a dict of check name to whether it passed.
+        """
+        return {
+            "not_draining": not shutdown.draining,
+            "accepting_connections": self.admission is None or self.admission.accepting,
+            "loop_lag": loop_monitor.last_lag <= self.max_loop_lag,
+        }
+
+    def readyz(self):
+        checks = self.readiness()
+        ready = all(checks.values())
+        body = json.dumps({"ready": ready, "checks": checks, "loop_lag_seconds": loop_monitor.last_lag})
+        return (200 if ready else 503), b"application/json", body.encode()
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import time
+import zlib
+
+from channels_redis.core import RedisChannelLayer
+
+from .instruments import group_add_duration, group_discard_duration, group_members
+
+
+logger = logging.getLogger(__name__)
+
+
+# Group every connection joins, so other processes can broadcast to all of them
+GLOBAL_GROUP = 'chat-global'
+
+
+async def group_add_many(channel_layer, group, channels):
+    """
+    Add several channels to a group. With channels_redis this is one pipelined round-trip
+    (a single ZADD for all of them plus the EXPIRE), other layers get one group_add per
+    channel, run concurrently. A layer can provide its own group_add_many.
+    """
+    if hasattr(channel_layer, 'group_add_many'):
+        await channel_layer.group_add_many(group, channels)
+    elif isinstance(channel_layer, RedisChannelLayer):
+        key = channel_layer._group_key(group)
+        connection = channel_layer.connection(channel_layer.consistent_hash(group))
+        pipe = connection.pipeline(transaction=False)
+        pipe.zadd(key, dict.fromkeys(channels, time.time()))
+        pipe.expire(key, channel_layer.group_expiry)
+        await pipe.execute()
+    else:
+        await asyncio.gather(*(channel_layer.group_add(group, channel) for channel in channels))
+
+
+async def group_discard_many(channel_layer, group, channels):
+    """
+    Remove several channels from a group, in one ZREM with channels_redis.
+    """
+    if hasattr(channel_layer, 'group_discard_many'):
+        await channel_layer.group_discard_many(group, channels)
+    elif isinstance(channel_layer, RedisChannelLayer):
+        connection = channel_layer.connection(channel_layer.consistent_hash(group))
+        await connection.zrem(channel_layer._group_key(group), *channels)
+    else:
+        await asyncio.gather(*(channel_layer.group_discard(group, channel) for channel in channels))
+
+
+class MembershipBatcher:
+    """
+    Queues group membership changes and sends them to the channel layer in batches, so
+    a handshake does not wait for a group_add round-trip and a reconnect wave costs one
+    call per group and tick instead of one per connection.
+
+    Changes are flushed `interval` seconds after the first one is queued, one flush at a
+    time so that an add always reaches the layer before the discard of the same channel.
+    A discard of a channel whose add is still queued cancels both. Failures are logged
+    and the batch dropped; a layer that has to survive outages retries on its own
+    (chat.layers.CircuitBreakerChannelLayer replays its memberships).
+
+    flush() sends everything queued so far and waits for it: a broadcast sent after
+    flush() reaches every member queued before it.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        # (channel layer, group) -> {channel: True to add, False to discard}
+        self.pending = {}
+        self.batches = 0
+        self.errors = 0
+        self._timer = None
+        self._task = None
+
+    def add(self, channel_layer, group, channel):
+        self._queue(channel_layer, group, channel, True)
+
+    def discard(self, channel_layer, group, channel):
+        changes = self.pending.get((channel_layer, group))
+        if changes is not None and changes.get(channel) is True:
+            # The add never reached the layer
+            del changes[channel]
+            return
+        self._queue(channel_layer, group, channel, False)
+
+    def _queue(self, channel_layer, group, channel, add):
+        self.pending.setdefault((channel_layer, group), {})[channel] = add
+        loop = asyncio.get_running_loop()
+        # A timer left behind by a closed event loop never fires
+        if self._timer is None or self._timer[0] is not loop:
+            self._timer = (loop, loop.call_later(self.interval, self._start_flush))
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer[1].cancel()
+            self._timer = None
+        # Flushes run one after the other, each waits for the previous one
+        self._task = asyncio.ensure_future(self._flush_pending(self._running_task()))
+
+    def _running_task(self):
+        task = self._task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            return None
+        return task
+
+    async def flush(self):
+        """
+        Send the queued changes now and wait until every flush in progress has finished.
+        """
+        if self.pending:
+            self._start_flush()
+        task = self._running_task()
+        if task is not None:
+            await task
+
+    async def _flush_pending(self, previous):
+        if previous is not None:
+            await previous
+        pending, self.pending = self.pending, {}
+        calls = []
+        for (channel_layer, group), changes in pending.items():
+            discards = [channel for channel, add in changes.items() if not add]
+            adds = [channel for channel, add in changes.items() if add]
+            if discards:
+                calls.append(self._timed(group_discard_duration, group_discard_many(channel_layer, group, discards)))
+            if adds:
+                calls.append(self._timed(group_add_duration, group_add_many(channel_layer, group, adds)))
+        if not calls:
+            return
+        self.batches += 1
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            self.errors += len(errors)
+            logger.error('Could not apply %s group membership batches: %s', len(errors), errors[0],
+                         extra={'event': 'group_membership'})
+
+    @staticmethod
+    async def _timed(histogram, call):
+        start = time.perf_counter()
+        await call
+        histogram.observe(time.perf_counter() - start)
+
+
+class ShardedGroup:
+    """
+    A broadcast audience split over `shards` channel layer groups named `<name>-<i>`.
+    Each member is assigned to a shard by the crc32 of a stable key (its session UUID or
+    channel name), so every process agrees on the assignment and a resumed session
+    lands in the same shard. No single group key holds the whole audience: with
+    channels_redis each shard is its own sorted set (spread over the hosts when there are
+    several), and send() sends to all shards concurrently instead of making one huge
+    group_send. With a single shard the group is just `name`.
+    Memberships made by this process are counted per shard in `members` and the
+    group_members gauge. With a MembershipBatcher, add() and discard() only queue the
+    change and send() flushes the queue first.
+    """
+    def __init__(self, name=GLOBAL_GROUP, shards=1, batcher=None):
+        if shards < 1:
+            raise ValueError(f"A sharded group needs at least one shard, got {shards}")
+        self.name = name
+        self.shards = shards
+        self.names = [name] if shards == 1 else [f'{name}-{shard}' for shard in range(shards)]
+        self.members = [0] * shards
+        self.batcher = batcher
+
+    def shard(self, key):
+        """
+        Return the shard a member with the given key belongs to.
+        """
+        return zlib.crc32(key.encode()) % self.shards
+
+    def _count(self, shard, change):
+        self.members[shard] += change
+        group_members.set(shard, self.members[shard])
+
+    async def add(self, channel_layer, key, channel_name):
+        """
+        Add a channel to the shard for `key`. Returns the shard, needed to discard it later.
+        """
+        shard = self.shard(key)
+        if self.batcher is not None:
+            self.batcher.add(channel_layer, self.names[shard], channel_name)
+        else:
+            start = time.perf_counter()
+            await channel_layer.group_add(self.names[shard], channel_name)
+            group_add_duration.observe(time.perf_counter() - start)
+        self._count(shard, 1)
+        return shard
+
+    async def discard(self, channel_layer, shard, channel_name):
+        if self.batcher is not None:
+            self.batcher.discard(channel_layer, self.names[shard], channel_name)
+        else:
+            start = time.perf_counter()
+            await channel_layer.group_discard(self.names[shard], channel_name)
+            group_discard_duration.observe(time.perf_counter() - start)
+        self._count(shard, -1)
+
+    async def flush(self):
+        if self.batcher is not None:
+            await self.batcher.flush()
+
+    async def send(self, channel_layer, message):
+        """
+        Send a message to every member, to all shards at once. A shard that fails does
+        not stop the others; the first error is raised once all sends have finished.
+        Queued membership changes are flushed first, so every member added by this process
+        before the call gets the message. Members another process is still batching may
+        miss it, as they would if the broadcast had raced their group_add.
+        """
+        await self.flush()
+        results = await asyncio.gather(
+            *(channel_layer.group_send(name, message) for name in self.names),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+
+from .instruments import heartbeat_fanout_duration
+
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatEngine:
+    """
+    Sends a timestamp heartbeat to every connection registered in this process.
+    The payload is serialized once per tick for each codec in use (JSON or the binary
+    subprotocol) and the same message is queued on each local connection directly, in chunks of `chunk_size` connections with a yield to the
+    event loop between chunks, so the channel layer is not involved at all.
+    start() and stop() manage one background task per process and event loop.
+    """
+    def __init__(self, registry, interval=30, chunk_size=500):
+        self.registry = registry
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.last_fanout_duration = 0.0
+        self.send_errors = 0
+        self._task = None
+
+    @property
+    def running(self):
+        # A task left behind by a closed event loop never finishes, so also check the loop
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    async def tick(self):
+        """
+        Send one heartbeat to every registered connection.
+        """
+        start = time.perf_counter()
+        timestamp = time.time()
+        # One message per codec in use, shared by all connections that use it
+        messages = {}
+        consumers = self.registry.snapshot()
+        for offset in range(0, len(consumers), self.chunk_size):
+            for consumer in consumers[offset:offset + self.chunk_size]:
+                try:
+                    message = messages.get(consumer.codec)
+                    if message is None:
+                        message = messages[consumer.codec] = consumer.codec.heartbeat(timestamp)
+                    consumer.queue_message(message, heartbeat=True)
+                except Exception:
+                    self.send_errors += 1
+                    logger.exception('Error sending heartbeat on channel %s', consumer.channel_name,
+                                     extra={'event': 'heartbeat', 'channel': consumer.channel_name})
+            await asyncio.sleep(0)
+        self.last_fanout_duration = time.perf_counter() - start
+        heartbeat_fanout_duration.observe(self.last_fanout_duration)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.tick()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        # Tasks of an event loop that has already closed died with it
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,203 @@
+from bisect import bisect_left
+
+
+# Upper bounds in seconds for latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """
+    Collects instruments so they can be rendered together in the Prometheus text format.
+    """
+    def __init__(self):
+        self.instruments = []
+
+    def register(self, instrument):
+        self.instruments.append(instrument)
+        return instrument
+
+    def render(self):
+        return ''.join(instrument.render() for instrument in self.instruments)
+
+    def state(self):
+        """
+        Value that changes whenever any registered instrument changes.
+        """
+        return tuple(instrument.state() for instrument in self.instruments)
+
+
+registry = Registry()
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed bucket upper bounds.
+    Counts are kept per bucket in a preallocated list and only summed into
+    cumulative buckets when rendered, so observe() allocates nothing.
+    """
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, register=True):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        if register:
+            registry.register(self)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def state(self):
+        return self.count
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{float(bound)}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class LabeledCounter:
+    """
+    Counter with a single label, e.g. disconnects per close code.
+    """
+    def __init__(self, name, documentation, label, register=True):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.values = {}
+        self.total = 0
+        if register:
+            registry.register(self)
+
+    def inc(self, label_value, amount=1):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+        self.total += amount
+
+    def state(self):
+        return self.total
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} counter',
+        ]
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class LabeledGauge:
+    """
+    Gauge with a single label, e.g. group members per shard.
+    """
+    def __init__(self, name, documentation, label, register=True):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.values = {}
+        self.changes = 0
+        if register:
+            registry.register(self)
+
+    def set(self, label_value, value):
+        self.values[label_value] = value
+        self.changes += 1
+
+    def state(self):
+        return self.changes
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} gauge',
+        ]
+        for label_value, value in sorted(self.values.items(), key=lambda item: str(item[0])):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Hot-path instrumentation shared by the whole process
+connect_duration = Histogram(
+    'websocket_connect_duration_seconds',
+    'Time taken by ChatConsumer.connect, from handshake to hello frame',
+)
+receive_duration = Histogram(
+    'websocket_receive_duration_seconds',
+    'Time taken by ChatConsumer.receive to handle one inbound frame',
+)
+send_duration = Histogram(
+    'websocket_send_duration_seconds',
+    'Time taken to hand one outbound frame to the server',
+)
+heartbeat_fanout_duration = Histogram(
+    'websocket_heartbeat_fanout_duration_seconds',
+    'Time taken to fan a heartbeat out to every local connection',
+)
+group_add_duration = Histogram(
+    'websocket_group_add_duration_seconds',
+    'Round-trip time of channel layer group_add calls, one per batch when membership changes are batched',
+)
+group_discard_duration = Histogram(
+    'websocket_group_discard_duration_seconds',
+    'Round-trip time of channel layer group_discard calls, one per batch when membership changes are batched',
+)
+event_loop_lag = Histogram(
+    'event_loop_lag_seconds',
+    'How late the event loop ran a periodic timer, i.e. how long ready callbacks waited',
+)
+disconnects = LabeledCounter(
+    'websocket_disconnects',
+    'WebSocket disconnections by close code',
+    'code',
+)
+handshakes = LabeledCounter(
+    'websocket_handshakes',
+    'WebSocket handshakes by admission control result',
+    'result',
+)
+throttled_messages = LabeledCounter(
+    'websocket_throttled_messages',
+    'Inbound messages dropped for exceeding a rate limit, by limit',
+    'limit',
+)
+group_members = LabeledGauge(
+    'websocket_group_members',
+    'Connections of this process in each shard of the global broadcast group',
+    'shard',
+)
+channel_layer_round_trip = Histogram(
+    'websocket_channel_layer_round_trip_seconds',
+    'Round-trip time of channel layer calls made through the circuit breaker',
+)
+channel_layer_timeouts = LabeledCounter(
+    'websocket_channel_layer_timeouts',
+    'Channel layer calls that timed out, by operation',
+    'operation',
+)
+channel_layer_fallbacks = LabeledCounter(
+    'websocket_channel_layer_fallbacks',
+    'Channel layer calls served by this process alone because the layer failed or the breaker was open',
+    'operation',
+)
+channel_layer_reconciled = LabeledCounter(
+    'websocket_channel_layer_reconciled',
+    'Group memberships replayed on the channel layer after it recovered, by operation',
+    'operation',
+)
+channel_layer_breaker_state = LabeledGauge(
+    'websocket_channel_layer_breaker_state',
+    'State of the channel layer circuit breaker, 1 for the current state',
+    'state',
+)
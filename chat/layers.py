@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from channels.exceptions import ChannelFull
+from django.utils.module_loading import import_string
+
+from .groups import group_add_many, group_discard_many
+from .instruments import (
+    channel_layer_breaker_state, channel_layer_fallbacks, channel_layer_reconciled, channel_layer_round_trip,
+    channel_layer_timeouts,
+)
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of calls to a dependency. After `failure_threshold`
+    failures in a row the breaker opens and allow() refuses calls for `reset_timeout`
+    seconds. Then it is half-open: one call is let through as a probe, and its success
+    closes the breaker while a failure opens it again. A probe that never reports back
+    is replaced by another one after `reset_timeout` seconds.
+    `on_change` is called with the old and new state on every transition.
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=5.0, on_change=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self._retry_at = 0.0
+
+    def _set_state(self, state):
+        old, self.state = self.state, state
+        if old != state and self.on_change is not None:
+            self.on_change(old, state)
+
+    def allow(self):
+        """
+        Whether a call may go to the dependency now.
+        """
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if now < self._retry_at:
+            return False
+        self._retry_at = now + self.reset_timeout
+        self._set_state(HALF_OPEN)
+        return True
+
+    def retry_in(self):
+        """
+        Seconds until allow() lets a probe through, 0 when the breaker is closed.
+        """
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def success(self):
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._retry_at = time.monotonic() + self.reset_timeout
+            self._set_state(OPEN)
+
+
+class CircuitBreakerChannelLayer:
+    """
+    Channel layer that wraps the layer built from `backend` and `config` (the BACKEND and
+    CONFIG of a CHANNEL_LAYERS entry) so that a slow or failing layer, e.g. Redis being
+    down, degrades the process instead of stalling handshakes or raising in them.
+
+    Every call gets a timeout, `group_send_timeout` for group_send and `timeout` for the
+    others, and goes through a CircuitBreaker. When a call fails, times out or is refused
+    by the open breaker:
+
+    - group_add and group_discard are only applied to the local copy of this process's
+      memberships kept in `groups`, and replayed on the layer once it recovers;
+    - group_send and send deliver to the channels of this process only, straight into
+      the inboxes read by receive(). Other processes miss the message.
+
+    receive() returns locally delivered messages as well as those from the layer, and
+    keeps waiting through layer errors. Anything else is passed through to the wrapped
+    layer. Calls are timed into the channel_layer_* instruments.
+    """
+    def __init__(self, backend, config=None, timeout=1.0, group_send_timeout=5.0, failure_threshold=3,
+                 reset_timeout=5.0, capacity=100, reconcile_batch_size=500):
+        self.layer = import_string(backend)(**(config or {}))
+        self.extensions = getattr(self.layer, 'extensions', [])
+        self.timeout = timeout
+        self.group_send_timeout = group_send_timeout
+        self.capacity = capacity
+        self.reconcile_batch_size = reconcile_batch_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, on_change=self._state_changed)
+        # Group name -> channels of this process in it
+        self.groups = {}
+        # Membership changes that have not reached the layer yet, as (group, channel)
+        self.pending_adds = set()
+        self.pending_discards = set()
+        # Set when the breaker opened: the layer may have lost every membership, e.g. when
+        # Redis was restarted, so all of them are replayed
+        self.resync = False
+        # Channel name -> messages delivered locally, and the receive() waiting on it
+        self.local_channels = set()
+        self.inboxes = {}
+        self._waiters = {}
+        self._receiving = {}
+        self._reconcile_task = None
+        for state in STATES:
+            channel_layer_breaker_state.set(state, int(state == CLOSED))
+
+    def __getattr__(self, name):
+        # Everything not wrapped here (flush, close, valid_group_name, ...) goes to the layer
+        if name == 'layer':
+            raise AttributeError(name)
+        return getattr(self.layer, name)
+
+    def _state_changed(self, old, new):
+        channel_layer_breaker_state.set(old, 0)
+        channel_layer_breaker_state.set(new, 1)
+        if new == OPEN:
+            self.resync = True
+            if old == CLOSED:
+                logger.warning('Channel layer unavailable after %s failures, serving groups locally',
+                               self.breaker.failures, extra={'event': 'channel_layer'})
+        elif new == CLOSED:
+            logger.info('Channel layer recovered', extra={'event': 'channel_layer'})
+
+    def _succeeded(self):
+        self.breaker.success()
+        if self.resync or self.pending_adds or self.pending_discards:
+            self._start_reconcile()
+
+    async def _call(self, operation, call, timeout):
+        """
+        Await `call()` on the layer through the breaker. Returns whether it succeeded.
+        """
+        if not self.breaker.allow():
+            channel_layer_fallbacks.inc(operation)
+            return False
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(call(), timeout)
+        except ChannelFull:
+            # The layer is up, the receiving channel is just not keeping up
+            self.breaker.success()
+            raise
+        except asyncio.TimeoutError:
+            channel_layer_timeouts.inc(operation)
+            self.breaker.failure()
+        except Exception as e:
+            logger.debug('Channel layer %s failed: %s', operation, e, extra={'event': 'channel_layer'})
+            self.breaker.failure()
+        else:
+            channel_layer_round_trip.observe(time.perf_counter() - start)
+            self._succeeded()
+            return True
+        channel_layer_fallbacks.inc(operation)
+        return False
+
+    async def new_channel(self, prefix="specific."):
+        channel = await self.layer.new_channel(prefix)
+        self.local_channels.add(channel)
+        return channel
+
+    async def group_add(self, group, channel):
+        self.groups.setdefault(group, set()).add(channel)
+        self.pending_discards.discard((group, channel))
+        if not await self._call('group_add', lambda: self.layer.group_add(group, channel), self.timeout):
+            self.pending_adds.add((group, channel))
+
+    async def group_discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del self.groups[group]
+        self.pending_adds.discard((group, channel))
+        if not await self._call('group_discard', lambda: self.layer.group_discard(group, channel), self.timeout):
+            self.pending_discards.add((group, channel))
+
+    async def group_add_many(self, group, channels):
+        members = self.groups.setdefault(group, set())
+        members.update(channels)
+        for channel in channels:
+            self.pending_discards.discard((group, channel))
+        if not await self._call('group_add', lambda: group_add_many(self.layer, group, channels), self.timeout):
+            self.pending_adds.update((group, channel) for channel in channels)
+
+    async def group_discard_many(self, group, channels):
+        members = self.groups.get(group)
+        if members is not None:
+            members.difference_update(channels)
+            if not members:
+                del self.groups[group]
+        for channel in channels:
+            self.pending_adds.discard((group, channel))
+        if not await self._call('group_discard', lambda: group_discard_many(self.layer, group, channels), self.timeout):
+            self.pending_discards.update((group, channel) for channel in channels)
+
+    async def group_send(self, group, message):
+        if not await self._call('group_send', lambda: self.layer.group_send(group, message), self.group_send_timeout):
+            for channel in self.groups.get(group, ()):
+                self.deliver(channel, message)
+
+    async def send(self, channel, message):
+        if not await self._call('send', lambda: self.layer.send(channel, message), self.timeout):
+            if channel not in self.local_channels:
+                raise ConnectionError(f"Channel layer unavailable, cannot send to {channel}")
+            self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        """
+        Queue a message for a channel of this process, bypassing the layer.
+        """
+        inbox = self.inboxes.get(channel)
+        if inbox is None:
+            inbox = self.inboxes[channel] = deque(maxlen=self.capacity)
+        inbox.append(message)
+        waiter = self._waiters.get(channel)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def receive(self, channel):
+        """
+        Return the next message for the channel, from its local inbox or from the layer.
+        The layer receive is kept running across calls when a local message wins the race,
+        so no message is lost; it is only cancelled together with the caller.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                inbox = self.inboxes.get(channel)
+                if inbox:
+                    message = inbox.popleft()
+                    if not inbox:
+                        del self.inboxes[channel]
+                    return message
+
+                waiter = self._waiters[channel] = loop.create_future()
+                task = self._receiving.get(channel)
+                retry_in = self.breaker.retry_in() if self.breaker.state == OPEN else 0
+                if task is None and not retry_in:
+                    task = self._receiving[channel] = asyncio.ensure_future(self.layer.receive(channel))
+                try:
+                    if task is None:
+                        # Wait for a local message or until the layer may be tried again
+                        await asyncio.wait({waiter}, timeout=retry_in)
+                        continue
+                    await asyncio.wait({task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    del self._waiters[channel]
+                if not task.done():
+                    continue
+                del self._receiving[channel]
+                try:
+                    message = task.result()
+                except Exception as e:
+                    logger.debug('Channel layer receive failed: %s', e, extra={'event': 'channel_layer'})
+                    self.breaker.failure()
+                    continue
+                self._succeeded()
+                return message
+        except asyncio.CancelledError:
+            # The consumer is done with the channel
+            task = self._receiving.pop(channel, None)
+            if task is not None:
+                task.cancel()
+            self.inboxes.pop(channel, None)
+            self.local_channels.discard(channel)
+            raise
+
+    def _start_reconcile(self):
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = asyncio.ensure_future(self.reconcile())
+
+    async def reconcile(self):
+        """
+        Replay membership changes the layer missed: the pending discards and adds, or
+        every membership of this process after the breaker was open. Re-adding a member
+        is harmless. Stops at the first failure, leaving the rest pending for the next
+        successful call to pick up.
+        """
+        discards, self.pending_discards = self.pending_discards, set()
+        adds, self.pending_adds = self.pending_adds, set()
+        if self.resync:
+            self.resync = False
+            adds = {(group, channel) for group, members in self.groups.items() for channel in members}
+        calls = [('group_discard', group, channel) for group, channel in discards]
+        calls += [('group_add', group, channel) for group, channel in adds]
+        for offset in range(0, len(calls), self.reconcile_batch_size):
+            batch = [
+                (operation, group, channel) for operation, group, channel in calls[offset:offset + self.reconcile_batch_size]
+                # Skip memberships that changed since the replay started
+                if (channel in self.groups.get(group, ())) == (operation == 'group_add')
+            ]
+            results = await asyncio.gather(
+                *(asyncio.wait_for(getattr(self.layer, operation)(group, channel), self.timeout)
+                  for operation, group, channel in batch),
+                return_exceptions=True,
+            )
+            failed = [call for call, result in zip(batch, results) if isinstance(result, Exception)]
+            for operation, _, _ in batch:
+                channel_layer_reconciled.inc(operation)
+            if failed:
+                for operation, group, channel in failed + calls[offset + self.reconcile_batch_size:]:
+                    (self.pending_adds if operation == 'group_add' else self.pending_discards).add((group, channel))
+                self.breaker.failure()
+                return
+        if calls:
+            logger.info('Replayed %s channel layer membership changes', len(calls), extra={'event': 'channel_layer'})
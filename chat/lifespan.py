@@ -0,0 +1,38 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Lifespan:
+    """
+    ASGI application for the lifespan scope: awaits `startup` when the server starts and
+    `shutdown` when it stops, both optional coroutine functions, and reports failures
+    back to the server. Servers that do not speak the lifespan protocol (Daphne) never
+    open this scope, they have to call the same hooks themselves.
+    """
+    def __init__(self, startup=None, shutdown=None):
+        self.startup = startup
+        self.shutdown = shutdown
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if not await self.run(self.startup, "startup", send):
+                    return
+            elif message["type"] == "lifespan.shutdown":
+                await self.run(self.shutdown, "shutdown", send)
+                return
+
+    @staticmethod
+    async def run(hook, phase, send):
+        try:
+            if hook is not None:
+                await hook()
+        except Exception as e:
+            logger.exception('Lifespan %s failed: %s', phase, e, extra={'event': phase})
+            await send({"type": f"lifespan.{phase}.failed", "message": str(e)})
+            return False
+        await send({"type": f"lifespan.{phase}.complete"})
+        return True
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import math
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Close code used for connections that stopped responding to liveness pings
+REAPED_CLOSE_CODE = 4408
+# Clients answer a {"ping": ts} frame with a frame starting with this prefix
+PONG_PREFIX = '{"pong"'
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel with `slots` buckets of `resolution` seconds each.
+    schedule() and cancel() are O(1); advance() only looks at the bucket of the
+    current tick. Timers further away than one revolution stay in their bucket
+    until the tick they are due on comes round.
+    """
+    def __init__(self, resolution=1.0, slots=64):
+        self.resolution = resolution
+        self.slots = slots
+        self.current_tick = 0
+        self._buckets = [{} for _ in range(slots)]
+        self._timers = {}
+
+    def schedule(self, key, delay):
+        """
+        (Re)schedule the timer for `key` to fire after `delay` seconds.
+        """
+        self.cancel(key)
+        due = self.current_tick + max(1, math.ceil(delay / self.resolution))
+        self._buckets[due % self.slots][key] = due
+        self._timers[key] = due
+
+    def cancel(self, key):
+        due = self._timers.pop(key, None)
+        if due is not None:
+            del self._buckets[due % self.slots][key]
+
+    def advance(self):
+        """
+        Move the wheel forward one tick and return the keys whose timers expired.
+        """
+        self.current_tick += 1
+        bucket = self._buckets[self.current_tick % self.slots]
+        expired = [key for key, due in bucket.items() if due <= self.current_tick]
+        for key in expired:
+            del bucket[key]
+            del self._timers[key]
+        return expired
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def __len__(self):
+        return len(self._timers)
+
+
+class LivenessMonitor:
+    """
+    Detects and reaps dead connections.
+    Consumers record their last inbound activity with touch(), which is a single
+    attribute write. Each tracked connection has one timer on the wheel; when it
+    fires, a connection that was active within `interval` is simply rescheduled,
+    an idle one is sent a ping, and one that has missed `max_missed` intervals in a
+    row is closed with REAPED_CLOSE_CODE and has its disconnect cleanup run.
+    Every reschedule adds up to `jitter` * `interval` of random delay so pings do not
+    go out in synchronized bursts.
+    """
+    def __init__(self, registry, interval=30, max_missed=3, jitter=0.2, resolution=1.0):
+        self.registry = registry
+        self.interval = interval
+        self.max_missed = max_missed
+        self.jitter = jitter
+        self.wheel = TimerWheel(resolution=resolution, slots=max(1, math.ceil(interval * (1 + jitter) / resolution)) + 1)
+        self.pings_sent = 0
+        self.reaped = 0
+        self._task = None
+
+    @property
+    def running(self):
+        # A task left behind by a closed event loop never finishes, so also check the loop
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    def _delay(self, base):
+        return base + random.uniform(0, self.jitter * self.interval)
+
+    @staticmethod
+    def touch(consumer):
+        consumer.last_activity = time.monotonic()
+        consumer.missed_pings = 0
+
+    def track(self, consumer):
+        self.touch(consumer)
+        self.wheel.schedule(consumer.channel_name, self._delay(self.interval))
+
+    def untrack(self, consumer):
+        self.wheel.cancel(consumer.channel_name)
+
+    async def check(self, channel_names):
+        """
+        Handle the connections whose timers expired.
+        """
+        now = time.monotonic()
+        # One ping message per codec in use, shared by all connections that use it
+        pings = {}
+        for channel_name in channel_names:
+            consumer = self.registry.get(channel_name)
+            if consumer is None:
+                continue
+            idle = now - consumer.last_activity
+            if idle < self.interval:
+                self.wheel.schedule(channel_name, self._delay(self.interval - idle))
+                continue
+            if consumer.missed_pings >= self.max_missed:
+                await self.reap(consumer)
+                continue
+            consumer.missed_pings += 1
+            try:
+                ping = pings.get(consumer.codec)
+                if ping is None:
+                    ping = pings[consumer.codec] = consumer.codec.ping(time.time())
+                consumer.queue_message(ping)
+                self.pings_sent += 1
+            except Exception:
+                logger.exception('Error sending liveness ping on channel %s', channel_name,
+                                 extra={'event': 'ping', 'channel': channel_name})
+            self.wheel.schedule(channel_name, self._delay(self.interval))
+
+    async def reap(self, consumer):
+        logger.info('Reaping unresponsive session %s on channel %s', consumer.session_uuid, consumer.channel_name,
+                    extra={'event': 'reap', 'session': consumer.session_uuid, 'channel': consumer.channel_name})
+        self.untrack(consumer)
+        self.reaped += 1
+        try:
+            await consumer.close(code=REAPED_CLOSE_CODE)
+        except Exception:
+            logger.exception('Error closing unresponsive channel %s', consumer.channel_name,
+                             extra={'event': 'reap', 'channel': consumer.channel_name})
+        # The peer may never complete the closing handshake, so clean up now. A failure must not
+        # stop check() halfway, the connections after this one are no longer on the wheel
+        try:
+            await consumer.disconnect(REAPED_CLOSE_CODE)
+        except Exception:
+            logger.exception('Error cleaning up unresponsive channel %s', consumer.channel_name,
+                             extra={'event': 'reap', 'channel': consumer.channel_name})
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.wheel.resolution
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+            try:
+                await self.check(self.wheel.advance())
+            except Exception:
+                logger.exception("Error checking connection liveness")
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        # Tasks of an event loop that has already closed died with it
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
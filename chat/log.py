@@ -0,0 +1,82 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Structured fields that consumers attach to records through `extra`
+STRUCTURED_FIELDS = ('event', 'session', 'channel', 'close_code')
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Logging handler that keeps formatting and I/O off the event loop.
+    Records are put on a bounded queue as-is and a background thread formats them
+    and writes them with the wrapped handler (stderr by default). A formatter set on
+    this handler is applied by that thread. If the queue is full the record is
+    dropped and counted rather than blocking the caller.
+    Usable from settings.LOGGING as 'class': 'chat.log.AsyncHandler'.
+    """
+    def __init__(self, handler=None, maxsize=10_000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = handler if handler is not None else logging.StreamHandler()
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Also called by logging.shutdown(), after the listener may already be stopped
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes 1 in N records per event type, where the event type is the `event`
+    field given in `extra`. `rates` maps event types to N; events without a rate
+    are always passed and a rate of 0 drops them all. Warnings and errors are
+    never sampled out, nor are records flagged with `sampled` in `extra`, which
+    were sampled by their caller before they were built.
+    """
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = rates or {}
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'sampled', False):
+            return True
+        event = getattr(record, 'event', None)
+        rate = self.rates.get(event, 1)
+        if rate <= 1:
+            return rate == 1
+        seen = self.seen.get(event, 0)
+        self.seen[event] = seen + 1
+        return seen % rate == 0
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formatter that appends the structured fields present on a record as key=value pairs.
+    """
+    def format(self, record):
+        message = super().format(record)
+        fields = ' '.join(
+            f'{field}={getattr(record, field)}' for field in STRUCTURED_FIELDS if hasattr(record, field)
+        )
+        return f'{message} {fields}' if fields else message
@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+
+from .instruments import event_loop_lag
+
+
+logger = logging.getLogger(__name__)
+
+# Consumer method last dispatched by the current task, e.g. 'ChatConsumer.websocket_receive',
+# set by consumers while the slow-callback profiler is enabled
+current_handler = contextvars.ContextVar('current_handler', default=None)
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a timer, which is how long any ready callback
+    has to wait for the loop while it is busy. Every `interval` seconds the monitor sleeps
+    and records the difference between when it asked to be woken up and when it actually
+    ran in the event_loop_lag histogram.
+    start() and stop() manage one background task per process and event loop.
+    """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task = None
+
+    @property
+    def running(self):
+        # A task left behind by a closed event loop never finishes, so also check the loop
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    def observe(self, lag):
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        event_loop_lag.observe(lag)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, loop.time() - expected))
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        # Tasks of an event loop that has already closed died with it
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def describe_coroutine(coro):
+    """
+    Name a coroutine by what it is awaiting: the innermost consumer method in its await
+    chain if there is one (e.g. 'ChatConsumer.receive'), otherwise the innermost coroutine.
+    """
+    names = []
+    while coro is not None and hasattr(coro, '__qualname__'):
+        names.append(coro.__qualname__)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    if not names:
+        return '<unknown>'
+    consumer_methods = [name for name in names if 'Consumer.' in name]
+    return consumer_methods[-1] if consumer_methods else names[-1]
+
+
+def describe_callback(callback):
+    """
+    Name an event loop callback. Task steps are named after the task's coroutine.
+    """
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        return describe_coroutine(task.get_coro())
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+
+class SlowCallbackProfiler:
+    """
+    Records event loop callbacks that ran for at least `threshold` seconds, such as a
+    coroutine step that blocked the loop, over a rolling window of `window` seconds.
+    Each entry names the callback (for a task step, the innermost consumer method or
+    coroutine it is awaiting in) and the consumer handler the task last dispatched, which
+    is what was running when a handler blocked without awaiting.
+    install() wraps asyncio's Handle._run, which runs every callback and task step of
+    every event loop in the process, and uninstall() puts it back. While it is not
+    installed the profiler costs nothing; while installed it adds two clock reads per
+    callback and only names the slow ones.
+    Only asyncio's own event loops run their callbacks through Handle._run; other loops,
+    such as uvloop's, never call it, so install() refuses to install on them.
+    """
+    def __init__(self, threshold=0.01, window=300, max_entries=1000):
+        self.threshold = threshold
+        self.window = window
+        self.entries = deque(maxlen=max_entries)
+        self._original_run = None
+
+    @property
+    def installed(self):
+        return self._original_run is not None
+
+    def install(self):
+        """
+        Start recording slow callbacks. Returns False, with a warning, when called on an event
+        loop that is not asyncio's own, since the profiler would never see its callbacks.
+        """
+        if self.installed:
+            return True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None and not isinstance(loop, asyncio.BaseEventLoop):
+            logger.warning('The slow callback profiler only works on the asyncio event loop, not on %s.%s',
+                           type(loop).__module__, type(loop).__qualname__)
+            return False
+        original_run = self._original_run = asyncio.events.Handle._run
+        profiler = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            original_run(handle)
+            duration = time.perf_counter() - start
+            if duration >= profiler.threshold:
+                profiler.record(handle, duration)
+
+        asyncio.events.Handle._run = _run
+        return True
+
+    def uninstall(self):
+        if self.installed:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    def record(self, handle, duration):
+        try:
+            name = describe_callback(handle._callback)
+            handler = handle._context.get(current_handler)
+        except Exception:
+            name, handler = '<unknown>', None
+        self.entries.append((time.monotonic(), duration, name, handler))
+
+    def slowest(self, count=20):
+        """
+        Return the `count` slowest callbacks recorded within the window, slowest first.
+        """
+        now = time.monotonic()
+        entries = self.entries
+        while entries and now - entries[0][0] > self.window:
+            entries.popleft()
+        slowest = sorted(entries, key=lambda entry: entry[1], reverse=True)[:count]
+        return [
+            {
+                "name": name,
+                "handler": handler,
+                "duration_ms": round(duration * 1000, 3),
+                "age_seconds": round(now - recorded, 3),
+            }
+            for recorded, duration, name, handler in slowest
+        ]
@@ -1,10 +1,21 @@
 import logging
+import time
 
 from channels.security.websocket import AllowedHostsOriginValidator
 from channels.middleware import BaseMiddleware
+from django.conf import settings
 
+from .codec import dumps
+from .instruments import handshakes
+from .ratelimit import TokenBucket
+from .shutdown import SHUTDOWN_CLOSE_CODE
 
-logger = logging.getLogger('__name__')
+
+logger = logging.getLogger(__name__)
+
+# Close code for handshakes turned away by admission control, the private-range twin of
+# 1013 (try again later), which Daphne does not let applications send.
+OVERLOADED_CLOSE_CODE = 4013
 
 class AllowEmptyOriginValidator(BaseMiddleware):
     """
@@ -14,13 +25,94 @@ class AllowEmptyOriginValidator(BaseMiddleware):
     are still processed, while still validating allowed hosts.
     This middleware should be used in development environments only, as it bypasses origin checks.
     """
+    # __call__ returns the coroutine of the application it wraps instead of awaiting it, so
+    # no frame of this middleware stays alive for as long as each connection is open. The
+    # hint tells asgiref that it is still a single-callable ASGI application.
+    _asgi_single_callable = True
+
     def __init__(self, inner):
         self.inner = inner
         self.allowed_hosts_validator = AllowedHostsOriginValidator(inner)
 
-    async def __call__(self, scope, receive, send):
-        if "headers" in scope:
-            headers = dict(scope["headers"])
-            if b"origin" not in headers:
-                scope["headers"].append((b"origin", b"http://localhost"))
-        return await self.allowed_hosts_validator(scope, receive, send)
+    def __call__(self, scope, receive, send):
+        if "headers" in scope and not any(name == b"origin" for name, _ in scope["headers"]):
+            scope["headers"].append((b"origin", b"http://localhost"))
+        return self.allowed_hosts_validator(scope, receive, send)
+
+
+class AdmissionControl(BaseMiddleware):
+    """
+    Token-bucket admission control for new WebSocket connections of this process.
+    At most `rate` handshakes per second, with bursts of up to `burst`, are passed on to
+    the inner application. The excess is turned away before any consumer work is done:
+    the connection is accepted only to send a {"retry_after": seconds} frame and is then
+    closed with OVERLOADED_CLOSE_CODE.
+    The retry_after hint grows with the number of recently rejected handshakes, up to
+    `max_retry_after`, so that clients backing off with jitter around it spread a
+    reconnect storm over time instead of all coming back at once.
+    Defaults come from settings.CHAT_ADMISSION; a rate of 0 turns admission control off.
+    Once the GracefulShutdown given as `shutdown` is draining, every handshake is turned
+    away the same way, even with admission control off, but closed with SHUTDOWN_CLOSE_CODE
+    and told to retry after the shutdown deadline: a client that was just closed on shutdown
+    would otherwise reconnect to this worker and hold up the drain until the deadline.
+    Like AllowEmptyOriginValidator, __call__ hands back the inner application's coroutine.
+    """
+    _asgi_single_callable = True
+
+    def __init__(self, inner, rate=None, burst=None, max_retry_after=None, enabled=None, shutdown=None,
+                 clock=time.monotonic):
+        self.inner = inner
+        self.shutdown = shutdown
+        admission_settings = getattr(settings, 'CHAT_ADMISSION', {})
+        rate = rate if rate is not None else admission_settings.get('RATE', 200)
+        burst = burst if burst is not None else admission_settings.get('BURST', 400)
+        self.max_retry_after = (
+            max_retry_after if max_retry_after is not None else admission_settings.get('MAX_RETRY_AFTER', 30)
+        )
+        enabled = enabled if enabled is not None else admission_settings.get('ENABLED', True)
+        self.enabled = enabled and rate > 0
+        self.bucket = TokenBucket(rate, burst, clock) if rate > 0 else None
+        self.clock = clock
+        self.backlog = 0.0
+        self.backlog_updated = clock()
+
+    def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            return self.inner(scope, receive, send)
+        if self.shutdown is not None and self.shutdown.draining:
+            handshakes.inc("draining")
+            retry_after = min(self.max_retry_after, self.shutdown.deadline)
+            return self.reject(receive, send, retry_after, SHUTDOWN_CLOSE_CODE)
+        if not self.enabled:
+            return self.inner(scope, receive, send)
+        if self.bucket.consume():
+            handshakes.inc("admitted")
+            return self.inner(scope, receive, send)
+        handshakes.inc("rejected")
+        return self.reject(receive, send, self.retry_after())
+
+    @property
+    def accepting(self):
+        """
+        Whether a handshake arriving now would be admitted.
+        """
+        return not self.enabled or self.bucket.wait_time() == 0
+
+    def retry_after(self):
+        """
+        Seconds a rejected client should wait, counting the clients rejected before it.
+        The backlog of rejected clients drains at the admission rate.
+        """
+        now = self.clock()
+        self.backlog = max(0.0, self.backlog - (now - self.backlog_updated) * self.bucket.rate) + 1
+        self.backlog_updated = now
+        return round(min(self.max_retry_after, self.bucket.wait_time() + self.backlog / self.bucket.rate), 3)
+
+    @staticmethod
+    async def reject(receive, send, retry_after, code=OVERLOADED_CLOSE_CODE):
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        await send({"type": "websocket.send", "text": dumps({"retry_after": retry_after})})
+        await send({"type": "websocket.close", "code": code})
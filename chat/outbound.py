@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from .instruments import Histogram, send_duration
+
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+COALESCE_HEARTBEATS = 'coalesce_heartbeats'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, COALESCE_HEARTBEATS, DISCONNECT)
+
+# Close code used when a client cannot keep up with its outbound frames
+SLOW_CONSUMER_CLOSE_CODE = 4503
+
+# Shared across all connections of the process
+queue_depth = Histogram(
+    'websocket_outbound_queue_depth',
+    'Outbound queue depth per connection, observed on every enqueued frame',
+    (1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+stats = {
+    "dropped": 0,
+    "coalesced": 0,
+    "slow_consumer_disconnects": 0,
+}
+
+
+class OutboundQueue:
+    """
+    Bounded per-connection queue of outbound ASGI messages.
+    put() never blocks: it appends the message and makes sure a writer task is
+    draining the queue, so a slow client only ever delays its own frames.
+    When the queue fills up the configured policy decides what happens:
+
+    - drop_oldest: the oldest queued frame is dropped to make room.
+    - coalesce_heartbeats: a new heartbeat replaces one that is still queued;
+      when full, the oldest frame is dropped as with drop_oldest.
+    - disconnect: once `high_water` frames are queued, pending frames are discarded
+      and the connection is closed with SLOW_CONSUMER_CLOSE_CODE.
+
+    close() queues the close frame behind everything already queued, so a final ack or
+    throttle frame is not overtaken by it, and nothing is queued after it.
+
+    Most connections are idle most of the time, so the deque and the writer task only
+    exist while frames are queued; an empty deque alone is about 600 bytes.
+    """
+    __slots__ = ('send', 'max_size', 'policy', 'high_water', 'closed', '_queue', '_heartbeat', '_writer')
+
+    def __init__(self, send, max_size=256, policy=COALESCE_HEARTBEATS, high_water=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown outbound queue policy: {policy!r}")
+        self.send = send
+        self.max_size = max_size
+        self.policy = policy
+        self.high_water = high_water if high_water is not None else max_size
+        self.closed = False
+        self._queue = None
+        self._heartbeat = None
+        self._writer = None
+
+    def put(self, message, heartbeat=False):
+        """
+        Queue a message for sending. Returns False if it was not queued.
+        """
+        if self.closed:
+            return False
+        queue = self._queue
+        if queue is None:
+            queue = self._queue = deque()
+        if heartbeat and self.policy == COALESCE_HEARTBEATS and self._heartbeat is not None:
+            queue.remove(self._heartbeat)
+            stats["coalesced"] += 1
+        elif self.policy == DISCONNECT and len(queue) >= self.high_water:
+            self._disconnect_slow_consumer()
+            return False
+        elif len(queue) >= self.max_size:
+            dropped = queue.popleft()
+            if dropped is self._heartbeat:
+                self._heartbeat = None
+            stats["dropped"] += 1
+        queue.append(message)
+        if heartbeat:
+            self._heartbeat = message
+        queue_depth.observe(len(queue))
+        self._start_writer()
+        return True
+
+    def close(self, code=None):
+        """
+        Queue a websocket.close message after the queued frames. Returns False if the queue
+        was already closed.
+        """
+        if self.closed:
+            return False
+        if self._queue is None:
+            self._queue = deque()
+        self._queue.append({"type": "websocket.close"} if code is None else {"type": "websocket.close", "code": code})
+        self.closed = True
+        self._start_writer()
+        return True
+
+    def _start_writer(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._drain())
+
+    def _disconnect_slow_consumer(self):
+        stats["slow_consumer_disconnects"] += 1
+        self._queue.clear()
+        self._heartbeat = None
+        self._queue.append({"type": "websocket.close", "code": SLOW_CONSUMER_CLOSE_CODE})
+        self.closed = True
+
+    async def _drain(self):
+        queue = self._queue
+        while queue:
+            message = queue.popleft()
+            if message is self._heartbeat:
+                self._heartbeat = None
+            start = time.perf_counter()
+            try:
+                await self.send(message)
+            except Exception:
+                logger.exception("Error sending queued WebSocket frame")
+            send_duration.observe(time.perf_counter() - start)
+        # Nothing is awaited from here on, so put() cannot add to the queue being dropped
+        self._queue = None
+        self._writer = None
+
+    async def flush(self):
+        """
+        Wait until every queued message has been sent.
+        """
+        if self._writer is not None and not self._writer.done():
+            await self._writer
+
+    def __len__(self):
+        return len(self._queue) if self._queue is not None else 0
@@ -0,0 +1,208 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from itertools import compress
+
+
+KEY_SIZE = 16
+
+# Snapshot header: magic, number of sessions, first log generation not included in the
+# snapshot, and when it was written. The columns that follow use native byte order.
+SNAPSHOT_MAGIC = b'CHATSNP1'
+SNAPSHOT_HEADER = struct.Struct('=8sQQd')
+# Sessions are sorted by key and the index holds where each 2-byte key prefix starts,
+# so a lookup only searches the few keys that share its prefix
+INDEX_SIZE = 1 << 16
+
+# Log frame header: crc32 of the records, number of records, and when they were written
+FRAME = struct.Struct('<IId')
+RECORD = struct.Struct('<16sQ')
+
+
+def snapshot_size(size):
+    return SNAPSHOT_HEADER.size + 4 * (INDEX_SIZE + 1) + size * (KEY_SIZE + 8 + 4)
+
+
+def fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file through mmap.
+    After the header come the prefix index (INDEX_SIZE + 1 uint32), then the keys in sorted
+    order (16 bytes each), their counts (uint64) and last-touched wall-clock times
+    (uint32 seconds). Opening a snapshot only reads its header and find() touches one
+    index entry and a handful of keys, so opening one with millions of sessions costs
+    about as much as opening an empty one.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, self.generation, self.written_at = SNAPSHOT_HEADER.unpack_from(self._map)
+        if magic != SNAPSHOT_MAGIC or len(self._map) != snapshot_size(self.size):
+            self._map.close()
+            raise ValueError(f"{path} is not a valid session snapshot")
+        self.path = path
+        offset = SNAPSHOT_HEADER.size + 4 * (INDEX_SIZE + 1)
+        self._keys_offset = offset
+        offset += self.size * KEY_SIZE
+        view = memoryview(self._map)
+        self._index = view[SNAPSHOT_HEADER.size:self._keys_offset].cast('I')
+        self._counts = view[offset:offset + self.size * 8].cast('Q')
+        offset += self.size * 8
+        self._touched = view[offset:offset + self.size * 4].cast('I')
+        view.release()
+
+    def find(self, key):
+        """
+        Return the position of `key` in the snapshot, or -1 if it is not in it.
+        """
+        prefix = key[0] << 8 | key[1]
+        lo = self._index[prefix]
+        # The keys sharing a prefix are a few hundred bytes, searching them in one go
+        # beats bisecting them one slice at a time
+        bucket = self._map[self._keys_offset + lo * KEY_SIZE:self._keys_offset + self._index[prefix + 1] * KEY_SIZE]
+        position = bucket.find(key)
+        while position > 0 and position % KEY_SIZE:
+            position = bucket.find(key, position + 1)
+        return lo + position // KEY_SIZE if position >= 0 else -1
+
+    def entry(self, position):
+        """
+        Return (count, touched) of the session at `position`.
+        """
+        return self._counts[position], self._touched[position]
+
+    def columns(self):
+        """
+        Return the keys, counts and touched times as three lists, in key order.
+        """
+        base, data = self._keys_offset, self._map
+        keys = [data[start:start + KEY_SIZE] for start in range(base, base + self.size * KEY_SIZE, KEY_SIZE)]
+        return keys, self._counts.tolist(), self._touched.tolist()
+
+    def close(self):
+        self._index.release()
+        self._counts.release()
+        self._touched.release()
+        self._map.close()
+
+
+def write_snapshot(path, keys, counts, touched, generation, written_at):
+    """
+    Write sessions sorted by key to a new snapshot at `path`, replacing any existing one
+    only once the new file is completely on disk. Returns the number of bytes written.
+    """
+    index = array('I', (bisect.bisect_left(keys, prefix.to_bytes(2, 'big')) for prefix in range(INDEX_SIZE)))
+    index.append(len(keys))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(keys), generation, written_at))
+        f.write(index.tobytes())
+        f.write(b''.join(keys))
+        f.write(array('Q', counts).tobytes())
+        f.write(array('I', touched).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path) or '.')
+    return snapshot_size(len(keys))
+
+
+def merge_columns(columns, other):
+    """
+    Merge two sets of (keys, counts, touched) columns that are each sorted by key and
+    share no keys. `other` is expected to be the much shorter one.
+    """
+    keys = columns[0]
+    merged = ([], [], [])
+    start = 0
+    for i, key in enumerate(other[0]):
+        position = bisect.bisect_left(keys, key, start)
+        for out, column, other_column in zip(merged, columns, other):
+            out.extend(column[start:position])
+            out.append(other_column[i])
+        start = position
+    for out, column in zip(merged, columns):
+        out.extend(column[start:])
+    return merged
+
+
+def compact(path, snapshot, shadowed, recent, generation, now, idle_ttl):
+    """
+    Write a new snapshot with the `recent` (key, count, touched) entries and every session
+    of the current `snapshot` that is neither in `shadowed`, superseded by a recent entry
+    nor idle for `idle_ttl` seconds at wall-clock time `now`.
+    Returns the number of bytes written.
+    """
+    recent.sort()
+    columns = tuple(list(column) for column in zip(*recent)) if recent else ([], [], [])
+    if snapshot is not None:
+        keys, counts, touched = snapshot.columns()
+        dropped = shadowed.union(columns[0])
+        keep = [key not in dropped and now - at < idle_ttl for key, at in zip(keys, touched)]
+        carried = tuple(list(compress(column, keep)) for column in (keys, counts, touched))
+        columns = merge_columns(carried, columns)
+    return write_snapshot(path, *columns, generation, now)
+
+
+class SessionLog:
+    """
+    Append-only log of session count updates. Each append() writes one frame holding a
+    batch of (key, count) records and fsyncs it. Frames carry a checksum so a frame cut
+    short by a crash is detected, and read_log() stops at it.
+    Appends from several threads are serialized.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def append(self, records, written_at):
+        """
+        Write `records`, a list of (key, count), as one frame. Returns the bytes written.
+        """
+        payload = b''.join(RECORD.pack(key, count) for key, count in records)
+        frame = FRAME.pack(zlib.crc32(payload), len(records), written_at) + payload
+        with self._lock:
+            self._file.write(frame)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        return len(frame)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_log(path):
+    """
+    Read the frames of a log as a list of (written_at, records), stopping at the first
+    incomplete or corrupt frame, which is truncated away so later appends follow the
+    last good frame.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = []
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        checksum, count, written_at = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        end = start + count * RECORD.size
+        if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            break
+        frames.append((written_at, list(RECORD.iter_unpack(data[start:end]))))
+        offset = end
+    if offset != len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(offset)
+    return frames
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+
+# Close code for connections closed for sending messages over their rate limit, after
+# HTTP 429 Too Many Requests
+RATE_LIMITED_CLOSE_CODE = 4429
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to `burst` tokens and refilled at `rate` tokens per second.
+    The bucket is refilled lazily from the elapsed time whenever it is used, so it needs
+    no background task. `clock` defaults to time.monotonic and can be replaced in tests.
+    `rate` must be positive; callers turn a limit off by not using a bucket at all.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'clock')
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate!r}")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount=1):
+        """
+        Take `amount` tokens if they are available. Returns False, taking nothing, if not.
+        """
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def wait_time(self, amount=1):
+        """
+        Seconds until `amount` tokens will be available.
+        """
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class KeyedTokenBuckets:
+    """
+    One TokenBucket per key, e.g. per session, all with the same `rate` and `burst`.
+    Buckets outlive the connections using them, so a client cannot get a full bucket back
+    by reconnecting. They are kept in least-recently-used order and dropped without any
+    timer: each new bucket first removes up to two of the least recently used ones that
+    have refilled completely (forgetting them loses nothing), and at most `max_size`
+    buckets are kept.
+    """
+    def __init__(self, rate, burst, max_size=100_000, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate!r}")
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.clock = clock
+        self.buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def get(self, key):
+        """
+        Return the bucket for `key`, creating a full one if there is none.
+        """
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            self.buckets.move_to_end(key)
+            return bucket
+        self._sweep()
+        bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, self.clock)
+        return bucket
+
+    def consume(self, key, amount=1):
+        return self.get(key).consume(amount)
+
+    def _sweep(self):
+        for _ in range(2):
+            if not self.buckets:
+                return
+            key, bucket = next(iter(self.buckets.items()))
+            if bucket.wait_time(bucket.burst) > 0:
+                break
+            del self.buckets[key]
+        while len(self.buckets) >= self.max_size:
+            self.buckets.popitem(last=False)
@@ -0,0 +1,36 @@
+class ConnectionRegistry:
+    """
+    Per-process registry of live consumers, keyed by channel name.
+    Lets process-wide tasks such as the heartbeat reach every local connection
+    directly instead of going through the channel layer.
+    """
+    def __init__(self):
+        self._consumers = {}
+
+    def add(self, consumer):
+        self._consumers[consumer.channel_name] = consumer
+
+    def remove(self, consumer):
+        self._consumers.pop(consumer.channel_name, None)
+
+    def get(self, channel_name):
+        return self._consumers.get(channel_name)
+
+    def snapshot(self):
+        """
+        Return the live consumers as a list, safe to iterate while connections come and go.
+        """
+        return list(self._consumers.values())
+
+    def __contains__(self, consumer):
+        return self._consumers.get(consumer.channel_name) is consumer
+
+    def __len__(self):
+        return len(self._consumers)
+
+    def clear(self):
+        self._consumers.clear()
+
+
+# Consumers connected to this process
+connections = ConnectionRegistry()
@@ -0,0 +1,60 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
+import uuid
+
+from django.conf import settings
+
+
+# Token payload: 16-byte session UUID, last acknowledged message count, issue time (unix seconds)
+TOKEN_PAYLOAD = struct.Struct('>16sQI')
+SIGNATURE_SIZE = 16
+KEY_SALT = b'chat.resume_tokens'
+
+_signing_key = None
+
+
+def _key():
+    global _signing_key
+    if _signing_key is None:
+        _signing_key = hashlib.sha256(KEY_SALT + settings.SECRET_KEY.encode()).digest()
+    return _signing_key
+
+
+def _sign(payload):
+    return hmac.new(_key(), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def issue_token(session_uuid, count, issued_at=None):
+    """
+    Build a compact signed resume token for the session.
+    `session_uuid` is the 16-byte form of the session UUID.
+    The token is URL-safe base64 without padding so it can be passed back in the query string.
+    """
+    if issued_at is None:
+        issued_at = int(time.time())
+    payload = TOKEN_PAYLOAD.pack(session_uuid, count, issued_at)
+    return base64.urlsafe_b64encode(payload + _sign(payload)).rstrip(b'=').decode()
+
+
+def read_token(token, max_age=None):
+    """
+    Verify a resume token and return (session_uuid, count), with the session UUID as a string.
+    Returns None if the token is malformed, has a bad signature or is older than `max_age` seconds.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if len(raw) != TOKEN_PAYLOAD.size + SIGNATURE_SIZE:
+        return None
+    payload, signature = raw[:TOKEN_PAYLOAD.size], raw[TOKEN_PAYLOAD.size:]
+    if not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    session_uuid, count, issued_at = TOKEN_PAYLOAD.unpack(payload)
+    if max_age is not None and time.time() - issued_at > max_age:
+        return None
+    return str(uuid.UUID(bytes=session_uuid)), count
@@ -0,0 +1,644 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import redis.asyncio
+from channels_redis.utils import create_pool, decode_hosts
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import persistence
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_STORE = {
+    'BACKEND': 'chat.session_store.InMemorySessionStore',
+    'OPTIONS': {},
+}
+
+# Packed entry layout: the message count lives in the high bits and the
+# last-touched time (whole seconds since the store was created) in the low bits,
+# so each entry is a single int instead of a tuple of two objects.
+_TOUCH_BITS = 32
+_TOUCH_MASK = (1 << _TOUCH_BITS) - 1
+
+
+def session_key(session_uuid):
+    """
+    Normalise a session identifier to its 16-byte UUID form.
+    Accepts a UUID string, a uuid.UUID or the raw 16 bytes.
+    Returns None if the value is not a valid UUID.
+    """
+    if isinstance(session_uuid, bytes) and len(session_uuid) == 16:
+        return session_uuid
+    if isinstance(session_uuid, uuid.UUID):
+        return session_uuid.bytes
+    try:
+        return uuid.UUID(session_uuid).bytes
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class BaseSessionStore:
+    """
+    Base class for session stores mapping a session UUID to its message count.
+    Implementations must keep hit, miss and eviction counters so they can be
+    exposed on the metrics endpoint.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, session_uuid):
+        """
+        Return the message count for the session, or None if it is unknown.
+        """
+        raise NotImplementedError
+
+    async def set(self, session_uuid, count):
+        """
+        Store the message count for the session.
+        Counts only grow, so stores whose writes can complete out of order must keep
+        the higher count rather than the last one written.
+        """
+        raise NotImplementedError
+
+    async def set_many(self, counts):
+        """
+        Store several session counts at once.
+        Backends with a network round-trip should override this to batch the writes.
+        """
+        for session_uuid, count in counts.items():
+            await self.set(session_uuid, count)
+
+    async def sync(self):
+        """
+        Make the writes so far durable. Called after every write-behind flush;
+        stores that persist to disk override it.
+        """
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self),
+        }
+
+
+class InMemorySessionStore(BaseSessionStore):
+    """
+    Process-local session store bounded by size and idle time.
+    Entries are kept in an OrderedDict in least-recently-used order, keyed by the
+    16-byte UUID. Since the order is also the order of last access, expired entries
+    are always at the front, so both LRU and TTL eviction pop from the front in
+    amortized O(1).
+    """
+    def __init__(self, max_size=100_000, idle_ttl=24 * 60 * 60):
+        super().__init__()
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()
+        self._epoch = time.monotonic()
+
+    def _now(self):
+        return int(time.monotonic() - self._epoch)
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            key, packed = next(iter(entries.items()))
+            if now - (packed & _TOUCH_MASK) < self.idle_ttl:
+                break
+            del entries[key]
+            self.evictions += 1
+
+    def _lookup(self, key):
+        now = self._now()
+        self._expire(now)
+        packed = self._entries.get(key)
+        if packed is None:
+            return None
+        self._entries[key] = (packed & ~_TOUCH_MASK) | now
+        self._entries.move_to_end(key)
+        return packed >> _TOUCH_BITS
+
+    def _store(self, key, count):
+        now = self._now()
+        self._expire(now)
+        self._entries[key] = (count << _TOUCH_BITS) | now
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, session_uuid):
+        key = session_key(session_uuid)
+        count = self._lookup(key) if key is not None else None
+        if count is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return count
+
+    async def set(self, session_uuid, count):
+        key = session_key(session_uuid)
+        if key is None:
+            raise ValueError(f"Invalid session UUID: {session_uuid!r}")
+        self._store(key, count)
+
+    def __contains__(self, session_uuid):
+        key = session_key(session_uuid)
+        return key is not None and key in self._entries
+
+    def __getitem__(self, session_uuid):
+        key = session_key(session_uuid)
+        count = self._lookup(key) if key is not None else None
+        if count is None:
+            raise KeyError(session_uuid)
+        return count
+
+    def __setitem__(self, session_uuid, count):
+        key = session_key(session_uuid)
+        if key is None:
+            raise ValueError(f"Invalid session UUID: {session_uuid!r}")
+        self._store(key, count)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class PersistentSessionStore(InMemorySessionStore):
+    """
+    InMemorySessionStore that keeps its sessions across restarts in the `path` directory.
+    Every count written is also buffered for an append-only log, and sync(), called by
+    the write-behind buffer after each flush, appends the buffered counts as one frame
+    and fsyncs it. Once the log holds `compact_after` records, a background compaction
+    writes every live session to a new snapshot sorted by key and starts a new log.
+    On startup the snapshot is memory-mapped rather than loaded: a session that misses
+    the in-memory entries is looked up in it and moved into them, so startup only
+    replays the log, which compaction keeps short, however many sessions were persisted.
+    Snapshot sessions that were moved into memory (or evicted after that) are shadowed
+    so the snapshot is not consulted for them again.
+    `max_size` bounds the in-memory entries only; the snapshot keeps every session until
+    it has been idle for `idle_ttl`. Its size is counted in len() until compaction drops it.
+    """
+    SNAPSHOT_NAME = 'sessions.snapshot'
+    LOG_PREFIX = 'sessions.log.'
+
+    def __init__(self, path, max_size=100_000, idle_ttl=24 * 60 * 60, compact_after=100_000):
+        super().__init__(max_size=max_size, idle_ttl=idle_ttl)
+        # Start the clock idle_ttl early so every restored session has a non-negative touch time
+        self._epoch -= idle_ttl
+        self._wall_epoch = time.time() - (time.monotonic() - self._epoch)
+        self.path = path
+        self.compact_after = compact_after
+        self.updates = 0
+        self.bytes_written = 0
+        self.log_records = 0
+        self.compactions = 0
+        self._unsynced = {}
+        self._snapshot = None
+        self._snapshot_live = 0
+        self._shadowed = set()
+        # Keys that entered the in-memory entries while a compaction is running
+        self._admitted = None
+        self._compaction = None
+        self._clears = 0
+        # One thread writes the log so frames land in the order they were taken
+        self._log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-log')
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _snapshot_path(self):
+        return os.path.join(self.path, self.SNAPSHOT_NAME)
+
+    def _log_path(self, generation):
+        return os.path.join(self.path, f'{self.LOG_PREFIX}{generation}')
+
+    def _log_generations(self):
+        return sorted(
+            int(name[len(self.LOG_PREFIX):]) for name in os.listdir(self.path)
+            if name.startswith(self.LOG_PREFIX) and name[len(self.LOG_PREFIX):].isdigit()
+        )
+
+    def _wall_now(self):
+        return self._wall_epoch + (time.monotonic() - self._epoch)
+
+    def _load(self):
+        generation = 0
+        if os.path.exists(self._snapshot_path()):
+            try:
+                self._snapshot = persistence.Snapshot(self._snapshot_path())
+            except (OSError, ValueError):
+                logger.exception("Ignoring unreadable session snapshot in %s", self.path)
+            else:
+                generation = self._snapshot.generation
+                self._snapshot_live = self._snapshot.size
+        logs = self._log_generations()
+        for log_generation in logs:
+            if log_generation < generation:
+                # Left behind by a compaction that was interrupted after writing the snapshot
+                os.unlink(self._log_path(log_generation))
+            else:
+                self._replay(self._log_path(log_generation))
+        self.generation = max([generation, *logs])
+        self._log = persistence.SessionLog(self._log_path(self.generation))
+
+    def _replay(self, path):
+        now = self._now()
+        entries = self._entries
+        for written_at, records in persistence.read_log(path):
+            touched = int(written_at - self._wall_epoch)
+            self.log_records += len(records)
+            if now - touched >= self.idle_ttl:
+                continue
+            for key, count in records:
+                if key not in entries:
+                    self._admit(key)
+                entries[key] = (count << _TOUCH_BITS) | touched
+                entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def _admit(self, key):
+        """
+        Shadow the snapshot entry of a key that is entering the in-memory entries.
+        Returns its position in the snapshot, or -1.
+        """
+        if self._admitted is not None:
+            self._admitted.add(key)
+        if self._snapshot is None or key in self._shadowed:
+            return -1
+        position = self._snapshot.find(key)
+        if position >= 0:
+            self._shadowed.add(key)
+            self._snapshot_live -= 1
+        return position
+
+    def _restore(self, key):
+        position = self._admit(key)
+        if position < 0:
+            return None
+        count, touched = self._snapshot.entry(position)
+        if self._wall_now() - touched >= self.idle_ttl:
+            self.evictions += 1
+            return None
+        super()._store(key, count)
+        return count
+
+    def _lookup(self, key):
+        count = super()._lookup(key)
+        if count is None and self._snapshot is not None:
+            count = self._restore(key)
+        return count
+
+    def _store(self, key, count):
+        if key not in self._entries:
+            self._admit(key)
+        super()._store(key, count)
+        self._unsynced[key] = count
+        self.updates += 1
+
+    def __contains__(self, session_uuid):
+        key = session_key(session_uuid)
+        if key is None:
+            return False
+        if key in self._entries:
+            return True
+        if self._snapshot is None or key in self._shadowed:
+            return False
+        position = self._snapshot.find(key)
+        return position >= 0 and self._wall_now() - self._snapshot.entry(position)[1] < self.idle_ttl
+
+    def __len__(self):
+        return len(self._entries) + self._snapshot_live
+
+    async def sync(self):
+        if not self._unsynced:
+            return
+        records, self._unsynced = self._unsynced, {}
+        loop = asyncio.get_running_loop()
+        try:
+            written = await loop.run_in_executor(
+                self._log_writer, self._log.append, list(records.items()), self._wall_now())
+        except Exception:
+            # Keep the counts for the next sync, without overwriting newer ones
+            for key, count in records.items():
+                self._unsynced.setdefault(key, count)
+            raise
+        self.bytes_written += written
+        self.log_records += len(records)
+        if self.log_records >= self.compact_after and (self._compaction is None or self._compaction.done()):
+            self._compaction = asyncio.create_task(self._compact_in_background())
+
+    async def _compact_in_background(self):
+        try:
+            await self.compact()
+        except Exception:
+            logger.exception("Error compacting the session log in %s", self.path)
+
+    async def compact(self):
+        """
+        Write every live session to a new snapshot and start a new log.
+        Only copying the in-memory entries runs on the event loop; the snapshot is merged
+        and written in a thread while new counts go to the new log.
+        """
+        if self._admitted is not None:
+            return
+        loop = asyncio.get_running_loop()
+        snapshot, shadowed, clears = self._snapshot, set(self._shadowed), self._clears
+        wall_epoch = self._wall_epoch
+        recent = [
+            (key, packed >> _TOUCH_BITS, int(wall_epoch + (packed & _TOUCH_MASK)))
+            for key, packed in self._entries.items()
+        ]
+        # Everything logged so far is in `recent`, later counts go to the next log
+        old_log = self._log
+        self.generation += 1
+        self._log = persistence.SessionLog(self._log_path(self.generation))
+        self.log_records = 0
+        self._admitted = set()
+        try:
+            written = await loop.run_in_executor(
+                None, persistence.compact, self._snapshot_path(), snapshot, shadowed, recent,
+                self.generation, self._wall_now(), self.idle_ttl,
+            )
+            new_snapshot = persistence.Snapshot(self._snapshot_path())
+        except Exception:
+            self._admitted = None
+            # Both logs stay on disk and are replayed on startup
+            await loop.run_in_executor(self._log_writer, old_log.close)
+            raise
+        admitted, self._admitted = self._admitted, None
+        # Close the old log after any frames still queued for it
+        await loop.run_in_executor(self._log_writer, old_log.close)
+        if clears != self._clears:
+            # The store was cleared while compacting
+            new_snapshot.close()
+            os.unlink(self._snapshot_path())
+            return
+        # Sessions copied from memory are in the snapshot and were shadowed from the start;
+        # so is anything that entered memory from the snapshot while it was being written
+        shadowed = {key for key, _, _ in recent}
+        shadowed.update(key for key in admitted if key not in shadowed and new_snapshot.find(key) >= 0)
+        self._snapshot, self._shadowed = new_snapshot, shadowed
+        self._snapshot_live = new_snapshot.size - len(shadowed)
+        if snapshot is not None:
+            snapshot.close()
+        for generation in self._log_generations():
+            if generation < self.generation:
+                os.unlink(self._log_path(generation))
+        self.bytes_written += written
+        self.compactions += 1
+
+    def stats(self):
+        stats = super().stats()
+        stats["persisted_bytes"] = self.bytes_written
+        stats["compactions"] = self.compactions
+        return stats
+
+    def clear(self):
+        """
+        Forget every session, in memory and on disk.
+        """
+        super().clear()
+        self._clears += 1
+        self._unsynced.clear()
+        self._shadowed = set()
+        self._snapshot_live = 0
+        # A running compaction is still reading the snapshot and closes nothing but its own
+        if self._snapshot is not None and self._admitted is None:
+            self._snapshot.close()
+        self._snapshot = None
+        if os.path.exists(self._snapshot_path()):
+            os.unlink(self._snapshot_path())
+        old_log = self._log
+        self.generation += 1
+        self._log = persistence.SessionLog(self._log_path(self.generation))
+        self.log_records = 0
+        self._log_writer.submit(old_log.close).result()
+        for generation in self._log_generations():
+            if generation < self.generation:
+                os.unlink(self._log_path(generation))
+
+
+class RedisSessionStore(BaseSessionStore):
+    """
+    Session store shared by all workers through Redis.
+    Counts live under `prefix` + the 16-byte session UUID with an idle TTL that is
+    refreshed on every read and write. Connections come from a pool built from the
+    same host configuration as the Redis channel layer, set_many() writes a whole
+    batch in one pipelined round-trip, and a small local read cache serves resumes
+    that reconnect to the same worker shortly after disconnecting.
+    The cache is kept short-lived because another worker may have advanced the
+    count in the meantime.
+    Writes go through SET_MAX_SCRIPT and never lower a count, since a batch from
+    set_many() can reach Redis after a newer count written by set().
+    """
+    # Counts are compared as decimal strings, Lua numbers lose precision above 2**53
+    SET_MAX_SCRIPT = """
+        local current = redis.call('GET', KEYS[1])
+        local count = ARGV[1]
+        if current and (#current > #count or (#current == #count and current > count)) then
+            redis.call('EXPIRE', KEYS[1], ARGV[2])
+            return current
+        end
+        redis.call('SET', KEYS[1], count, 'EX', ARGV[2])
+        return count
+    """
+
+    def __init__(self, hosts=None, prefix='chat:session:', idle_ttl=24 * 60 * 60,
+                 cache_size=10_000, cache_ttl=5, max_connections=None):
+        super().__init__()
+        if hosts is None:
+            hosts = settings.CHANNEL_LAYERS_REDIS['default']['CONFIG']['config']['hosts']
+        host = decode_hosts(hosts)[0]
+        if max_connections is not None:
+            host['max_connections'] = max_connections
+        self.pool = create_pool(host)
+        self.client = redis.asyncio.Redis(connection_pool=self.pool)
+        self.prefix = prefix.encode()
+        self.idle_ttl = idle_ttl
+        self.cache = InMemorySessionStore(max_size=cache_size, idle_ttl=cache_ttl)
+        self.cache_hits = 0
+        self._set_max = self.client.register_script(self.SET_MAX_SCRIPT)
+
+    def _redis_key(self, session_uuid):
+        key = session_key(session_uuid)
+        if key is None:
+            raise ValueError(f"Invalid session UUID: {session_uuid!r}")
+        return key, self.prefix + key
+
+    async def get(self, session_uuid):
+        key = session_key(session_uuid)
+        if key is None:
+            self.misses += 1
+            return None
+        count = self.cache._lookup(key)
+        if count is not None:
+            self.hits += 1
+            self.cache_hits += 1
+            return count
+        value = await self.client.getex(self.prefix + key, ex=self.idle_ttl)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        count = int(value)
+        self.cache._store(key, count)
+        return count
+
+    def _cache_max(self, key, count):
+        # Replies to overlapping writes can also arrive out of order
+        cached = self.cache._lookup(key)
+        if cached is None or cached < count:
+            self.cache._store(key, count)
+
+    async def set(self, session_uuid, count):
+        key, redis_key = self._redis_key(session_uuid)
+        stored = await self._set_max(keys=[redis_key], args=[count, self.idle_ttl])
+        self._cache_max(key, int(stored))
+
+    async def set_many(self, counts):
+        keys = [self._redis_key(session_uuid)[0] for session_uuid in counts]
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, count in zip(keys, counts.values()):
+                await self._set_max(keys=[self.prefix + key], args=[count, self.idle_ttl], client=pipe)
+            stored = await pipe.execute()
+        for key, count in zip(keys, stored):
+            self._cache_max(key, int(count))
+
+    def __len__(self):
+        return len(self.cache)
+
+    def stats(self):
+        stats = super().stats()
+        stats["evictions"] = self.cache.evictions
+        stats["cache_hits"] = self.cache_hits
+        return stats
+
+    async def close(self):
+        await self.client.aclose()
+        await self.pool.disconnect()
+
+
+class WriteBehindBuffer:
+    """
+    Buffers session count updates in front of a session store.
+    mark() is a plain dict write so it can be called for every message without yielding
+    to the event loop; the latest count per session is written to the store in one
+    set_many() call every `interval` seconds, or immediately through flush_session()
+    when a connection closes.
+    Counts being written stay visible to get() in `_in_flight` until the write has
+    finished, so a resume during a flush does not read an older count from the store.
+    """
+    def __init__(self, store, interval=1.0):
+        self.store = store
+        self.interval = interval
+        self._pending = {}
+        self._in_flight = {}
+        self._task = None
+
+    @property
+    def running(self):
+        # A task left behind by a closed event loop never finishes, so also check the loop
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    def mark(self, session_uuid, count):
+        self._pending[session_uuid] = count
+
+    async def get(self, session_uuid):
+        """
+        Return the latest count for the session, preferring a pending unflushed update,
+        then one still being written, over the value in the store.
+        """
+        count = self._pending.get(session_uuid)
+        if count is None:
+            count = self._in_flight.get(session_uuid)
+        if count is not None:
+            return count
+        return await self.store.get(session_uuid)
+
+    def _begin_write(self, counts):
+        in_flight = self._in_flight
+        for session_uuid, count in counts.items():
+            if in_flight.get(session_uuid, -1) < count:
+                in_flight[session_uuid] = count
+
+    def _end_write(self, counts):
+        in_flight = self._in_flight
+        for session_uuid, count in counts.items():
+            # A newer count of the session may still be on its way
+            if in_flight.get(session_uuid) == count:
+                del in_flight[session_uuid]
+
+    async def flush_session(self, session_uuid, count):
+        self._pending.pop(session_uuid, None)
+        written = {session_uuid: count}
+        self._begin_write(written)
+        try:
+            await self.store.set(session_uuid, count)
+        finally:
+            self._end_write(written)
+
+    async def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            self._begin_write(pending)
+            try:
+                await self.store.set_many(pending)
+            except Exception:
+                # Keep the unflushed counts for the next tick, without overwriting newer ones
+                for session_uuid, count in pending.items():
+                    self._pending.setdefault(session_uuid, count)
+                raise
+            finally:
+                self._end_write(pending)
+        # Also covers counts written directly by flush_session() since the last tick
+        await self.store.sync()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error flushing session counts to the session store")
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        # Tasks of an event loop that has already closed died with it
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+        await self.flush()
+
+
+def get_session_store():
+    """
+    Build the session store configured in settings.CHAT_SESSION_STORE.
+    The setting follows the same BACKEND/OPTIONS shape as CHANNEL_LAYERS.
+    """
+    config = getattr(settings, 'CHAT_SESSION_STORE', DEFAULT_SESSION_STORE)
+    backend = import_string(config.get('BACKEND', DEFAULT_SESSION_STORE['BACKEND']))
+    return backend(**config.get('OPTIONS', {}))
@@ -0,0 +1,201 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+
+# Counters and gauges every worker publishes, in slot order
+FIELDS = (
+    'total_messages',
+    'active_connections',
+    'error_count',
+    'session_store_hits',
+    'session_store_misses',
+    'session_store_evictions',
+    'session_store_size',
+    'heartbeat_send_errors',
+    'liveness_pings_sent',
+    'reaped_connections',
+    'liveness_timers',
+    'outbound_dropped_frames',
+    'outbound_coalesced_heartbeats',
+    'slow_consumer_disconnects',
+)
+# Fields that are point-in-time values rather than running totals. Only live workers
+# count towards their totals, a dead worker's open connections are gone with it.
+GAUGES = frozenset(('active_connections', 'session_store_size', 'liveness_timers'))
+
+# Slot layout: sequence number, publish time, pid, then one double per field
+SEQUENCE = struct.Struct('<Q')
+SLOT = struct.Struct(f'<QdQ{len(FIELDS)}d')
+# Slots are padded to whole cache lines so workers never write to the same line
+SLOT_SIZE = -(-SLOT.size // 64) * 64
+
+
+def region_size(workers):
+    return workers * SLOT_SIZE
+
+
+def create_region(path, workers):
+    """
+    Create the zeroed shared file backing `workers` slots. Done once by the launcher.
+    """
+    with open(path, 'wb') as f:
+        f.truncate(region_size(workers))
+
+
+class SharedMetrics:
+    """
+    Counters and gauges of all worker processes in a memory-mapped file shared by them.
+    Each worker owns one fixed-size slot, publishes its own values into it and reads
+    every slot when scraped, so totals and per-worker values come from plain memory
+    reads without asking the other workers for anything.
+    Slots are written under a sequence lock: the sequence number is odd while a write
+    is in progress, and a reader retries if it was odd or changed during its read.
+    start() runs a background task publishing this worker's values every `interval`
+    seconds; a worker whose slot has not been published for `stale_after` seconds is
+    reported as down.
+    A worker restarted into a slot that another process published to carries on from the
+    counters it finds there, so totals and per-worker counters never go backwards.
+    """
+    def __init__(self, path, workers, worker_id, interval=1.0, stale_after=10.0):
+        if not 0 <= worker_id < workers:
+            raise ValueError(f"Worker id {worker_id} out of range for {workers} workers")
+        self.workers = workers
+        self.worker_id = worker_id
+        self.interval = interval
+        self.stale_after = stale_after
+        with open(path, 'r+b') as f:
+            self.region = mmap.mmap(f.fileno(), region_size(workers))
+        self.pid = os.getpid()
+        self.published = None
+        self._task = None
+        published_at, pid, previous = self.read_slot(worker_id)
+        if published_at and pid != self.pid:
+            self.base = {field: value for field, value in previous.items() if field not in GAUGES}
+        else:
+            self.base = {}
+
+    @property
+    def running(self):
+        # A task left behind by a closed event loop never finishes, so also check the loop
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    def publish(self, values):
+        """
+        Write this worker's values, a dict with an entry for every field, to its slot.
+        Counters are written on top of those of the slot's previous process.
+        """
+        self.published = values
+        base = self.base
+        offset = self.worker_id * SLOT_SIZE
+        sequence = SEQUENCE.unpack_from(self.region, offset)[0] | 1
+        SEQUENCE.pack_into(self.region, offset, sequence)
+        SLOT.pack_into(self.region, offset, sequence, time.time(), self.pid,
+                       *(values[field] + base.get(field, 0) for field in FIELDS))
+        SEQUENCE.pack_into(self.region, offset, sequence + 1)
+
+    async def _run(self, collect):
+        while True:
+            self.publish(collect())
+            await asyncio.sleep(self.interval)
+
+    def start(self, collect):
+        """
+        Publish the values returned by `collect` now and then every `interval` seconds.
+        """
+        if not self.running:
+            self._task = asyncio.create_task(self._run(collect))
+
+    async def stop(self):
+        task, self._task = self._task, None
+        # Tasks of an event loop that has already closed died with it
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def read_slot(self, worker_id, retries=100):
+        """
+        Return (published_at, pid, values) for one worker.
+        """
+        offset = worker_id * SLOT_SIZE
+        for _ in range(retries):
+            slot = SLOT.unpack_from(self.region, offset)
+            if not slot[0] & 1 and SEQUENCE.unpack_from(self.region, offset)[0] == slot[0]:
+                break
+        return slot[1], slot[2], dict(zip(FIELDS, slot[3:]))
+
+    def read(self):
+        """
+        Return a list of (worker_id, up, pid, values) for every worker slot.
+        """
+        now = time.time()
+        slots = []
+        for worker_id in range(self.workers):
+            published_at, pid, values = self.read_slot(worker_id)
+            slots.append((worker_id, now - published_at <= self.stale_after, pid, values))
+        return slots
+
+    @staticmethod
+    def totals(slots):
+        totals = dict.fromkeys(FIELDS, 0)
+        for _, up, _, values in slots:
+            for field in FIELDS:
+                if up or field not in GAUGES:
+                    totals[field] += values[field]
+        return totals
+
+    def state(self):
+        """
+        Raw contents of the region, which change whenever any worker publishes.
+        """
+        return self.region[:]
+
+    @staticmethod
+    def render(slots):
+        """
+        Render the per-worker breakdown in the Prometheus text format.
+        """
+        lines = [
+            '# HELP websocket_worker_up Whether the worker process published its metrics recently',
+            '# TYPE websocket_worker_up gauge',
+        ]
+        lines.extend(f'websocket_worker_up{{worker="{worker_id}"}} {int(up)}' for worker_id, up, _, _ in slots)
+        for field in FIELDS:
+            name = f'websocket_worker_{field}'
+            lines.append(f'# HELP {name} Value of {field} in each worker process')
+            lines.append(f'# TYPE {name} {"gauge" if field in GAUGES else "counter"}')
+            lines.extend(f'{name}{{worker="{worker_id}"}} {format_value(values[field])}'
+                         for worker_id, _, _, values in slots)
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def get_shared_metrics(settings):
+    """
+    Open the shared metrics region named by settings.CHAT_WORKERS, or return None when
+    the process was not started by the multi-worker launcher.
+    """
+    workers_settings = getattr(settings, 'CHAT_WORKERS', {})
+    path = workers_settings.get('SHARED_METRICS')
+    if not path:
+        return None
+    return SharedMetrics(
+        path,
+        workers=workers_settings['COUNT'],
+        worker_id=workers_settings['WORKER_ID'],
+        interval=workers_settings.get('PUBLISH_INTERVAL', 1.0),
+        stale_after=workers_settings.get('STALE_AFTER', 10.0),
+    )
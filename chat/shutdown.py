@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to clients when the server shuts down. 1001 (going away) would fit, but
+# Daphne only lets applications close with 1000 or a code from the 3000-4999 range.
+SHUTDOWN_CLOSE_CODE = 4001
+
+PHASES = ('broadcast', 'drain', 'stop')
+
+
+class GracefulShutdown:
+    """
+    Drains the connections of this process when the server shuts down.
+    Shutdown runs in three phases, each timed into `timings`:
+
+    - broadcast: every registered connection is asked to close with SHUTDOWN_CLOSE_CODE, in
+      batches of `batch_size` with `batch_interval` seconds between batches so the burst
+      of close frames written to sockets stays bounded.
+    - drain: waits until the registry is empty, i.e. every client finished its close
+      handshake, or until `deadline` seconds after shutdown started.
+    - stop: runs the given stop callback, e.g. a final flush of pending session writes.
+
+    Connections still open after the deadline are counted in `remaining` and left to
+    the server to cut off. `draining` is set once shutdown has started.
+    """
+    def __init__(self, registry, deadline=8, batch_size=500, batch_interval=0.05, poll_interval=0.05):
+        self.registry = registry
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.poll_interval = poll_interval
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.draining = False
+        self.remaining = 0
+        self.close_errors = 0
+
+    async def close_connections(self):
+        """
+        Ask every registered connection to close, one batch at a time.
+        """
+        consumers = self.registry.snapshot()
+        event = {"type": "shutdown_message", "message": {"reason": "Server is shutting down"}}
+        for offset in range(0, len(consumers), self.batch_size):
+            if offset:
+                await asyncio.sleep(self.batch_interval)
+            results = await asyncio.gather(
+                *(consumer.shutdown_message(event) for consumer in consumers[offset:offset + self.batch_size]),
+                return_exceptions=True,
+            )
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                self.close_errors += len(errors)
+                logger.warning('Could not close %s connections on shutdown: %s', len(errors), errors[0],
+                               extra={'event': 'shutdown'})
+
+    async def drain(self, until):
+        """
+        Wait for the registry to empty out or for the `until` monotonic time to pass.
+        Returns the number of connections still open.
+        """
+        while len(self.registry) and time.monotonic() < until:
+            await asyncio.sleep(min(self.poll_interval, max(0.0, until - time.monotonic())))
+        return len(self.registry)
+
+    async def run(self, stop=None):
+        """
+        Run the broadcast, drain and stop phases, recording how long each one took.
+        `stop` is an optional coroutine function awaited in the last phase.
+        """
+        started = time.monotonic()
+        self.draining = True
+        await self.close_connections()
+        drain_started = time.monotonic()
+        self.timings["broadcast"] = drain_started - started
+
+        self.remaining = await self.drain(started + self.deadline)
+        stop_started = time.monotonic()
+        self.timings["drain"] = stop_started - drain_started
+        if self.remaining:
+            logger.warning('Shutdown deadline of %ss reached with %s connections still open',
+                           self.deadline, self.remaining, extra={'event': 'shutdown'})
+
+        if stop is not None:
+            await stop()
+        self.timings["stop"] = time.monotonic() - stop_started
+        logger.info('Shutdown finished: broadcast %.3fs, drain %.3fs, stop %.3fs',
+                    self.timings["broadcast"], self.timings["drain"], self.timings["stop"],
+                    extra={'event': 'shutdown'})
@@ -1,8 +1,9 @@
 from django.urls import path
 
-from chat.views import ws_chat_view, metrics_view
+from chat.views import ws_chat_view, metrics_view, slow_callbacks_view
 
 urlpatterns = [
     path('ws/', ws_chat_view, name='ws_chat_view'),
     path('metrics/', metrics_view, name='metrics'),
+    path('slow-callbacks/', slow_callbacks_view, name='slow_callbacks'),
 ]
\ No newline at end of file
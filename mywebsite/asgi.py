@@ -1,50 +1,61 @@
 import os
-import asyncio
-import time
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.layers import get_channel_layer
-from chat.middleware import AllowEmptyOriginValidator
-from chat.routing import websocket_urlpatterns
-from daphne.server import Server
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
 
+# Initialise Django before importing the chat app, which reads its settings at import time.
 django_asgi_app = get_asgi_application()
 
-# Metrics for shutdown time
-metrics = {
-    "last_shutdown_time": 0.0
-}
-metrics_lock = asyncio.Lock()
-
-class CustomServer(Server):
-    async def handle(self):
-        try:
-            await super().handle()
-        except (KeyboardInterrupt, SystemExit):
-            await self.graceful_shutdown()
-
-    async def graceful_shutdown(self):
-        start_time = time.time()
-        channel_layer = get_channel_layer()
-        await channel_layer.group_send(
-            "chat-global",
-            {
-                "type": "shutdown_message",
-                "message": {"reason": "Server is shutting down"}
-            }
-        )
-        await asyncio.sleep(8)
-        self.stop()
-        async with metrics_lock:
-            metrics["last_shutdown_time"] = time.time() - start_time
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from chat.consumers import (  # noqa: E402
+    broadcast_group, heartbeat, liveness, loop_monitor, session_writes, shared_metrics, shutdown, slow_callbacks,
+    start_background_tasks, worker_metrics,
+)
+from chat.fastpath import FastPath  # noqa: E402
+from chat.lifespan import Lifespan  # noqa: E402
+from chat.middleware import AdmissionControl, AllowEmptyOriginValidator  # noqa: E402
+from chat.routing import websocket_urlpatterns  # noqa: E402
 
-application = ProtocolTypeRouter({
-    "http": django_asgi_app,
-    "websocket": AllowEmptyOriginValidator(
+
+async def startup():
+    # Start publishing metrics and sending heartbeats before the first client connects,
+    # so that idle workers are reported as up
+    start_background_tasks()
+
+
+async def graceful_shutdown():
+    """
+    Stop the background tasks, drain the WebSocket connections and flush pending session
+    writes, queued group membership changes and this worker's final metrics. Servers call
+    this before closing connections themselves: Daphne from mywebsite.server, others
+    through the lifespan shutdown event.
+    uvicorn closes every connection before lifespan shutdown, so mywebsite.uvicorn_server
+    drains first and only the remaining steps run here.
+    """
+    await heartbeat.stop()
+    await liveness.stop()
+    await loop_monitor.stop()
+    slow_callbacks.uninstall()
+    if shutdown.draining:
+        await session_writes.stop()
+    else:
+        await shutdown.run(stop=session_writes.stop)
+    # Leaves of the drained connections that are still queued
+    await broadcast_group.flush()
+    if shared_metrics is not None:
+        await shared_metrics.stop()
+        shared_metrics.publish(worker_metrics())
+
+websocket_admission = AdmissionControl(
+    AllowEmptyOriginValidator(
         URLRouter(websocket_urlpatterns)
     ),
-})
+    shutdown=shutdown,
+)
 
-application.server_class = CustomServer
+application = ProtocolTypeRouter({
+    "lifespan": Lifespan(startup=startup, shutdown=graceful_shutdown),
+    # Metrics and health checks are answered before Django is reached
+    "http": FastPath(django_asgi_app, admission=websocket_admission),
+    "websocket": websocket_admission,
+})
@@ -0,0 +1,43 @@
+"""
+Runs Daphne with CustomServer so that connections are drained on shutdown.
+Takes the same arguments as the daphne command:
+
+    python -m mywebsite.server -b 0.0.0.0 -p 8000 mywebsite.asgi:application
+"""
+import asyncio
+import logging
+
+from daphne.cli import CommandLineInterface as DaphneCommandLineInterface
+from daphne.server import Server
+from twisted.internet import defer, reactor
+
+from mywebsite.asgi import graceful_shutdown, startup
+
+logger = logging.getLogger(__name__)
+
+
+class CustomServer(Server):
+    """
+    Daphne server that runs the startup and shutdown hooks of mywebsite.asgi, which
+    other servers get through the ASGI lifespan protocol that Daphne does not support.
+    Daphne kills every application instance from a before-shutdown reactor trigger, and
+    the reactor keeps running until the Deferred returned by that trigger fires, so the
+    graceful shutdown runs there first.
+    """
+    def run(self):
+        reactor.callWhenRunning(lambda: asyncio.ensure_future(startup()))
+        super().run()
+
+    def kill_all_applications(self):
+        drained = defer.Deferred.fromFuture(asyncio.ensure_future(graceful_shutdown()))
+        drained.addErrback(lambda failure: logger.error('Graceful shutdown failed: %s', failure.value))
+        drained.addBoth(lambda _: super(CustomServer, self).kill_all_applications())
+        return drained
+
+
+class CommandLineInterface(DaphneCommandLineInterface):
+    server_class = CustomServer
+
+
+if __name__ == "__main__":
+    CommandLineInterface.entrypoint()
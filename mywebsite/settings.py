@@ -77,11 +77,22 @@ WSGI_APPLICATION = 'mywebsite.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# The Redis layer is wrapped in a circuit breaker (chat.layers.CircuitBreakerChannelLayer):
+# calls time out after `timeout` seconds (`group_send_timeout` for group_send), and after
+# `failure_threshold` failures in a row groups are served by each process alone until a
+# call succeeds again, tried every `reset_timeout` seconds; memberships are then replayed.
 CHANNEL_LAYERS_REDIS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'chat.layers.CircuitBreakerChannelLayer',
         'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+            'backend': 'channels_redis.core.RedisChannelLayer',
+            'config': {
+                "hosts": [('127.0.0.1', 6379)],
+            },
+            'timeout': float(os.environ.get('CHAT_CHANNEL_LAYER_TIMEOUT', 1.0)),
+            'group_send_timeout': float(os.environ.get('CHAT_CHANNEL_LAYER_GROUP_SEND_TIMEOUT', 5.0)),
+            'failure_threshold': int(os.environ.get('CHAT_CHANNEL_LAYER_FAILURE_THRESHOLD', 3)),
+            'reset_timeout': float(os.environ.get('CHAT_CHANNEL_LAYER_RESET_TIMEOUT', 5.0)),
         },
     },
 }
@@ -95,6 +106,230 @@ CHANNEL_LAYERS_DEV = {
 
 CHANNEL_LAYERS = CHANNEL_LAYERS_DEV if os.environ.get('TESTING', '1') == '1' else CHANNEL_LAYERS_REDIS
 
+# Session resume store used by chat.consumers.ChatConsumer.
+# max_size bounds the number of sessions kept, idle_ttl (seconds) drops sessions
+# that have not been touched for that long.
+CHAT_SESSION_STORE_DEV = {
+    'BACKEND': 'chat.session_store.InMemorySessionStore',
+    'OPTIONS': {
+        'max_size': int(os.environ.get('CHAT_SESSION_STORE_MAX_SIZE', 100_000)),
+        'idle_ttl': int(os.environ.get('CHAT_SESSION_STORE_IDLE_TTL', 24 * 60 * 60)),
+    },
+}
+
+# Shared by all workers so a session can resume on any of them. Uses the same
+# Redis hosts as CHANNEL_LAYERS_REDIS; cache_size/cache_ttl bound the local read cache.
+CHAT_SESSION_STORE_REDIS = {
+    'BACKEND': 'chat.session_store.RedisSessionStore',
+    'OPTIONS': {
+        'hosts': CHANNEL_LAYERS_REDIS['default']['CONFIG']['config']['hosts'],
+        'idle_ttl': int(os.environ.get('CHAT_SESSION_STORE_IDLE_TTL', 24 * 60 * 60)),
+        'cache_size': 10_000,
+        'cache_ttl': 5,
+    },
+}
+
+# Process-local like the dev store, but kept on disk under CHAT_SESSION_STORE_PATH (one
+# directory per worker) so counts survive restarts. Takes precedence over the other two
+# when the path is set. compact_after is the number of log records that triggers compaction.
+CHAT_SESSION_STORE_PERSISTENT = {
+    'BACKEND': 'chat.session_store.PersistentSessionStore',
+    'OPTIONS': {
+        **CHAT_SESSION_STORE_DEV['OPTIONS'],
+        'path': os.path.join(
+            os.environ.get('CHAT_SESSION_STORE_PATH', ''),
+            f"worker-{os.environ.get('CHAT_WORKER_ID', '0')}",
+        ),
+        'compact_after': int(os.environ.get('CHAT_SESSION_STORE_COMPACT_AFTER', 100_000)),
+    },
+}
+
+if os.environ.get('CHAT_SESSION_STORE_PATH'):
+    CHAT_SESSION_STORE = CHAT_SESSION_STORE_PERSISTENT
+else:
+    CHAT_SESSION_STORE = CHAT_SESSION_STORE_DEV if os.environ.get('TESTING', '1') == '1' else CHAT_SESSION_STORE_REDIS
+# Signed resume tokens: when enabled the hello frame and every ack carry a resume_token
+# that any worker can verify to resume the session without a session store lookup.
+# MAX_AGE (seconds) bounds how long a token stays valid.
+CHAT_RESUME_TOKENS = {
+    'ENABLED': os.environ.get('CHAT_RESUME_TOKENS', '0') == '1',
+    'MAX_AGE': 24 * 60 * 60,
+}
+
+# Binary subprotocol (chat.binary.v1) clients can negotiate instead of JSON frames. Frame bodies
+# of at least COMPRESS_THRESHOLD bytes are deflated at COMPRESS_LEVEL when that makes them smaller.
+CHAT_BINARY = {
+    'ENABLED': os.environ.get('CHAT_BINARY', '1') == '1',
+    'COMPRESS_THRESHOLD': int(os.environ.get('CHAT_BINARY_COMPRESS_THRESHOLD', 256)),
+    'COMPRESS_LEVEL': 6,
+}
+
+# Global broadcast group every connection joins, split into SHARDS groups named GROUP-<i>
+# (just GROUP with one shard). SHARD_BY picks the key members are assigned by: 'session'
+# (the session UUID) or 'channel' (the channel name). Joins and leaves are queued and sent
+# to the channel layer in one batch per group every BATCH_INTERVAL seconds (0 sends each
+# one from the handshake as it happens).
+CHAT_BROADCAST = {
+    'GROUP': 'chat-global',
+    'SHARDS': int(os.environ.get('CHAT_BROADCAST_SHARDS', 16)),
+    'SHARD_BY': os.environ.get('CHAT_BROADCAST_SHARD_BY', 'session'),
+    'BATCH_INTERVAL': float(os.environ.get('CHAT_BROADCAST_BATCH_INTERVAL', 0.005)),
+}
+
+# Heartbeat sent to every connection of a worker: INTERVAL in seconds, CHUNK_SIZE is the
+# number of sockets written before yielding back to the event loop.
+CHAT_HEARTBEAT = {
+    'INTERVAL': float(os.environ.get('CHAT_HEARTBEAT_INTERVAL', 30)),
+    'CHUNK_SIZE': 500,
+}
+
+# Per-connection outbound queue: at most MAX_SIZE frames are buffered for a client.
+# POLICY is one of 'drop_oldest' (drop the oldest frame when full), 'coalesce_heartbeats'
+# (a new heartbeat replaces a queued one, otherwise drop oldest) or 'disconnect' (close the
+# connection with code 4503 once HIGH_WATER frames are queued).
+CHAT_OUTBOUND = {
+    'MAX_SIZE': 256,
+    'POLICY': os.environ.get('CHAT_OUTBOUND_POLICY', 'coalesce_heartbeats'),
+    'HIGH_WATER': 192,
+}
+
+# Ack options clients can negotiate with ?batch=1 and ?ack_window=<ms>; the requested
+# coalescing window is capped at MAX_COALESCE_WINDOW_MS (0 disables coalescing).
+# A batch frame carrying more than MAX_BATCH_SIZE messages closes the connection with code 4400.
+CHAT_ACKS = {
+    'MAX_COALESCE_WINDOW_MS': 200,
+    'MAX_BATCH_SIZE': 1000,
+}
+
+# Dead connection reaping: a connection with no inbound frame for INTERVAL seconds is sent
+# a {"ping": ts} frame (clients reply with {"pong": ts}); after MAX_MISSED unanswered pings it
+# is closed with code 4408. JITTER spreads pings over an extra fraction of the interval.
+# Off unless CHAT_LIVENESS=1: clients that only listen and do not answer pings would be reaped.
+CHAT_LIVENESS = {
+    'ENABLED': os.environ.get('CHAT_LIVENESS', '0') == '1',
+    'INTERVAL': 30,
+    'MAX_MISSED': 3,
+    'JITTER': 0.2,
+}
+
+# Handshake admission control per worker: at most RATE new connections per second with bursts
+# of up to BURST; the excess gets a {"retry_after": seconds} frame (at most MAX_RETRY_AFTER)
+# and is closed with code 4013. A RATE of 0 turns admission control off, like CHAT_ADMISSION=0.
+CHAT_ADMISSION = {
+    'ENABLED': os.environ.get('CHAT_ADMISSION', '1') == '1',
+    'RATE': float(os.environ.get('CHAT_ADMISSION_RATE', 200)),
+    'BURST': int(os.environ.get('CHAT_ADMISSION_BURST', 400)),
+    'MAX_RETRY_AFTER': 30,
+}
+
+# Inbound message rate limits: each session may send SESSION_RATE messages per second with
+# bursts of up to SESSION_BURST (the limit is kept across reconnects), and each worker accepts
+# WORKER_RATE messages per second with bursts of WORKER_BURST over all its connections (a rate
+# of 0 turns that limit off). With POLICY 'throttle' messages over a limit are dropped without an ack
+# and the client is sent a {"throttled": true, "retry_after": seconds} frame; with 'close' the
+# connection is closed with code 4429.
+CHAT_RATE_LIMIT = {
+    'ENABLED': os.environ.get('CHAT_RATE_LIMIT', '1') == '1',
+    'SESSION_RATE': float(os.environ.get('CHAT_RATE_LIMIT_SESSION_RATE', 50)),
+    'SESSION_BURST': int(os.environ.get('CHAT_RATE_LIMIT_SESSION_BURST', 100)),
+    'WORKER_RATE': float(os.environ.get('CHAT_RATE_LIMIT_WORKER_RATE', 0)),
+    'WORKER_BURST': int(os.environ.get('CHAT_RATE_LIMIT_WORKER_BURST', 0)),
+    'POLICY': os.environ.get('CHAT_RATE_LIMIT_POLICY', 'throttle'),
+}
+
+# Memory an idle WebSocket connection may keep allocated in a worker, in bytes, checked by
+# tests/test_memory.py and python -m benchmarks.bench_memory: CONNECTION for everything
+# allocated for it in the process (the consumer, channel layer queue and group membership,
+# session store entry, ...), CONSUMER for the part allocated by the chat code.
+CHAT_MEMORY_BUDGET = {
+    'CONNECTION': 12 * 1024,
+    'CONSUMER': 1536,
+}
+
+# Event loop monitoring: every INTERVAL seconds the lag of the event loop is measured and
+# exported as a histogram. With SLOW_CALLBACKS on, callbacks and coroutine steps that run for
+# SLOW_CALLBACK_THRESHOLD seconds or more are recorded over a rolling SLOW_CALLBACK_WINDOW
+# (seconds) and listed at /chat/slow-callbacks/. Both are off with no overhead when disabled.
+CHAT_LOOP_MONITOR = {
+    'ENABLED': os.environ.get('CHAT_LOOP_MONITOR', '1') == '1',
+    'INTERVAL': 0.5,
+    'SLOW_CALLBACKS': os.environ.get('CHAT_SLOW_CALLBACKS', '0') == '1',
+    'SLOW_CALLBACK_THRESHOLD': float(os.environ.get('CHAT_SLOW_CALLBACK_THRESHOLD', 0.01)),
+    'SLOW_CALLBACK_WINDOW': 300,
+}
+
+# Readiness (/readyz) fails while the worker drains for shutdown, turns handshakes away, or
+# its event loop lag is above MAX_LOOP_LAG seconds.
+CHAT_READINESS = {
+    'MAX_LOOP_LAG': float(os.environ.get('CHAT_READINESS_MAX_LOOP_LAG', 0.25)),
+}
+
+# Set by the multi-worker launcher (python -m mywebsite.workers) for each worker process:
+# SHARED_METRICS is the memory-mapped file the workers publish their counters and gauges to,
+# every PUBLISH_INTERVAL seconds, and a worker that has not published for STALE_AFTER seconds
+# is reported as down.
+CHAT_WORKERS = {
+    'SHARED_METRICS': os.environ.get('CHAT_METRICS_SHM'),
+    'COUNT': int(os.environ.get('CHAT_WORKER_COUNT', 1)),
+    'WORKER_ID': int(os.environ.get('CHAT_WORKER_ID', 0)),
+    'PUBLISH_INTERVAL': 1.0,
+    'STALE_AFTER': 10.0,
+}
+
+# Graceful shutdown: connections are closed with code 4001 in batches of BATCH_SIZE,
+# BATCH_INTERVAL seconds apart, and shutdown waits up to DEADLINE seconds for them to finish
+# closing before the server cuts off the rest.
+CHAT_SHUTDOWN = {
+    'DEADLINE': float(os.environ.get('CHAT_SHUTDOWN_DEADLINE', 8)),
+    'BATCH_SIZE': 500,
+    'BATCH_INTERVAL': 0.05,
+}
+
+# Seconds between write-behind flushes of message counts to the session store.
+CHAT_SESSION_FLUSH_INTERVAL = float(os.environ.get('CHAT_SESSION_FLUSH_INTERVAL', 1.0))
+
+# Per-message receive records kept by ChatConsumer.receive: 1 in N, sampled before the record
+# is built so that the others cost nothing (0 drops them all).
+CHAT_LOG_RECEIVE_SAMPLE_RATE = int(os.environ.get('CHAT_LOG_RECEIVE_SAMPLE_RATE', 100))
+
+# Logging for the chat app. Records are handed to a background thread by chat.log.AsyncHandler
+# so formatting and I/O stay off the event loop, and chat.log.SamplingFilter keeps 1 in N
+# records per event type (warnings and errors are always kept). Receive records are sampled at
+# the call site already, see CHAT_LOG_RECEIVE_SAMPLE_RATE; the filter is the fallback for
+# records that were not.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'chat.log.SamplingFilter',
+            'rates': {
+                'receive': CHAT_LOG_RECEIVE_SAMPLE_RATE,
+            },
+        },
+    },
+    'formatters': {
+        'structured': {
+            '()': 'chat.log.StructuredFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'async_console': {
+            'class': 'chat.log.AsyncHandler',
+            'filters': ['sampling'],
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['async_console'],
+            'level': os.environ.get('CHAT_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
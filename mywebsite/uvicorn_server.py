@@ -0,0 +1,74 @@
+"""
+Runs the application under uvicorn, by default with the uvloop event loop, the httptools
+HTTP parser and the wsproto WebSocket implementation, and drains connections on shutdown.
+
+    python -m mywebsite.uvicorn_server -b 0.0.0.0 -p 8000 mywebsite.asgi:application
+
+Startup and shutdown hooks run through the ASGI lifespan protocol (mywebsite.asgi). Takes
+the -b, -p and --fd arguments of daphne, so it can also be started by mywebsite.workers
+with `--server uvicorn`.
+"""
+import argparse
+import logging
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that drains WebSocket connections before exiting.
+    uvicorn closes every open WebSocket with code 1012 as soon as it starts shutting down
+    and only sends the lifespan shutdown event afterwards, so the drain runs here, after
+    the listening sockets are closed and before uvicorn cuts the remaining connections off.
+    """
+    async def shutdown(self, sockets=None):
+        from chat.consumers import shutdown
+
+        for server in self.servers:
+            server.close()
+        try:
+            await shutdown.run()
+        except Exception as e:
+            logger.error('Graceful shutdown failed: %s', e)
+        await super().shutdown(sockets=sockets)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-b", "--bind", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--fd", type=int, help="Accept connections from this inherited socket instead")
+    parser.add_argument("--loop", default="uvloop", choices=["auto", "asyncio", "uvloop"])
+    parser.add_argument("--http", default="httptools", choices=["auto", "h11", "httptools"])
+    parser.add_argument("--ws", default="wsproto", choices=["auto", "websockets", "wsproto"])
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true", help="Log every HTTP request and handshake")
+    parser.add_argument("application", nargs="?", default="mywebsite.asgi:application")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Pass the application as an import string: uvicorn configures logging as soon as the Config
+    # is created, which closes every existing handler, so Django has to set up the chat loggers after
+    config = uvicorn.Config(
+        args.application,
+        host=args.bind,
+        port=args.port,
+        fd=args.fd,
+        loop=args.loop,
+        http=args.http,
+        ws=args.ws,
+        lifespan="on",
+        backlog=args.backlog,
+        log_level=args.log_level,
+        access_log=args.access_log,
+    )
+    DrainingServer(config).run()
+
+
+if __name__ == "__main__":
+    main()
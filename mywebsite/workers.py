@@ -0,0 +1,116 @@
+"""
+Runs several Daphne worker processes, all serving one listening socket.
+
+The launcher binds the socket, creates the shared memory file the workers publish
+their metrics to, and starts `--workers` copies of `python -m mywebsite.server`, or of
+`python -m mywebsite.uvicorn_server` with `--server uvicorn`, that accept connections
+from the inherited socket (--fd). Any other arguments are passed on to every worker. A worker that dies is restarted; SIGTERM or SIGINT is
+forwarded to all workers, which drain their connections before exiting.
+
+    python -m mywebsite.workers --workers 4 -b 0.0.0.0 -p 8000
+    python -m mywebsite.workers --workers 4 --server uvicorn -b 0.0.0.0 -p 8000
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from chat.sharedmetrics import create_region
+
+
+logger = logging.getLogger(__name__)
+
+# Module each worker runs, by --server
+SERVERS = {
+    "daphne": "mywebsite.server",
+    "uvicorn": "mywebsite.uvicorn_server",
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="daphne", help="Server each worker runs")
+    parser.add_argument("-b", "--bind", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--backlog", type=int, default=2048, help="Listen backlog of the shared socket")
+    parser.add_argument("application", nargs="?", default="mywebsite.asgi:application")
+    return parser
+
+
+def listen(host, port, backlog):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Launcher:
+    def __init__(self, args, server_args):
+        self.args = args
+        self.server_args = server_args
+        self.socket = listen(args.bind, args.port, args.backlog)
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, self.metrics_path = tempfile.mkstemp(prefix="chat-metrics-", dir=shm_dir)
+        os.close(fd)
+        create_region(self.metrics_path, args.workers)
+        self.processes = {}
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        fd = self.socket.fileno()
+        env = dict(
+            os.environ,
+            CHAT_METRICS_SHM=self.metrics_path,
+            CHAT_WORKER_COUNT=str(self.args.workers),
+            CHAT_WORKER_ID=str(worker_id),
+        )
+        command = [sys.executable, "-m", SERVERS[self.args.server], "--fd", str(fd), *self.server_args, self.args.application]
+        self.processes[worker_id] = subprocess.Popen(command, env=env, pass_fds=(fd,))
+        logger.info("Started worker %s with pid %s", worker_id, self.processes[worker_id].pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.args.workers):
+            self.spawn(worker_id)
+        try:
+            while True:
+                for worker_id, process in list(self.processes.items()):
+                    if process.poll() is None:
+                        continue
+                    if self.stopping:
+                        del self.processes[worker_id]
+                    else:
+                        logger.warning("Worker %s exited with code %s, restarting it", worker_id, process.returncode)
+                        self.spawn(worker_id)
+                if not self.processes:
+                    return
+                time.sleep(0.2)
+        finally:
+            self.socket.close()
+            os.unlink(self.metrics_path)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args, server_args = build_parser().parse_known_args(argv)
+    Launcher(args, server_args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import time
+
+import django
+import pytest
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mywebsite.settings')
+# The metrics tests go through Django's test client, which needs the app registry
+django.setup()
+
+
+class RedisServer:
+    """
+    A throwaway redis-server process listening on a free local port.
+    """
+    def __init__(self, tmp_path):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.tmp_path = tmp_path
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ["redis-server", "--port", str(self.port), "--save", "", "--appendonly", "no", "--dir", str(self.tmp_path)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.wait_ready()
+
+    @property
+    def hosts(self):
+        return [("127.0.0.1", self.port)]
+
+    def wait_ready(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.1):
+                    return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("redis-server did not start")
+
+    def pause(self):
+        """
+        Freeze the server: connections stay open but nothing is answered.
+        """
+        self.process.send_signal(signal.SIGSTOP)
+
+    def resume(self):
+        self.process.send_signal(signal.SIGCONT)
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def stop(self):
+        self.resume()
+        self.process.terminate()
+        self.process.wait()
+
+
+@pytest.fixture
+def redis_server(tmp_path):
+    """
+    Start a local redis-server for the test, skipping the test if it is not installed.
+    """
+    if shutil.which("redis-server") is None:
+        pytest.skip("redis-server is not installed")
+    server = RedisServer(tmp_path)
+    yield server
+    server.stop()
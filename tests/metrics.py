@@ -1,15 +1,14 @@
 import pytest
 from django.test import AsyncClient
 from prometheus_client.parser import text_string_to_metric_families
-from chat.consumers import metrics, metrics_lock
+from chat.consumers import metrics
 
 @pytest.mark.asyncio
 async def test_metrics_endpoint():
     client = AsyncClient()
-    async with metrics_lock:
-        metrics["total_messages"] = 10
-        metrics["active_connections"] = 3
-        metrics["error_count"] = 1
+    metrics["total_messages"] = 10
+    metrics["active_connections"] = 3
+    metrics["error_count"] = 1
     response = await client.get("/metrics")
     assert response.status_code == 200
     assert response["Content-Type"] == "text/plain; version=0.0.4"
@@ -26,5 +25,9 @@ async def test_metrics_endpoint():
     assert "websocket_error_count" in metrics_dict
     assert metrics_dict["websocket_error_count"].samples[0].value == 1
 
-    assert "websocket_last_shutdown_time" in metrics_dict
-    assert metrics_dict["websocket_last_shutdown_time"].samples[0].value == 0.0
+    assert "websocket_shutdown_phase_seconds" in metrics_dict
+    phases = {sample.labels["phase"]: sample.value for sample in metrics_dict["websocket_shutdown_phase_seconds"].samples}
+    assert phases == {"broadcast": 0.0, "drain": 0.0, "stop": 0.0}
+
+    assert "websocket_shutdown_remaining_connections" in metrics_dict
+    assert metrics_dict["websocket_shutdown_remaining_connections"].samples[0].value == 0
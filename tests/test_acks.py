@@ -0,0 +1,89 @@
+import asyncio
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+async def connect(query=""):
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        f"/ws/chat/{query}"
+    )
+    connected, _ = await communicator.connect()
+    assert connected
+    hello = await communicator.receive_json_from()
+    return communicator, hello
+
+async def test_one_ack_per_frame_by_default():
+    communicator, hello = await connect()
+    try:
+        assert "batch" not in hello and "ack_window" not in hello
+        await communicator.send_to(text_data='["a", "b"]')
+        response = await communicator.receive_json_from()
+        assert response["count"] == 1
+    finally:
+        await communicator.disconnect()
+
+async def test_batch_frame_gets_single_ack():
+    communicator, hello = await connect("?batch=1")
+    try:
+        assert hello["batch"] is True
+        await communicator.send_json_to(["a", "b", "c"])
+        response = await communicator.receive_json_from()
+        assert response["count"] == 3
+        await communicator.send_to(text_data="plain message")
+        response = await communicator.receive_json_from()
+        assert response["count"] == 4
+        await communicator.send_to(text_data="[not json")
+        response = await communicator.receive_json_from()
+        assert response["count"] == 5
+        assert await communicator.receive_nothing()
+    finally:
+        await communicator.disconnect()
+
+async def test_acks_within_window_are_coalesced():
+    communicator, hello = await connect("?ack_window=50")
+    try:
+        assert hello["ack_window"] == 50
+        for _ in range(10):
+            await communicator.send_to(text_data="m")
+        response = await communicator.receive_json_from()
+        assert response["count"] == 10
+        assert await communicator.receive_nothing(timeout=0.1)
+        await communicator.send_to(text_data="m")
+        response = await communicator.receive_json_from()
+        assert response["count"] == 11
+    finally:
+        await communicator.disconnect()
+
+async def test_batches_and_coalescing_combined():
+    communicator, _ = await connect("?batch=1&ack_window=50")
+    try:
+        await communicator.send_json_to(["a", "b"])
+        await communicator.send_to(text_data="c")
+        await communicator.send_json_to(["d", "e", "f"])
+        response = await communicator.receive_json_from()
+        assert response["count"] == 6
+    finally:
+        await communicator.disconnect()
+
+async def test_ack_window_is_capped():
+    communicator, hello = await connect("?ack_window=60000")
+    try:
+        assert hello["ack_window"] == 200
+    finally:
+        await communicator.disconnect()
+
+async def test_pending_ack_is_sent_before_bye():
+    communicator, _ = await connect("?ack_window=200")
+    await communicator.send_to(text_data="m")
+    await communicator.send_to(text_data="m")
+    await asyncio.sleep(0.01)
+    await communicator.disconnect()
+    response = await communicator.receive_json_from()
+    assert response["count"] == 2
+    response = await communicator.receive_json_from()
+    assert response == {"bye": True, "total": 2}
@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat.instruments import handshakes
+from chat.middleware import OVERLOADED_CLOSE_CODE, AdmissionControl, AllowEmptyOriginValidator
+from chat.ratelimit import TokenBucket
+from chat.routing import websocket_urlpatterns
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_rate_up_to_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=2, clock=clock)
+    assert bucket.consume() and bucket.consume()
+    assert not bucket.consume()
+    assert bucket.wait_time() == 0.1
+    clock.now = 0.1
+    assert bucket.consume()
+    assert not bucket.consume()
+    clock.now = 10
+    assert bucket.consume() and bucket.consume()
+    assert not bucket.consume()
+
+def test_retry_after_grows_with_the_backlog_and_is_capped():
+    clock = FakeClock()
+    admission = AdmissionControl(None, rate=100, burst=0, max_retry_after=0.5, enabled=True, clock=clock)
+    hints = [admission.retry_after() for _ in range(100)]
+    assert hints == sorted(hints)
+    assert hints[0] == 0.02
+    assert hints[-1] == 0.5
+    # The backlog drains at the admission rate
+    clock.now = 10
+    assert admission.retry_after() == 0.02
+
+def test_zero_rate_turns_admission_control_off():
+    admission = AdmissionControl(None, rate=0, burst=10, enabled=True)
+    assert not admission.enabled
+    assert admission.accepting
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=10)
+
+async def handshake(application):
+    communicator = WebsocketCommunicator(application, "/ws/chat/")
+    connected, _ = await communicator.connect(timeout=10)
+    assert connected
+    frame = await communicator.receive_json_from(timeout=10)
+    if "retry_after" in frame:
+        output = await communicator.receive_output(timeout=10)
+        assert output == {"type": "websocket.close", "code": OVERLOADED_CLOSE_CODE}
+        return frame
+    await communicator.disconnect()
+    return frame
+
+async def test_burst_of_handshakes_is_capped():
+    clock = FakeClock()
+    application = AdmissionControl(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        rate=50, burst=100, max_retry_after=30, enabled=True, clock=clock,
+    )
+    admitted, rejected = handshakes.values.get("admitted", 0), handshakes.values.get("rejected", 0)
+    frames = await asyncio.gather(*(handshake(application) for _ in range(3000)))
+
+    hellos = [frame for frame in frames if "session_uuid" in frame]
+    retries = [frame["retry_after"] for frame in frames if "retry_after" in frame]
+    assert len(hellos) == 100
+    assert len(retries) == 2900
+    assert max(retries) == 30
+    assert len(set(retries)) > 1000
+    assert handshakes.values["admitted"] - admitted == 100
+    assert handshakes.values["rejected"] - rejected == 2900
+
+    # Once the bucket has refilled, handshakes are admitted again
+    clock.now += 2
+    frame = await handshake(application)
+    assert "session_uuid" in frame
+
+async def test_rejected_client_gets_retry_after_frame_before_close():
+    application = AdmissionControl(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        rate=1, burst=0, enabled=True,
+    )
+    communicator = WebsocketCommunicator(application, "/ws/chat/")
+    connected, _ = await communicator.connect()
+    assert connected
+    frame = json.loads(await communicator.receive_from())
+    assert 0 < frame["retry_after"] <= 30
+    assert await communicator.receive_output() == {"type": "websocket.close", "code": OVERLOADED_CLOSE_CODE}
@@ -0,0 +1,175 @@
+import base64
+import json
+import os
+import uuid
+import zlib
+
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat import codec, consumers
+from chat.codec import BINARY_SUBPROTOCOL, BinaryCodec, decode_varint, encode_varint, json_codec
+from chat.consumers import session_store
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+@pytest.fixture(autouse=True)
+def clear_session_store():
+    session_store.clear()
+    yield
+    session_store.clear()
+
+
+async def connect(query=""):
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        f"/ws/chat/{query}",
+        subprotocols=[BINARY_SUBPROTOCOL],
+    )
+    connected, subprotocol = await communicator.connect()
+    assert connected
+    assert subprotocol == BINARY_SUBPROTOCOL
+    return communicator
+
+
+def read(frame):
+    return BinaryCodec().read(frame)
+
+def test_varints_round_trip():
+    for value in (0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 + 5):
+        encoded = encode_varint(value)
+        assert decode_varint(encoded + b"rest") == (value, len(encoded))
+    assert encode_varint(300) == b"\xac\x02"
+    with pytest.raises(ValueError):
+        decode_varint(b"\x80")
+
+def test_binary_frames_are_smaller_than_json():
+    binary = BinaryCodec()
+    assert binary.ack(300)["bytes"] == b"\x02\xac\x02"
+    assert json_codec.ack(300)["text"] == '{"count":300}'
+    session_uuid = str(uuid.uuid4())
+    hello = binary.hello(session_uuid, batch=True, ack_window_ms=200)["bytes"]
+    frame_type, body = read(hello)
+    assert frame_type == codec.HELLO
+    assert body[:16] == uuid.UUID(session_uuid).bytes
+    assert body[16] == codec.HELLO_BATCH
+    assert decode_varint(body, 17) == (200, 19)
+    assert read(binary.bye(7)["bytes"]) == (codec.BYE, b"\x07")
+    assert read(binary.throttle(0.0125)["bytes"]) == (codec.THROTTLE, b"\x0d")
+
+def test_json_frames_match_their_dict_form():
+    session_uuid = str(uuid.uuid4())
+    token = base64.urlsafe_b64encode(os.urandom(45)).decode()
+    frames = [
+        (json_codec.hello(session_uuid), {"session_uuid": session_uuid}),
+        (json_codec.hello(session_uuid, token, True, 200),
+         {"session_uuid": session_uuid, "resume_token": token, "batch": True, "ack_window": 200}),
+        (json_codec.ack(5), {"count": 5}),
+        (json_codec.ack(10 ** 6), {"count": 10 ** 6}),
+        (json_codec.ack(5, token), {"count": 5, "resume_token": token}),
+        (json_codec.bye(12), {"bye": True, "total": 12}),
+        (json_codec.heartbeat(0), {"ts": "1970-01-01T00:00:00+00:00"}),
+        (json_codec.ping(1700000000.25), {"ping": 1700000000.25}),
+        (json_codec.throttle(0.25), {"throttled": True, "retry_after": 0.25}),
+        (json_codec.event({"text": "caf\u00e9 \"quoted\""}), {"text": "caf\u00e9 \"quoted\""}),
+    ]
+    for frame, expected in frames:
+        assert json.loads(frame["text"]) == expected
+    # Small acks are shared between sessions
+    assert json_codec.ack(5) is json_codec.ack(5)
+    assert codec.loads(codec.dumps([1, "a"])) == [1, "a"]
+
+def test_large_frames_are_deflated():
+    binary = BinaryCodec(compress_threshold=64)
+    message = {"text": "hello " * 50}
+    frame = binary.event(message)["bytes"]
+    assert frame[0] == codec.EVENT | codec.DEFLATED
+    assert len(frame) < 64
+    frame_type, body = read(frame)
+    assert frame_type == codec.EVENT
+    assert json.loads(body) == message
+    # Small frames and incompressible ones are sent as they are
+    assert binary.ack(1)["bytes"][0] == codec.ACK
+    token = base64.urlsafe_b64encode(os.urandom(45)).decode()
+    assert BinaryCodec(compress_threshold=8).ack(1, token)["bytes"][0] == codec.ACK
+
+def test_read_rejects_bad_frames():
+    binary = BinaryCodec(max_inflated_size=1024)
+    with pytest.raises(ValueError):
+        binary.read(b"")
+    with pytest.raises(ValueError):
+        binary.read(bytes((codec.BATCH | codec.DEFLATED,)) + b"not deflate")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    bomb = compressor.compress(b"\0" * 100_000) + compressor.flush()
+    with pytest.raises(ValueError):
+        binary.read(bytes((codec.BATCH | codec.DEFLATED,)) + bomb)
+
+async def test_binary_session():
+    communicator = await connect("?batch=1")
+    try:
+        frame_type, body = read(await communicator.receive_from())
+        assert frame_type == codec.HELLO
+        session_uuid = str(uuid.UUID(bytes=body[:16]))
+        assert body[16] == codec.HELLO_BATCH
+
+        await communicator.send_to(bytes_data=bytes((codec.MESSAGE,)) + b"payload")
+        assert read(await communicator.receive_from()) == (codec.ACK, encode_varint(1))
+        await communicator.send_to(bytes_data=bytes((codec.BATCH,)) + encode_varint(5))
+        assert read(await communicator.receive_from()) == (codec.ACK, encode_varint(6))
+        # Text frames still count on a binary connection
+        await communicator.send_to(text_data="m")
+        assert read(await communicator.receive_from()) == (codec.ACK, encode_varint(7))
+
+        await communicator.disconnect()
+        assert read(await communicator.receive_from()) == (codec.BYE, encode_varint(7))
+        assert session_store[session_uuid] == 7
+    finally:
+        await communicator.disconnect()
+
+async def test_oversized_batches_close_the_connection(monkeypatch):
+    # A batch up to the limit is only accepted in one piece without the rate limit's burst
+    monkeypatch.setattr(consumers, "rate_limit_enabled", False)
+    communicator = await connect("?batch=1")
+    try:
+        read(await communicator.receive_from())
+        # Far above the batch limit and above what an ack or resume token can encode
+        await communicator.send_to(bytes_data=bytes((codec.BATCH,)) + encode_varint(2 ** 70))
+        assert await communicator.receive_output() == {
+            "type": "websocket.close", "code": codec.PROTOCOL_ERROR_CLOSE_CODE,
+        }
+    finally:
+        await communicator.disconnect()
+
+    communicator = WebsocketCommunicator(AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)), "/ws/chat/?batch=1")
+    connected, _ = await communicator.connect()
+    try:
+        assert connected
+        session_uuid = (await communicator.receive_json_from())["session_uuid"]
+        await communicator.send_to(text_data=json.dumps(list(range(consumers.max_batch_size))))
+        assert await communicator.receive_json_from() == {"count": consumers.max_batch_size}
+        await communicator.send_to(text_data=json.dumps(list(range(consumers.max_batch_size + 1))))
+        assert await communicator.receive_output() == {
+            "type": "websocket.close", "code": codec.PROTOCOL_ERROR_CLOSE_CODE,
+        }
+    finally:
+        await communicator.disconnect()
+    assert session_store[session_uuid] == consumers.max_batch_size
+
+async def test_json_stays_the_default():
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/",
+        subprotocols=["something.else"],
+    )
+    connected, subprotocol = await communicator.connect()
+    try:
+        assert connected
+        assert subprotocol is None
+        assert "session_uuid" in await communicator.receive_json_from()
+        # A binary frame from a JSON client is one message
+        await communicator.send_to(bytes_data=bytes((codec.BATCH,)) + encode_varint(5))
+        assert await communicator.receive_json_from() == {"count": 1}
+    finally:
+        await communicator.disconnect()
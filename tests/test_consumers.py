@@ -1,3 +1,4 @@
+import json
 import pytest
 import uuid
 from channels.testing import WebsocketCommunicator
@@ -44,6 +45,31 @@ async def test_connect_resume_session():
     finally:
         await communicator.disconnect()
 
+async def test_resume_with_non_canonical_session_uuid():
+    session_uuid = "0" + str(uuid.uuid4())[1:]
+    session_store[session_uuid] = 5
+    spellings = [
+        "%0A" + session_uuid.replace("-", "")[1:],
+        session_uuid.upper(),
+        f"urn:uuid:{session_uuid}",
+        "%7B" + session_uuid + "%7D",
+    ]
+    for spelling in spellings:
+        communicator = WebsocketCommunicator(
+            AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+            f"/ws/chat/?session_uuid={spelling}"
+        )
+        try:
+            connected, _ = await communicator.connect()
+            assert connected
+            hello = await communicator.receive_from()
+            assert json.loads(hello) == {"session_uuid": session_uuid}
+            await communicator.send_json_to({"message": "test"})
+            assert (await communicator.receive_json_from())["count"] == 6
+        finally:
+            await communicator.disconnect()
+        session_store[session_uuid] = 5
+
 async def test_connect_invalid_session_uuid():
     communicator = WebsocketCommunicator(
         AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
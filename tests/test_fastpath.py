@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from channels.testing import HttpCommunicator
+from prometheus_client.parser import text_string_to_metric_families
+
+from chat import consumers, exposition
+from chat.fastpath import FastPath
+from chat.middleware import AdmissionControl
+
+
+async def django_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"django"})
+
+
+@pytest.fixture
+def restore_state():
+    lag, draining = consumers.loop_monitor.last_lag, consumers.shutdown.draining
+    yield
+    consumers.loop_monitor.last_lag, consumers.shutdown.draining = lag, draining
+
+async def get(application, path):
+    return await HttpCommunicator(application, "GET", path).get_response()
+
+async def test_metrics_are_served_without_django():
+    response = await get(FastPath(django_app), "/chat/metrics/")
+    assert response["status"] == 200
+    assert (b"content-type", b"text/plain; version=0.0.4") in response["headers"]
+    families = {family.name for family in text_string_to_metric_families(response["body"].decode())}
+    assert "websocket_total_messages" in families
+    assert "event_loop_lag_seconds" in families
+
+async def test_other_paths_go_to_django():
+    response = await get(FastPath(django_app), "/chat/ws/")
+    assert response["body"] == b"django"
+
+def test_payload_is_cached_until_a_value_changes():
+    first = exposition.render_metrics()
+    assert exposition.render_metrics() is first
+    consumers.metrics["total_messages"] += 1
+    second = exposition.render_metrics()
+    assert second is not first
+    assert exposition.render_metrics() is second
+    assert b"websocket_total_messages %d\n" % consumers.metrics["total_messages"] in second
+
+async def test_healthz():
+    response = await get(FastPath(django_app), "/healthz")
+    assert response["status"] == 200
+
+async def test_readyz_reflects_draining_and_loop_lag(restore_state):
+    application = FastPath(django_app, max_loop_lag=0.1)
+    consumers.loop_monitor.last_lag = 0.0
+    consumers.shutdown.draining = False
+    response = await get(application, "/readyz")
+    assert response["status"] == 200
+    assert json.loads(response["body"])["ready"] is True
+
+    consumers.loop_monitor.last_lag = 0.5
+    response = await get(application, "/readyz")
+    assert response["status"] == 503
+    assert json.loads(response["body"])["checks"]["loop_lag"] is False
+
+    consumers.loop_monitor.last_lag = 0.0
+    consumers.shutdown.draining = True
+    response = await get(application, "/readyz")
+    assert response["status"] == 503
+    assert json.loads(response["body"])["checks"]["not_draining"] is False
+
+async def test_readyz_fails_while_handshakes_are_turned_away(restore_state):
+    consumers.loop_monitor.last_lag = 0.0
+    consumers.shutdown.draining = False
+    admission = AdmissionControl(django_app, rate=1, burst=1, enabled=True)
+    application = FastPath(django_app, admission=admission)
+    assert (await get(application, "/readyz"))["status"] == 200
+    admission.bucket.consume()
+    response = await get(application, "/readyz")
+    assert response["status"] == 503
+    assert json.loads(response["body"])["checks"]["accepting_connections"] is False
@@ -0,0 +1,153 @@
+import asyncio
+import uuid
+
+import pytest
+import redis
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+
+from chat.consumers import broadcast_group
+from chat.groups import GLOBAL_GROUP, MembershipBatcher, ShardedGroup
+from chat.instruments import group_members
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+class FailingLayer(InMemoryChannelLayer):
+    async def group_send(self, group, message):
+        if group.endswith("-0"):
+            raise ConnectionError("shard down")
+        await super().group_send(group, message)
+
+
+class CountingLayer(InMemoryChannelLayer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = []
+
+    async def group_add(self, group, channel):
+        self.calls.append(("add", channel))
+        await super().group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        self.calls.append(("discard", channel))
+        await super().group_discard(group, channel)
+
+
+def test_shards_are_assigned_deterministically():
+    group = ShardedGroup(shards=16)
+    keys = [str(uuid.uuid4()) for _ in range(1600)]
+    shards = [group.shard(key) for key in keys]
+    assert shards == [ShardedGroup(shards=16).shard(key) for key in keys]
+    counts = [shards.count(shard) for shard in range(16)]
+    assert min(counts) > 50
+    assert group.names[3] == f"{GLOBAL_GROUP}-3"
+
+def test_single_shard_keeps_the_plain_group_name():
+    group = ShardedGroup(shards=1)
+    assert group.names == [GLOBAL_GROUP]
+    assert group.shard("anything") == 0
+    with pytest.raises(ValueError):
+        ShardedGroup(shards=0)
+
+async def test_send_reaches_every_shard():
+    layer = InMemoryChannelLayer()
+    group = ShardedGroup("test-broadcast", shards=4)
+    channels = [await layer.new_channel() for _ in range(20)]
+    shards = [await group.add(layer, channel, channel) for channel in channels]
+    assert sum(group.members) == 20
+    assert group_members.values[shards[0]] == group.members[shards[0]]
+
+    await group.send(layer, {"type": "heartbeat.message", "message": {"ts": 1}})
+    for channel in channels:
+        assert (await layer.receive(channel))["message"] == {"ts": 1}
+
+    await group.discard(layer, shards[0], channels[0])
+    assert sum(group.members) == 19
+    await group.send(layer, {"type": "heartbeat.message", "message": {"ts": 2}})
+    assert layer.channels.get(channels[0]) is None or layer.channels[channels[0]].empty()
+
+async def test_a_failing_shard_does_not_stop_the_others():
+    layer = FailingLayer()
+    group = ShardedGroup("test-failing", shards=2)
+    channel = await layer.new_channel()
+    while group.shard(channel) != 1:
+        channel = await layer.new_channel()
+    await group.add(layer, channel, channel)
+    with pytest.raises(ConnectionError):
+        await group.send(layer, {"type": "heartbeat.message", "message": {"ts": 1}})
+    assert (await layer.receive(channel))["message"] == {"ts": 1}
+
+async def test_batcher_coalesces_changes_and_cancels_unsent_adds():
+    layer = CountingLayer()
+    batcher = MembershipBatcher(interval=0.01)
+    group = ShardedGroup("test-batched", shards=2, batcher=batcher)
+    channels = [await layer.new_channel() for _ in range(3)]
+    shards = [await group.add(layer, channel, channel) for channel in channels]
+    await group.discard(layer, shards[2], channels[2])
+    assert layer.calls == []
+    assert sum(group.members) == 2
+
+    await asyncio.sleep(0.05)
+    # One flush for both shards, and the add that was discarded again never went out
+    assert batcher.batches == 1
+    assert sorted(layer.calls) == sorted(("add", channel) for channel in channels[:2])
+    await group.discard(layer, shards[0], channels[0])
+    await group.flush()
+    assert layer.calls[-1] == ("discard", channels[0])
+    assert batcher.batches == 2
+
+async def test_send_flushes_queued_adds():
+    layer = InMemoryChannelLayer()
+    group = ShardedGroup("test-flushed", shards=4, batcher=MembershipBatcher(interval=60))
+    channels = [await layer.new_channel() for _ in range(8)]
+    for channel in channels:
+        await group.add(layer, channel, channel)
+    await group.send(layer, {"type": "heartbeat.message", "message": {"ts": 1}})
+    for channel in channels:
+        assert (await layer.receive(channel))["message"] == {"ts": 1}
+
+async def test_batched_adds_are_one_redis_pipeline_per_group(redis_server):
+    layer = RedisChannelLayer(hosts=redis_server.hosts)
+    batcher = MembershipBatcher(interval=0.01)
+    group = ShardedGroup("test-pipelined", shards=2, batcher=batcher)
+    channels = [await layer.new_channel() for _ in range(200)]
+    client = redis.Redis(*redis_server.hosts[0])
+    commands = client.info("commandstats")
+    for channel in channels:
+        await group.add(layer, channel, channel)
+    await group.flush()
+    stats = client.info("commandstats")
+    assert batcher.batches == 1
+    assert stats["cmdstat_zadd"]["calls"] - commands.get("cmdstat_zadd", {}).get("calls", 0) == 2
+    assert sum(client.zcard(layer._group_key(name)) for name in group.names) == 200
+
+    for channel in channels[:10]:
+        await group.discard(layer, group.shard(channel), channel)
+    await group.flush()
+    assert sum(client.zcard(layer._group_key(name)) for name in group.names) == 190
+    client.close()
+    await layer.flush()
+
+async def test_consumers_join_the_shard_of_their_session():
+    session_uuid = str(uuid.uuid4())
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        f"/ws/chat/?session_uuid={session_uuid}",
+    )
+    connected, _ = await communicator.connect()
+    assert connected
+    hello = await communicator.receive_json_from()
+    layer = get_channel_layer()
+    group_name = broadcast_group.names[broadcast_group.shard(hello["session_uuid"])]
+    # The join is queued, the broadcast flushes it first
+    assert group_name not in layer.groups
+
+    await broadcast_group.send(layer, {"type": "heartbeat.message", "message": {"ts": "now"}})
+    assert await communicator.receive_json_from() == {"ts": "now"}
+    assert len(layer.groups[group_name]) == 1
+    await communicator.disconnect()
+    await broadcast_group.flush()
+    assert not layer.groups.get(group_name)
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat.codec import json_codec
+from chat.consumers import heartbeat
+from chat.heartbeat import HeartbeatEngine
+from chat.middleware import AllowEmptyOriginValidator
+from chat.registry import ConnectionRegistry, connections
+from chat.routing import websocket_urlpatterns
+
+
+class FakeConsumer:
+    codec = json_codec
+
+    def __init__(self, channel_name, fail=False):
+        self.channel_name = channel_name
+        self.fail = fail
+        self.sent = []
+
+    def queue_message(self, message, heartbeat=False):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        self.sent.append(message)
+
+
+@pytest.fixture(autouse=True)
+async def stop_heartbeat():
+    yield
+    await heartbeat.stop()
+
+async def test_tick_serializes_once_and_sends_to_all():
+    registry = ConnectionRegistry()
+    consumers = [FakeConsumer(f"test.{i}") for i in range(7)]
+    for consumer in consumers:
+        registry.add(consumer)
+    engine = HeartbeatEngine(registry, chunk_size=3)
+    await engine.tick()
+    messages = [consumer.sent[0] for consumer in consumers]
+    assert all(message is messages[0] for message in messages)
+    assert messages[0]["type"] == "websocket.send"
+    assert "ts" in json.loads(messages[0]["text"])
+    assert engine.last_fanout_duration > 0
+
+async def test_tick_yields_between_chunks():
+    registry = ConnectionRegistry()
+    for i in range(10):
+        registry.add(FakeConsumer(f"test.{i}"))
+    engine = HeartbeatEngine(registry, chunk_size=2)
+    yields = 0
+
+    async def count_yields():
+        nonlocal yields
+        while True:
+            await asyncio.sleep(0)
+            yields += 1
+
+    counter = asyncio.create_task(count_yields())
+    await engine.tick()
+    counter.cancel()
+    assert yields >= 4
+
+async def test_failed_send_does_not_stop_fanout():
+    registry = ConnectionRegistry()
+    broken, healthy = FakeConsumer("test.broken", fail=True), FakeConsumer("test.healthy")
+    registry.add(broken)
+    registry.add(healthy)
+    engine = HeartbeatEngine(registry)
+    await engine.tick()
+    assert engine.send_errors == 1
+    assert len(healthy.sent) == 1
+
+async def test_start_and_stop():
+    engine = HeartbeatEngine(ConnectionRegistry(), interval=0.01)
+    engine.start()
+    assert engine.running
+    await asyncio.sleep(0.05)
+    await engine.stop()
+    assert not engine.running
+
+async def test_connected_clients_receive_heartbeat():
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/"
+    )
+    try:
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.receive_json_from()
+        assert len(connections) == 1
+        assert heartbeat.running
+        await heartbeat.tick()
+        response = await communicator.receive_json_from()
+        assert "ts" in response
+    finally:
+        await communicator.disconnect()
+    assert len(connections) == 0
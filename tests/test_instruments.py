@@ -0,0 +1,66 @@
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import AsyncClient
+from prometheus_client.parser import text_string_to_metric_families
+
+from chat.instruments import Histogram, LabeledCounter, connect_duration, receive_duration
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+def parse(text):
+    return {family.name: family for family in text_string_to_metric_families(text)}
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_latency_seconds", "Test latency", buckets=(0.1, 1.0), register=False)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    samples = {
+        (sample.name, sample.labels.get("le")): sample.value
+        for sample in parse(histogram.render())["test_latency_seconds"].samples
+    }
+    assert samples[("test_latency_seconds_bucket", "0.1")] == 2
+    assert samples[("test_latency_seconds_bucket", "1.0")] == 3
+    assert samples[("test_latency_seconds_bucket", "+Inf")] == 4
+    assert samples[("test_latency_seconds_count", None)] == 4
+    assert samples[("test_latency_seconds_sum", None)] == 2.65
+
+def test_labeled_counter_renders_one_sample_per_label():
+    counter = LabeledCounter("test_disconnects", "Test disconnects", "code", register=False)
+    counter.inc(1000)
+    counter.inc(1000)
+    counter.inc(4408)
+    samples = {sample.labels["code"]: sample.value for sample in parse(counter.render())["test_disconnects"].samples}
+    assert samples == {"1000": 2, "4408": 1}
+
+async def test_metrics_endpoint_exports_hot_path_histograms():
+    connects, receives = connect_duration.count, receive_duration.count
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/"
+    )
+    try:
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.receive_json_from()
+        await communicator.send_to(text_data="m")
+        await communicator.receive_json_from()
+    finally:
+        await communicator.disconnect(code=1000)
+    assert connect_duration.count == connects + 1
+    assert receive_duration.count == receives + 1
+
+    response = await AsyncClient().get("/chat/metrics/")
+    families = parse(response.content.decode())
+    for name in (
+        "websocket_connect_duration_seconds",
+        "websocket_receive_duration_seconds",
+        "websocket_send_duration_seconds",
+        "websocket_heartbeat_fanout_duration_seconds",
+        "websocket_group_add_duration_seconds",
+        "websocket_group_discard_duration_seconds",
+        "websocket_outbound_queue_depth",
+    ):
+        assert families[name].type == "histogram"
+    disconnects = {sample.labels["code"]: sample.value for sample in families["websocket_disconnects"].samples}
+    assert disconnects["1000"] >= 1
@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat.consumers import broadcast_group, metrics
+from chat.instruments import channel_layer_breaker_state, channel_layer_fallbacks, channel_layer_timeouts
+from chat.layers import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerChannelLayer
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+class FlakyLayer(InMemoryChannelLayer):
+    """
+    In-memory layer whose group calls fail while `down` is set.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.down = False
+
+    async def group_add(self, group, channel):
+        if self.down:
+            raise ConnectionError("layer down")
+        await super().group_add(group, channel)
+
+    async def group_send(self, group, message):
+        if self.down:
+            raise ConnectionError("layer down")
+        await super().group_send(group, message)
+
+
+def redis_layer(redis_server, **kwargs):
+    return CircuitBreakerChannelLayer(
+        "channels_redis.core.RedisChannelLayer", {"hosts": redis_server.hosts}, **kwargs
+    )
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        await asyncio.sleep(0.02)
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    changes = []
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05, on_change=lambda old, new: changes.append(new))
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_in() <= 0.05
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    # A failed probe opens the breaker again straight away
+    breaker.failure()
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED
+    assert changes == [OPEN, HALF_OPEN, OPEN, HALF_OPEN, CLOSED]
+
+async def test_groups_are_served_locally_and_replayed_on_recovery():
+    layer = CircuitBreakerChannelLayer("tests.test_layers.FlakyLayer", failure_threshold=2, reset_timeout=0.1)
+    first, second = await layer.new_channel(), await layer.new_channel()
+    await layer.group_add("room", first)
+
+    layer.layer.down = True
+    fallbacks = channel_layer_fallbacks.values.get("group_add", 0)
+    await layer.group_add("room", second)
+    await layer.group_send("room", {"type": "test.message", "n": 1})
+    assert layer.breaker.state == OPEN
+    assert channel_layer_breaker_state.values[OPEN] == 1
+    assert channel_layer_fallbacks.values["group_add"] == fallbacks + 1
+    # Both members get the message, from their local inboxes
+    assert (await asyncio.wait_for(layer.receive(first), 1))["n"] == 1
+    assert (await asyncio.wait_for(layer.receive(second), 1))["n"] == 1
+    assert second not in layer.layer.groups["room"]
+
+    # Refused by the open breaker without reaching the layer
+    await layer.group_discard("room", first)
+    assert first in layer.layer.groups["room"]
+
+    layer.layer.down = False
+    await asyncio.sleep(0.15)
+    # The first call that gets through closes the breaker and starts the replay
+    await layer.group_add("lobby", first)
+    assert layer.breaker.state == CLOSED
+    await layer._reconcile_task
+    assert set(layer.layer.groups["room"]) == {second}
+    await layer.group_send("room", {"type": "test.message", "n": 2})
+    assert (await asyncio.wait_for(layer.receive(second), 1))["n"] == 2
+
+async def test_paused_redis_times_out_and_recovers(redis_server):
+    layer = redis_layer(redis_server, timeout=0.2, group_send_timeout=0.2, failure_threshold=2, reset_timeout=0.5)
+    channel = await layer.new_channel()
+    await layer.group_add("room", channel)
+    receiving = asyncio.ensure_future(layer.receive(channel))
+    try:
+        redis_server.pause()
+        timeouts = channel_layer_timeouts.values.get("group_send", 0)
+        start = time.monotonic()
+        for n in range(3):
+            await layer.group_send("room", {"type": "test.message", "n": n})
+        # Only the calls made before the breaker opened waited for the timeout. They were
+        # cancelled in their first Redis command, so no copy of them is delivered later
+        assert time.monotonic() - start < 0.6
+        assert channel_layer_timeouts.values["group_send"] == timeouts + 2
+        assert layer.breaker.state == OPEN
+        assert (await asyncio.wait_for(receiving, 1))["n"] == 0
+
+        redis_server.resume()
+        await asyncio.sleep(0.6)
+        await layer.group_send("room", {"type": "test.message", "n": 10})
+        assert layer.breaker.state == CLOSED
+        messages = [await asyncio.wait_for(layer.receive(channel), 2) for _ in range(3)]
+        assert [message["n"] for message in messages] == [1, 2, 10]
+    finally:
+        redis_server.resume()
+        receiving.cancel()
+        await layer.flush()
+
+async def test_memberships_are_restored_after_redis_restarts(redis_server):
+    layer = redis_layer(redis_server, timeout=0.5, failure_threshold=1, reset_timeout=0.3)
+    channels = [await layer.new_channel() for _ in range(3)]
+    for channel in channels:
+        await layer.group_add("room", channel)
+
+    redis_server.kill()
+    await layer.group_add("room", channels[0])
+    assert layer.breaker.state == OPEN
+    # A fresh server has no groups at all
+    redis_server.start()
+    await asyncio.sleep(0.35)
+    await layer.group_send("other", {"type": "test.message"})
+    await wait_for(lambda: layer._reconcile_task is not None and layer._reconcile_task.done())
+    assert layer.breaker.state == CLOSED
+
+    await layer.group_send("room", {"type": "test.message", "n": 1})
+    for channel in channels:
+        assert (await asyncio.wait_for(layer.receive(channel), 2))["n"] == 1
+    await layer.flush()
+
+async def test_consumers_connect_and_get_broadcasts_while_the_layer_is_down():
+    layer = CircuitBreakerChannelLayer("tests.test_layers.FlakyLayer", failure_threshold=1, reset_timeout=60)
+    layer.layer.down = True
+    previous = channel_layers.backends.get("default")
+    channel_layers.backends["default"] = layer
+    errors = metrics["error_count"]
+    communicator = WebsocketCommunicator(AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)), "/ws/chat/")
+    try:
+        connected, _ = await communicator.connect(timeout=2)
+        assert connected
+        await communicator.receive_json_from()
+        await broadcast_group.send(layer, {"type": "heartbeat.message", "message": {"ts": "local"}})
+        assert await communicator.receive_json_from() == {"ts": "local"}
+        await communicator.disconnect()
+        await broadcast_group.flush()
+        assert metrics["error_count"] == errors
+        assert not layer.groups
+    finally:
+        if previous is None:
+            del channel_layers.backends["default"]
+        else:
+            channel_layers.backends["default"] = previous
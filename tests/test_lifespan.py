@@ -0,0 +1,109 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+from asgiref.testing import ApplicationCommunicator
+from channels.testing import WebsocketCommunicator
+
+from chat import consumers
+from chat.lifespan import Lifespan
+from chat.shutdown import SHUTDOWN_CLOSE_CODE
+from mywebsite.asgi import application
+
+
+@pytest.fixture
+def restore_shutdown():
+    draining, timings = consumers.shutdown.draining, dict(consumers.shutdown.timings)
+    yield
+    consumers.shutdown.draining = draining
+    consumers.shutdown.timings.update(timings)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def test_lifespan_runs_its_hooks():
+    calls = []
+
+    async def startup():
+        calls.append("startup")
+
+    async def shutdown():
+        calls.append("shutdown")
+
+    communicator = ApplicationCommunicator(Lifespan(startup, shutdown), {"type": "lifespan"})
+    await communicator.send_input({"type": "lifespan.startup"})
+    assert await communicator.receive_output() == {"type": "lifespan.startup.complete"}
+    await communicator.send_input({"type": "lifespan.shutdown"})
+    assert await communicator.receive_output() == {"type": "lifespan.shutdown.complete"}
+    assert calls == ["startup", "shutdown"]
+    await communicator.wait()
+
+async def test_lifespan_reports_a_failed_startup():
+    async def startup():
+        raise RuntimeError("no redis")
+
+    communicator = ApplicationCommunicator(Lifespan(startup), {"type": "lifespan"})
+    await communicator.send_input({"type": "lifespan.startup"})
+    assert await communicator.receive_output() == {"type": "lifespan.startup.failed", "message": "no redis"}
+    await communicator.wait()
+
+async def test_application_lifespan_starts_tasks_and_drains(restore_shutdown):
+    lifespan = ApplicationCommunicator(application, {"type": "lifespan"})
+    await lifespan.send_input({"type": "lifespan.startup"})
+    assert await lifespan.receive_output() == {"type": "lifespan.startup.complete"}
+    assert consumers.heartbeat.running
+
+    communicator = WebsocketCommunicator(application, "/ws/chat/")
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()
+
+    await lifespan.send_input({"type": "lifespan.shutdown"})
+    assert await communicator.receive_output() == {"type": "websocket.close", "code": SHUTDOWN_CLOSE_CODE}
+    await communicator.disconnect()
+    assert await lifespan.receive_output(timeout=5) == {"type": "lifespan.shutdown.complete"}
+    assert not consumers.heartbeat.running
+    assert len(consumers.connections) == 0
+
+def test_uvicorn_drains_connections_on_sigterm():
+    pytest.importorskip("uvicorn")
+    pytest.importorskip("wsproto")
+    from websockets.exceptions import ConnectionClosed
+    from websockets.sync.client import connect
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "mywebsite.uvicorn_server", "-p", str(port), "--loop", "asyncio", "--http", "h11"],
+        env=dict(os.environ, TESTING="1"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                websocket = connect(f"ws://127.0.0.1:{port}/ws/chat/", open_timeout=5)
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise
+                time.sleep(0.1)
+        with websocket:
+            assert "session_uuid" in websocket.recv(timeout=5)
+            websocket.send("hello")
+            assert websocket.recv(timeout=5) == '{"count":1}'
+            server.send_signal(signal.SIGTERM)
+            with pytest.raises(ConnectionClosed):
+                websocket.recv(timeout=10)
+            assert websocket.close_code == SHUTDOWN_CLOSE_CODE
+        server.wait(timeout=10)
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
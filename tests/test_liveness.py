@@ -0,0 +1,133 @@
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat import consumers
+from chat.codec import json_codec
+from chat.liveness import REAPED_CLOSE_CODE, LivenessMonitor, TimerWheel
+from chat.middleware import AllowEmptyOriginValidator
+from chat.registry import ConnectionRegistry, connections
+from chat.routing import websocket_urlpatterns
+
+
+@pytest.fixture(autouse=True)
+async def liveness_enabled(monkeypatch):
+    monkeypatch.setattr(consumers, "liveness_enabled", True)
+    yield
+    await consumers.liveness.stop()
+
+def test_timer_wheel_fires_on_due_tick():
+    wheel = TimerWheel(resolution=1.0, slots=4)
+    wheel.schedule("a", 2)
+    wheel.schedule("b", 3)
+    assert wheel.advance() == []
+    assert wheel.advance() == ["a"]
+    assert wheel.advance() == ["b"]
+    assert len(wheel) == 0
+
+def test_timer_wheel_reschedule_and_cancel():
+    wheel = TimerWheel(resolution=1.0, slots=4)
+    wheel.schedule("a", 1)
+    wheel.schedule("a", 2)
+    wheel.schedule("b", 1)
+    wheel.cancel("b")
+    assert wheel.advance() == []
+    assert wheel.advance() == ["a"]
+
+def test_timer_wheel_handles_delays_longer_than_a_revolution():
+    wheel = TimerWheel(resolution=1.0, slots=4)
+    wheel.schedule("a", 6)
+    fired = [wheel.advance() for _ in range(6)]
+    assert fired == [[], [], [], [], [], ["a"]]
+
+class FakeConsumer:
+    codec = json_codec
+    session_uuid = None
+
+    def __init__(self, channel_name, fail_disconnect=False):
+        self.channel_name = channel_name
+        self.fail_disconnect = fail_disconnect
+        self.sent = []
+        self.closed = None
+
+    def queue_message(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=None):
+        self.closed = code
+
+    async def disconnect(self, close_code):
+        if self.fail_disconnect:
+            raise ConnectionError("session store unavailable")
+
+async def test_failing_reap_does_not_stop_the_check():
+    registry = ConnectionRegistry()
+    liveness = LivenessMonitor(registry, interval=1, max_missed=1)
+    failing, dead, idle = FakeConsumer("failing", fail_disconnect=True), FakeConsumer("dead"), FakeConsumer("idle")
+    for consumer in (failing, dead, idle):
+        registry.add(consumer)
+        liveness.track(consumer)
+        consumer.last_activity -= 1
+    # Two connections have missed their ping, the last one is only idle
+    failing.missed_pings = dead.missed_pings = 1
+    await liveness.check(["failing", "dead", "idle"])
+    assert failing.closed == dead.closed == REAPED_CLOSE_CODE
+    assert liveness.reaped == 2
+    # The connection after the failed reap was still pinged and stays tracked
+    assert len(idle.sent) == 1
+    assert "idle" in liveness.wheel
+
+async def connect():
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/"
+    )
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()
+    consumer = connections.snapshot()[-1]
+    return communicator, consumer
+
+async def test_idle_connection_is_pinged_then_reaped():
+    liveness = consumers.liveness
+    communicator, consumer = await connect()
+    active_connections = consumers.metrics["active_connections"]
+    reaped = liveness.reaped
+    try:
+        assert consumer.channel_name in liveness.wheel
+        for _ in range(liveness.max_missed):
+            consumer.last_activity -= liveness.interval
+            await liveness.check([consumer.channel_name])
+            response = await communicator.receive_json_from()
+            assert "ping" in response
+        consumer.last_activity -= liveness.interval
+        await liveness.check([consumer.channel_name])
+        closed = await communicator.receive_output()
+        assert closed == {"type": "websocket.close", "code": REAPED_CLOSE_CODE}
+        assert liveness.reaped == reaped + 1
+        assert consumer.channel_name not in liveness.wheel
+        assert consumer not in connections
+        assert consumers.metrics["active_connections"] == active_connections - 1
+    finally:
+        await communicator.disconnect()
+    # The server reporting the close later does not run the cleanup twice
+    assert consumers.metrics["active_connections"] == active_connections - 1
+
+async def test_pong_counts_as_activity_but_not_as_message():
+    liveness = consumers.liveness
+    communicator, consumer = await connect()
+    try:
+        consumer.last_activity -= liveness.interval
+        await liveness.check([consumer.channel_name])
+        ping = await communicator.receive_json_from()
+        await communicator.send_json_to({"pong": ping["ping"]})
+        await communicator.send_json_to({"message": "test"})
+        response = await communicator.receive_json_from()
+        assert response["count"] == 1
+        assert consumer.missed_pings == 0
+        # Recently active connections are just rescheduled
+        await liveness.check([consumer.channel_name])
+        assert await communicator.receive_nothing()
+        assert consumer.channel_name in liveness.wheel
+    finally:
+        await communicator.disconnect()
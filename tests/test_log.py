@@ -0,0 +1,103 @@
+import itertools
+import logging
+import threading
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat import consumers
+from chat.log import AsyncHandler, SamplingFilter, StructuredFormatter
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+        self.threads = set()
+        self.done = threading.Event()
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+        self.done.set()
+
+
+def make_record(level=logging.INFO, event=None, **fields):
+    record = logging.LogRecord("chat.consumers", level, __file__, 1, "message %s", ("arg",), None)
+    if event is not None:
+        record.event = event
+    for name, value in fields.items():
+        setattr(record, name, value)
+    return record
+
+def test_sampling_filter_passes_one_in_n():
+    sampling = SamplingFilter(rates={"receive": 10, "noisy": 0})
+    passed = [sampling.filter(make_record(event="receive")) for _ in range(100)]
+    assert sum(passed) == 10
+    assert passed[0]
+    assert not sampling.filter(make_record(event="noisy"))
+    assert sampling.filter(make_record(event="connect"))
+
+def test_sampling_filter_never_drops_errors():
+    sampling = SamplingFilter(rates={"receive": 1000})
+    sampling.filter(make_record(event="receive"))
+    assert all(sampling.filter(make_record(logging.ERROR, event="receive")) for _ in range(10))
+
+def test_sampling_filter_passes_records_sampled_by_their_caller():
+    sampling = SamplingFilter(rates={"receive": 1000})
+    assert all(sampling.filter(make_record(event="receive", sampled=True)) for _ in range(10))
+
+async def test_receive_builds_records_only_for_sampled_messages(monkeypatch):
+    monkeypatch.setattr(consumers, "receive_log_sample_rate", 10)
+    monkeypatch.setattr(consumers, "receive_log_counter", itertools.count())
+    built = []
+    make_record_original = consumers.logger.makeRecord
+
+    def counting_make_record(*args, **kwargs):
+        record = make_record_original(*args, **kwargs)
+        built.append(record)
+        return record
+
+    monkeypatch.setattr(consumers.logger, "makeRecord", counting_make_record)
+    communicator = WebsocketCommunicator(AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)), "/ws/chat/")
+    await communicator.connect()
+    await communicator.receive_json_from()
+    for i in range(30):
+        await communicator.send_to(text_data="hello")
+        await communicator.receive_json_from()
+    await communicator.disconnect()
+    receive_records = [record for record in built if getattr(record, "event", None) == "receive"]
+    assert len(receive_records) == 3
+    assert all(record.sampled for record in receive_records)
+
+def test_structured_formatter_appends_fields():
+    formatter = StructuredFormatter("%(message)s")
+    line = formatter.format(make_record(event="disconnect", session="abc", close_code=1000))
+    assert line == "message arg event=disconnect session=abc close_code=1000"
+    assert formatter.format(make_record()) == "message arg"
+
+def test_async_handler_formats_on_background_thread():
+    target = RecordingHandler()
+    handler = AsyncHandler(target)
+    handler.setFormatter(StructuredFormatter("%(levelname)s %(message)s"))
+    try:
+        handler.handle(make_record(event="receive", channel="test.1"))
+        assert target.done.wait(timeout=5)
+    finally:
+        handler.close()
+    assert target.lines == ["INFO message arg event=receive channel=test.1"]
+    assert threading.current_thread().name not in target.threads
+
+def test_async_handler_drops_when_queue_is_full():
+    target = RecordingHandler()
+    handler = AsyncHandler(target, maxsize=1)
+    handler.listener.stop()
+    try:
+        handler.handle(make_record())
+        handler.handle(make_record())
+        assert handler.dropped == 1
+    finally:
+        handler.listener.start()
+        handler.close()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import AsyncClient
+
+from chat import consumers
+from chat.instruments import event_loop_lag
+from chat.loopmonitor import LoopLagMonitor, SlowCallbackProfiler
+from chat.middleware import AllowEmptyOriginValidator
+from chat.routing import websocket_urlpatterns
+
+
+class BlockingConsumer:
+    async def receive(self):
+        await asyncio.sleep(0)
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def profiler():
+    profiler = SlowCallbackProfiler(threshold=0.02, window=60)
+    profiler.install()
+    yield profiler
+    profiler.uninstall()
+
+async def test_lag_monitor_measures_a_blocked_loop():
+    monitor = LoopLagMonitor(interval=0.01)
+    count = event_loop_lag.count
+    monitor.start()
+    try:
+        await asyncio.sleep(0.03)
+        time.sleep(0.1)
+        await asyncio.sleep(0.03)
+    finally:
+        await monitor.stop()
+    assert monitor.max_lag >= 0.08
+    assert event_loop_lag.count > count
+
+async def test_profiler_records_slow_coroutine_steps(profiler):
+    await asyncio.create_task(BlockingConsumer().receive())
+    await asyncio.sleep(0)
+    slowest = profiler.slowest()
+    assert slowest[0]["name"] == "BlockingConsumer.receive"
+    assert slowest[0]["duration_ms"] >= 50
+
+async def test_profiler_ignores_fast_callbacks_and_can_be_uninstalled(profiler):
+    original_run = profiler._original_run
+    await asyncio.sleep(0.01)
+    assert profiler.slowest() == []
+    profiler.uninstall()
+    assert asyncio.events.Handle._run is original_run
+    await asyncio.create_task(BlockingConsumer().receive())
+    assert profiler.slowest() == []
+
+def test_profiler_refuses_to_install_on_uvloop(caplog, monkeypatch):
+    uvloop = pytest.importorskip("uvloop")
+    # The chat loggers write to their own handler, caplog listens on the root logger
+    monkeypatch.setattr(logging.getLogger("chat"), "propagate", True)
+    profiler = SlowCallbackProfiler()
+
+    async def install():
+        return profiler.install()
+
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        assert runner.run(install()) is False
+    assert not profiler.installed
+    assert "only works on the asyncio event loop" in caplog.text
+
+def test_profiler_window_drops_old_entries():
+    profiler = SlowCallbackProfiler(window=10)
+    now = time.monotonic()
+    profiler.entries.extend([(now - 20, 0.5, "old", None), (now, 0.1, "new", None)])
+    assert [entry["name"] for entry in profiler.slowest()] == ["new"]
+
+async def test_slow_handler_is_named_and_listed(profiler, monkeypatch):
+    monkeypatch.setattr(consumers, "slow_callbacks_enabled", True)
+    monkeypatch.setattr(consumers, "slow_callbacks", profiler)
+    monkeypatch.setattr("chat.views.slow_callbacks", profiler)
+    original_receive = consumers.ChatConsumer.receive
+
+    async def slow_receive(self, text_data):
+        time.sleep(0.05)
+        await original_receive(self, text_data)
+
+    monkeypatch.setattr(consumers.ChatConsumer, "receive", slow_receive)
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/"
+    )
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()
+    await communicator.send_to(text_data="hello")
+    await communicator.receive_json_from()
+    await communicator.disconnect()
+
+    response = await AsyncClient().get("/chat/slow-callbacks/")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["enabled"] is True
+    assert body["slowest"][0]["handler"] == "ChatConsumer.websocket_receive"
+    assert body["slowest"][0]["duration_ms"] >= 50
+    # A count that is not a number falls back to the default, a negative one lists nothing
+    response = await AsyncClient().get("/chat/slow-callbacks/?count=abc")
+    assert response.status_code == 200
+    assert len(response.json()["slowest"]) >= len(body["slowest"])
+    response = await AsyncClient().get("/chat/slow-callbacks/?count=-5")
+    assert response.status_code == 200
+    assert response.json()["slowest"] == []
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from chat import outbound
+from chat.outbound import SLOW_CONSUMER_CLOSE_CODE, OutboundQueue
+
+
+class SlowClient:
+    """
+    Send callable that blocks until released, like a socket whose buffer is full.
+    """
+    def __init__(self):
+        self.sent = []
+        self.released = asyncio.Event()
+
+    async def __call__(self, message):
+        await self.released.wait()
+        self.sent.append(message)
+
+
+def frame(text):
+    return {"type": "websocket.send", "text": text}
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    for key in outbound.stats:
+        outbound.stats[key] = 0
+
+async def test_drop_oldest_when_full():
+    client = SlowClient()
+    queue = OutboundQueue(client, max_size=3, policy=outbound.DROP_OLDEST)
+    queue.put(frame("0"))
+    await asyncio.sleep(0)
+    for i in range(1, 6):
+        assert queue.put(frame(str(i)))
+    # The writer holds frame 0 while it waits on the client, 1 and 2 were dropped
+    assert len(queue) == 3
+    assert outbound.stats["dropped"] == 2
+    client.released.set()
+    await queue.flush()
+    assert [message["text"] for message in client.sent] == ["0", "3", "4", "5"]
+
+async def test_coalesce_heartbeats():
+    client = SlowClient()
+    queue = OutboundQueue(client, max_size=10, policy=outbound.COALESCE_HEARTBEATS)
+    queue.put(frame("ack 1"))
+    await asyncio.sleep(0)
+    queue.put(frame("hb 1"), heartbeat=True)
+    queue.put(frame("ack 2"))
+    queue.put(frame("hb 2"), heartbeat=True)
+    assert outbound.stats["coalesced"] == 1
+    client.released.set()
+    await queue.flush()
+    assert [message["text"] for message in client.sent] == ["ack 1", "ack 2", "hb 2"]
+
+async def test_disconnect_slow_consumer_at_high_water():
+    client = SlowClient()
+    queue = OutboundQueue(client, max_size=10, policy=outbound.DISCONNECT, high_water=3)
+    queue.put(frame("0"))
+    await asyncio.sleep(0)
+    for i in range(1, 4):
+        queue.put(frame(str(i)))
+    assert not queue.put(frame("too many"))
+    assert queue.closed
+    assert not queue.put(frame("after close"))
+    assert outbound.stats["slow_consumer_disconnects"] == 1
+    client.released.set()
+    await queue.flush()
+    assert client.sent == [frame("0"), {"type": "websocket.close", "code": SLOW_CONSUMER_CLOSE_CODE}]
+
+async def test_slow_client_does_not_delay_others():
+    slow, fast = SlowClient(), SlowClient()
+    fast.released.set()
+    slow_queue = OutboundQueue(slow, max_size=4)
+    fast_queue = OutboundQueue(fast, max_size=4)
+    for i in range(100):
+        slow_queue.put(frame(str(i)))
+        fast_queue.put(frame(str(i)))
+        await asyncio.sleep(0)
+    await asyncio.wait_for(fast_queue.flush(), timeout=1)
+    assert len(fast.sent) == 100
+    assert slow.sent == []
+    slow.released.set()
+    await slow_queue.flush()
+
+async def test_queue_depth_is_observed():
+    count = outbound.queue_depth.count
+    queue = OutboundQueue(SlowClient(), max_size=4)
+    queue.put(frame("a"))
+    queue.put(frame("b"))
+    assert outbound.queue_depth.count == count + 2
+    assert "websocket_outbound_queue_depth_bucket" in outbound.queue_depth.render()
+
+async def test_idle_queue_keeps_no_deque_or_writer():
+    client = SlowClient()
+    queue = OutboundQueue(client)
+    assert queue._queue is None and len(queue) == 0
+    queue.put(frame("0"))
+    queue.put(frame("1"))
+    assert len(queue) == 2
+    client.released.set()
+    await queue.flush()
+    assert [message["text"] for message in client.sent] == ["0", "1"]
+    assert queue._queue is None and queue._writer is None
+    queue.put(frame("2"))
+    await queue.flush()
+    assert len(client.sent) == 3
+
+async def test_close_is_sent_after_queued_frames():
+    client = SlowClient()
+    queue = OutboundQueue(client)
+    queue.put(frame("ack"))
+    queue.put(frame("throttled"))
+    assert queue.close(4429)
+    assert not queue.put(frame("late"))
+    assert not queue.close(4001)
+    client.released.set()
+    await queue.flush()
+    assert client.sent == [frame("ack"), frame("throttled"), {"type": "websocket.close", "code": 4429}]
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        OutboundQueue(SlowClient(), policy="block")
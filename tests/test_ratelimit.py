@@ -0,0 +1,135 @@
+import asyncio
+import json
+import time
+
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat import consumers
+from chat.instruments import throttled_messages
+from chat.middleware import AllowEmptyOriginValidator
+from chat.ratelimit import RATE_LIMITED_CLOSE_CODE, KeyedTokenBuckets, TokenBucket
+from chat.routing import websocket_urlpatterns
+from tests.test_admission import FakeClock
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """
+    Replace the rate limits of the consumers with a session limit of 10/s with bursts of 20,
+    on a clock that only moves when the test says so.
+    """
+    monkeypatch.setattr(consumers, "rate_limit_enabled", True)
+    monkeypatch.setattr(consumers, "session_limits", KeyedTokenBuckets(rate=10, burst=20, clock=FakeClock()))
+    monkeypatch.setattr(consumers, "worker_limit", None)
+    return monkeypatch
+
+
+async def connect(query=""):
+    communicator = WebsocketCommunicator(AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)), f"/ws/chat/{query}")
+    connected, _ = await communicator.connect()
+    assert connected
+    hello = await communicator.receive_json_from()
+    return communicator, hello["session_uuid"]
+
+
+def test_keyed_buckets_forget_only_refilled_buckets():
+    clock = FakeClock()
+    buckets = KeyedTokenBuckets(rate=10, burst=2, max_size=3, clock=clock)
+    assert buckets.consume("a", 2)
+    assert buckets.consume("b")
+    assert not buckets.consume("a")
+    clock.now = 0.1
+    # "b" is full again and goes, "a" still owes a token and stays
+    buckets.get("c")
+    assert set(buckets.buckets) == {"a", "c"}
+    assert not buckets.consume("a", 2)
+    buckets.consume("d")
+    buckets.consume("e")
+    # Over max_size the least recently used bucket goes regardless
+    assert set(buckets.buckets) == {"a", "d", "e"}
+    assert len(buckets) == 3
+
+async def test_flooding_session_is_throttled_without_slowing_others(limits):
+    flooder, flooder_session = await connect()
+    client, _ = await connect()
+    throttled = throttled_messages.values.get("session", 0)
+    total = consumers.metrics["total_messages"]
+
+    async def flood():
+        for i in range(2000):
+            await flooder.send_to(text_data=f"flood {i}")
+            if i % 50 == 0:
+                await asyncio.sleep(0)
+
+    flooding = asyncio.ensure_future(flood())
+    latencies = []
+    for i in range(1, 11):
+        start = time.perf_counter()
+        await client.send_to(text_data="hello")
+        assert await client.receive_json_from() == {"count": i}
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    await flooding
+    await client.disconnect()
+
+    frames = []
+    while not await flooder.receive_nothing(timeout=0.05):
+        frames.append(json.loads(await flooder.receive_from()))
+    acked = [frame["count"] for frame in frames if "count" in frame]
+    throttle_frames = [frame for frame in frames if frame.get("throttled")]
+    # The flooder got its burst and a single throttle frame
+    assert acked == list(range(1, 21))
+    assert throttle_frames == [{"throttled": True, "retry_after": 0.1}]
+    assert throttled_messages.values["session"] == throttled + 2000 - acked[-1]
+    assert consumers.metrics["total_messages"] == total + 10 + acked[-1]
+    assert max(latencies) < 0.1
+
+    # Reconnecting does not refill the bucket
+    await flooder.disconnect()
+    flooder, _ = await connect(f"?session_uuid={flooder_session}")
+    await flooder.send_to(text_data="again")
+    assert (await flooder.receive_json_from())["throttled"]
+    await flooder.disconnect()
+
+async def test_other_spellings_of_the_session_share_its_bucket(limits):
+    flooder, session_uuid = await connect()
+    for i in range(21):
+        await flooder.send_to(text_data=f"flood {i}")
+    frames = [await flooder.receive_json_from() for _ in range(21)]
+    assert frames[-1]["throttled"]
+    await flooder.disconnect()
+    for spelling in (session_uuid.upper(), f"urn:uuid:{session_uuid}", session_uuid.replace("-", "")):
+        flooder, resumed = await connect(f"?session_uuid={spelling}")
+        assert resumed == session_uuid
+        await flooder.send_to(text_data="again")
+        assert (await flooder.receive_json_from())["throttled"]
+        await flooder.disconnect()
+    assert len(consumers.session_limits) == 1
+
+async def test_worker_limit_alone(limits):
+    # A session rate of 0 turns the session limit off
+    limits.setattr(consumers, "session_limits", None)
+    limits.setattr(consumers, "worker_limit", TokenBucket(rate=10, burst=2, clock=FakeClock()))
+    communicator, _ = await connect()
+    for i in range(1, 3):
+        await communicator.send_to(text_data="m")
+        assert await communicator.receive_json_from() == {"count": i}
+    await communicator.send_to(text_data="m")
+    assert await communicator.receive_json_from() == {"throttled": True, "retry_after": 0.1}
+    await communicator.disconnect()
+
+async def test_close_policy_and_worker_limit(limits):
+    limits.setattr(consumers, "close_when_throttled", True)
+    limits.setattr(consumers, "worker_limit", TokenBucket(rate=1, burst=3))
+    communicator, session_uuid = await connect("?batch=1")
+    await communicator.send_to(text_data="[1,2]")
+    assert await communicator.receive_json_from() == {"count": 2}
+    worker_throttled = throttled_messages.values.get("worker", 0)
+    await communicator.send_to(text_data="[3,4]")
+    assert await communicator.receive_output() == {"type": "websocket.close", "code": RATE_LIMITED_CLOSE_CODE}
+    assert throttled_messages.values["worker"] == worker_throttled + 2
+    # The refused batch was not taken from the session's bucket
+    assert consumers.session_limits.get(session_uuid).tokens >= 18
+    await communicator.disconnect()
@@ -0,0 +1,77 @@
+import uuid
+
+import pytest
+
+from chat.session_store import RedisSessionStore
+
+
+@pytest.fixture
+async def make_store(redis_server):
+    stores = []
+
+    def make(**kwargs):
+        store = RedisSessionStore(hosts=redis_server.hosts, **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        await store.close()
+
+async def test_sessions_are_shared_between_workers(make_store):
+    worker1, worker2 = make_store(), make_store()
+    session_uuid = str(uuid.uuid4())
+    await worker1.set(session_uuid, 5)
+    assert await worker2.get(session_uuid) == 5
+    assert await worker2.get(str(uuid.uuid4())) is None
+    assert worker2.hits == 1
+    assert worker2.misses == 1
+
+async def test_set_many_is_pipelined(make_store, monkeypatch):
+    store = make_store()
+    counts = {str(uuid.uuid4()): i for i in range(100)}
+    calls = []
+    original = store.client.execute_command
+    async def execute_command(*args, **kwargs):
+        calls.append(args)
+        return await original(*args, **kwargs)
+    monkeypatch.setattr(store.client, "execute_command", execute_command)
+    await store.set_many(counts)
+    assert calls == []
+    monkeypatch.undo()
+    reader = make_store()
+    for session_uuid, count in counts.items():
+        assert await reader.get(session_uuid) == count
+
+async def test_resume_is_served_from_local_cache(make_store):
+    store = make_store()
+    session_uuid = str(uuid.uuid4())
+    await store.set(session_uuid, 3)
+    assert await store.get(session_uuid) == 3
+    assert store.cache_hits == 1
+    assert store.stats()["cache_hits"] == 1
+
+async def test_sessions_expire_when_idle(make_store):
+    store = make_store(idle_ttl=100)
+    session_uuid = str(uuid.uuid4())
+    await store.set(session_uuid, 1)
+    ttl = await store.client.ttl(store.prefix + uuid.UUID(session_uuid).bytes)
+    assert 0 < ttl <= 100
+
+async def test_invalid_session_uuid_is_a_miss(make_store):
+    store = make_store()
+    assert await store.get("invalid-uuid") is None
+    assert store.misses == 1
+
+async def test_writes_never_lower_a_count(make_store):
+    store, reader = make_store(), make_store()
+    session_uuid = str(uuid.uuid4())
+    await store.set(session_uuid, 2 ** 60 + 7)
+    # A batch that was taken before the newer count was written arrives late
+    await store.set_many({session_uuid: 2 ** 60 + 6})
+    await store.set(session_uuid, 9)
+    assert await store.get(session_uuid) == 2 ** 60 + 7
+    assert await reader.get(session_uuid) == 2 ** 60 + 7
+    await store.set_many({session_uuid: 2 ** 60 + 8})
+    assert await store.get(session_uuid) == 2 ** 60 + 8
+    assert await make_store().get(session_uuid) == 2 ** 60 + 8
@@ -0,0 +1,84 @@
+import time
+import uuid
+
+import pytest
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat import consumers
+from chat.middleware import AllowEmptyOriginValidator
+from chat.resume_tokens import issue_token, read_token
+from chat.routing import websocket_urlpatterns
+
+
+@pytest.fixture
+def tokens_enabled(monkeypatch):
+    monkeypatch.setattr(consumers, "resume_tokens_enabled", True)
+    consumers.session_store.clear()
+    yield
+    consumers.session_store.clear()
+
+def test_token_round_trip():
+    session_uuid = uuid.uuid4()
+    token = issue_token(session_uuid.bytes, 42)
+    assert read_token(token) == (str(session_uuid), 42)
+    assert "=" not in token
+
+def test_tampered_token_is_rejected():
+    token = issue_token(uuid.uuid4().bytes, 42)
+    tampered = token[:10] + ("A" if token[10] != "A" else "B") + token[11:]
+    assert read_token(tampered) is None
+    assert read_token(token[:-2]) is None
+    assert read_token("not a token!") is None
+
+def test_expired_token_is_rejected():
+    token = issue_token(uuid.uuid4().bytes, 1, issued_at=int(time.time()) - 120)
+    assert read_token(token, max_age=60) is None
+    assert read_token(token, max_age=300) is not None
+
+async def test_resume_from_token_without_store(tokens_enabled):
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/"
+    )
+    try:
+        connected, _ = await communicator.connect()
+        assert connected
+        hello = await communicator.receive_json_from()
+        assert read_token(hello["resume_token"]) == (hello["session_uuid"], 0)
+        await communicator.send_json_to({"message": "test"})
+        ack = await communicator.receive_json_from()
+        assert ack["count"] == 1
+        resume_token = ack["resume_token"]
+    finally:
+        await communicator.disconnect()
+
+    # Simulate a reconnect landing on a worker that has never seen the session
+    consumers.session_store.clear()
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        f"/ws/chat/?resume_token={resume_token}"
+    )
+    try:
+        connected, _ = await communicator.connect()
+        assert connected
+        hello = await communicator.receive_json_from()
+        assert hello["session_uuid"] == read_token(resume_token)[0]
+        await communicator.send_json_to({"message": "test"})
+        ack = await communicator.receive_json_from()
+        assert ack["count"] == 2
+    finally:
+        await communicator.disconnect()
+
+async def test_invalid_token_starts_new_session(tokens_enabled):
+    communicator = WebsocketCommunicator(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+        "/ws/chat/?resume_token=invalid"
+    )
+    try:
+        connected, _ = await communicator.connect()
+        assert connected
+        hello = await communicator.receive_json_from()
+        assert read_token(hello["resume_token"]) == (hello["session_uuid"], 0)
+    finally:
+        await communicator.disconnect()
@@ -0,0 +1,126 @@
+import os
+import uuid
+
+from chat import persistence
+from chat.session_store import PersistentSessionStore, WriteBehindBuffer
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def sessions(count):
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+async def test_counts_survive_a_restart(tmp_path):
+    store = PersistentSessionStore(str(tmp_path))
+    buffer = WriteBehindBuffer(store)
+    first, second = sessions(2)
+    buffer.mark(first, 3)
+    await buffer.flush_session(second, 7)
+    await buffer.flush()
+    buffer.mark(first, 4)
+    await buffer.stop()
+
+    restarted = PersistentSessionStore(str(tmp_path))
+    assert await restarted.get(first) == 4
+    assert await restarted.get(second) == 7
+    assert len(restarted) == 2
+
+async def test_compaction_moves_the_log_into_a_snapshot(tmp_path):
+    store = PersistentSessionStore(str(tmp_path))
+    ids = sessions(50)
+    for i, session_uuid in enumerate(ids):
+        await store.set(session_uuid, i)
+    await store.sync()
+    await store.compact()
+    await store.set(ids[0], 100)
+    await store.sync()
+    assert sorted(os.listdir(tmp_path)) == ["sessions.log.1", "sessions.snapshot"]
+
+    restarted = PersistentSessionStore(str(tmp_path), max_size=10)
+    # Only the session from the new log is replayed, the rest stay in the snapshot
+    assert len(restarted._entries) == 1
+    assert len(restarted) == 50
+    assert await restarted.get(ids[0]) == 100
+    assert await restarted.get(ids[25]) == 25
+    assert ids[49] in restarted
+    assert await restarted.get(str(uuid.uuid4())) is None
+
+async def test_snapshot_sessions_are_not_resurrected_after_eviction(tmp_path):
+    store = PersistentSessionStore(str(tmp_path))
+    ids = sessions(3)
+    for session_uuid in ids:
+        await store.set(session_uuid, 1)
+    await store.sync()
+    await store.compact()
+
+    restarted = PersistentSessionStore(str(tmp_path), max_size=1)
+    assert await restarted.get(ids[0]) == 1
+    await restarted.set(ids[1], 2)
+    # ids[0] was evicted from memory and its snapshot entry is stale
+    assert ids[0] not in restarted
+    assert await restarted.get(ids[0]) is None
+    await restarted.sync()
+    await restarted.compact()
+    assert len(restarted) == 2
+
+    assert await PersistentSessionStore(str(tmp_path)).get(ids[1]) == 2
+
+async def test_background_compaction_keeps_counts_written_meanwhile(tmp_path):
+    store = PersistentSessionStore(str(tmp_path), compact_after=10)
+    ids = sessions(20)
+    for i, session_uuid in enumerate(ids[:10]):
+        await store.set(session_uuid, i)
+    await store.sync()
+    assert store._compaction is not None
+    for i, session_uuid in enumerate(ids[10:], start=10):
+        await store.set(session_uuid, i)
+    await store.sync()
+    await store._compaction
+    assert store.compactions == 1
+
+    restarted = PersistentSessionStore(str(tmp_path))
+    assert [await restarted.get(session_uuid) for session_uuid in ids] == list(range(20))
+
+async def test_torn_log_frames_are_dropped(tmp_path):
+    store = PersistentSessionStore(str(tmp_path))
+    kept, lost = sessions(2)
+    await store.set(kept, 1)
+    await store.sync()
+    await store.set(lost, 2)
+    await store.sync()
+    log_path = tmp_path / "sessions.log.0"
+    # Cut the second frame short, as a crash in the middle of a write would
+    with open(log_path, "r+b") as f:
+        f.truncate(os.path.getsize(log_path) - 3)
+
+    restarted = PersistentSessionStore(str(tmp_path))
+    assert await restarted.get(kept) == 1
+    assert await restarted.get(lost) is None
+    assert os.path.getsize(log_path) == persistence.FRAME.size + persistence.RECORD.size
+
+async def test_idle_sessions_expire_across_restarts(tmp_path, monkeypatch):
+    monotonic, wall = FakeClock(1000.0), FakeClock(1_700_000_000.0)
+    monkeypatch.setattr("chat.session_store.time.monotonic", monotonic)
+    monkeypatch.setattr("chat.session_store.time.time", wall)
+    store = PersistentSessionStore(str(tmp_path), idle_ttl=60)
+    idle, active, logged = sessions(3)
+    await store.set(idle, 1)
+    monotonic.now += 30
+    wall.now += 30
+    await store.set(active, 2)
+    await store.sync()
+    await store.compact()
+    await store.set(logged, 3)
+    await store.sync()
+
+    wall.now += 40
+    restarted = PersistentSessionStore(str(tmp_path), idle_ttl=60)
+    assert await restarted.get(idle) is None
+    assert await restarted.get(active) == 2
+    assert await restarted.get(logged) == 3
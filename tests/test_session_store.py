@@ -0,0 +1,115 @@
+import asyncio
+import uuid
+
+from chat.session_store import InMemorySessionStore, WriteBehindBuffer, session_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_store(monkeypatch, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr("chat.session_store.time.monotonic", clock)
+    return InMemorySessionStore(**kwargs), clock
+
+def test_session_key_normalises_to_bytes():
+    value = uuid.uuid4()
+    assert session_key(str(value)) == value.bytes
+    assert session_key(value) == value.bytes
+    assert session_key(value.bytes) == value.bytes
+    assert session_key("invalid-uuid") is None
+    assert session_key(None) is None
+
+async def test_get_counts_hits_and_misses(monkeypatch):
+    store, _ = make_store(monkeypatch)
+    session_uuid = str(uuid.uuid4())
+    assert await store.get(session_uuid) is None
+    await store.set(session_uuid, 5)
+    assert await store.get(session_uuid) == 5
+    assert await store.get("invalid-uuid") is None
+    assert store.stats() == {"hits": 1, "misses": 2, "evictions": 0, "size": 1}
+
+async def test_evicts_least_recently_used(monkeypatch):
+    store, _ = make_store(monkeypatch, max_size=2)
+    first, second, third = (str(uuid.uuid4()) for _ in range(3))
+    await store.set(first, 1)
+    await store.set(second, 2)
+    # Touching the first session makes the second one the least recently used
+    assert await store.get(first) == 1
+    await store.set(third, 3)
+    assert first in store
+    assert second not in store
+    assert third in store
+    assert store.evictions == 1
+    assert len(store) == 2
+
+async def test_evicts_idle_sessions(monkeypatch):
+    store, clock = make_store(monkeypatch, idle_ttl=60)
+    idle, active = str(uuid.uuid4()), str(uuid.uuid4())
+    await store.set(idle, 1)
+    clock.now += 30
+    await store.set(active, 2)
+    clock.now += 40
+    assert await store.get(idle) is None
+    assert await store.get(active) == 2
+    assert store.evictions == 1
+
+async def test_large_counts_survive_packing(monkeypatch):
+    store, clock = make_store(monkeypatch)
+    session_uuid = str(uuid.uuid4())
+    await store.set(session_uuid, 2 ** 40 + 7)
+    clock.now += 5
+    assert await store.get(session_uuid) == 2 ** 40 + 7
+    assert session_uuid in store
+    assert uuid.UUID(session_uuid).bytes in store._entries
+
+async def test_write_behind_buffer_batches_updates(monkeypatch):
+    store, _ = make_store(monkeypatch)
+    buffer = WriteBehindBuffer(store)
+    session_uuid = str(uuid.uuid4())
+    buffer.mark(session_uuid, 1)
+    buffer.mark(session_uuid, 2)
+    assert session_uuid not in store
+    # Pending counts are visible to resumes before they are flushed
+    assert await buffer.get(session_uuid) == 2
+    await buffer.flush()
+    assert store[session_uuid] == 2
+
+async def test_write_behind_buffer_flushes_session_on_close(monkeypatch):
+    store, _ = make_store(monkeypatch)
+    buffer = WriteBehindBuffer(store)
+    session_uuid = str(uuid.uuid4())
+    buffer.mark(session_uuid, 3)
+    await buffer.flush_session(session_uuid, 4)
+    assert store[session_uuid] == 4
+    await buffer.flush()
+    assert store[session_uuid] == 4
+
+async def test_write_behind_buffer_keeps_counts_in_flight_visible(monkeypatch):
+    store, _ = make_store(monkeypatch)
+    buffer = WriteBehindBuffer(store)
+    session_uuid = str(uuid.uuid4())
+    release = asyncio.Event()
+    set_many = store.set_many
+
+    async def slow_set_many(counts):
+        await release.wait()
+        await set_many(counts)
+
+    monkeypatch.setattr(store, "set_many", slow_set_many)
+    buffer.mark(session_uuid, 5)
+    flushing = asyncio.ensure_future(buffer.flush())
+    await asyncio.sleep(0)
+    # The batch is neither pending nor in the store yet
+    assert session_uuid not in store
+    assert await buffer.get(session_uuid) == 5
+    await buffer.flush_session(session_uuid, 6)
+    assert await buffer.get(session_uuid) == 6
+    release.set()
+    await flushing
+    assert buffer._in_flight == {}
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from chat import exposition
+from chat.sharedmetrics import FIELDS, SharedMetrics, create_region
+
+
+def worker_values(**overrides):
+    values = dict.fromkeys(FIELDS, 0)
+    values.update(overrides)
+    return values
+
+
+@pytest.fixture
+def region(tmp_path):
+    path = str(tmp_path / "metrics")
+    create_region(path, 3)
+    return path
+
+def test_workers_publish_to_their_own_slots(region):
+    workers = [SharedMetrics(region, 3, worker_id) for worker_id in range(3)]
+    for worker_id, worker in enumerate(workers):
+        worker.publish(worker_values(total_messages=10 * (worker_id + 1), active_connections=worker_id + 1))
+    # Any worker sees every slot
+    slots = workers[1].read()
+    assert [up for _, up, _, _ in slots] == [True, True, True]
+    assert [values["total_messages"] for _, _, _, values in slots] == [10, 20, 30]
+    totals = SharedMetrics.totals(slots)
+    assert totals["total_messages"] == 60
+    assert totals["active_connections"] == 6
+
+def test_gauges_of_dead_workers_are_not_counted(region):
+    workers = [SharedMetrics(region, 3, worker_id, stale_after=0.05) for worker_id in range(2)]
+    workers[0].publish(worker_values(total_messages=5, active_connections=2))
+    time.sleep(0.1)
+    workers[1].publish(worker_values(total_messages=7, active_connections=3))
+    slots = workers[1].read()
+    assert [up for _, up, _, _ in slots] == [False, True, False]
+    totals = SharedMetrics.totals(slots)
+    assert totals["total_messages"] == 12
+    assert totals["active_connections"] == 3
+
+def test_counters_survive_a_restarted_worker(region):
+    reader = SharedMetrics(region, 3, 1)
+    old = SharedMetrics(region, 3, 0)
+    # The previous process in the slot
+    old.pid += 1
+    old.publish(worker_values(total_messages=40, error_count=2, active_connections=5))
+    assert SharedMetrics.totals(reader.read())["total_messages"] == 40
+
+    restarted = SharedMetrics(region, 3, 0)
+    restarted.publish(worker_values(total_messages=3, active_connections=1))
+    _, _, pid, values = reader.read()[0]
+    assert pid == restarted.pid
+    assert values["total_messages"] == 43
+    assert values["error_count"] == 2
+    assert values["active_connections"] == 1
+    totals = SharedMetrics.totals(reader.read())
+    assert totals["total_messages"] == 43
+    assert totals["active_connections"] == 1
+
+def test_sequence_is_even_between_writes(region):
+    worker = SharedMetrics(region, 3, 0)
+    sequences = []
+    for count in range(3):
+        worker.publish(worker_values(total_messages=count))
+        sequences.append(int.from_bytes(worker.region[:8], "little"))
+    assert sequences == [2, 4, 6]
+    assert worker.read_slot(0)[2]["total_messages"] == 2
+
+def test_worker_id_must_fit_the_region(region):
+    with pytest.raises(ValueError):
+        SharedMetrics(region, 3, 3)
+
+def test_metrics_page_reports_totals_and_per_worker_values(region, monkeypatch):
+    local = SharedMetrics(region, 3, 0)
+    other = SharedMetrics(region, 3, 2)
+    other.publish(worker_values(total_messages=100, active_connections=4))
+    monkeypatch.setattr(exposition, "shared_metrics", local)
+    local_values = exposition.worker_metrics()
+
+    families = {
+        family.name: family
+        for family in text_string_to_metric_families(exposition.render_metrics().decode())
+    }
+    assert families["websocket_total_messages"].samples[0].value == local_values["total_messages"] + 100
+    per_worker = {
+        sample.labels["worker"]: sample.value for sample in families["websocket_worker_active_connections"].samples
+    }
+    assert per_worker == {"0": local_values["active_connections"], "1": 0, "2": 4}
+    up = {sample.labels["worker"]: sample.value for sample in families["websocket_worker_up"].samples}
+    assert up == {"0": 1, "1": 0, "2": 1}
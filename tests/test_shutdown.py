@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat.middleware import AdmissionControl, AllowEmptyOriginValidator
+from chat.registry import ConnectionRegistry, connections
+from chat.routing import websocket_urlpatterns
+from chat.shutdown import SHUTDOWN_CLOSE_CODE, GracefulShutdown
+
+
+class FakeConsumer:
+    def __init__(self, registry, channel_name, close_delay=0.0, hang=False):
+        self.registry = registry
+        self.channel_name = channel_name
+        self.close_delay = close_delay
+        self.hang = hang
+        self.closed_at = None
+
+    async def shutdown_message(self, event):
+        self.closed_at = time.monotonic()
+        if not self.hang:
+            # The client finishes the close handshake later and the consumer disconnects
+            asyncio.get_running_loop().call_later(self.close_delay, self.registry.remove, self)
+
+
+def make_registry(count, **kwargs):
+    registry = ConnectionRegistry()
+    consumers = [FakeConsumer(registry, f"test.{i}", **kwargs) for i in range(count)]
+    for consumer in consumers:
+        registry.add(consumer)
+    return registry, consumers
+
+async def test_shutdown_finishes_when_connections_drain():
+    registry, _ = make_registry(10, close_delay=0.05)
+    shutdown = GracefulShutdown(registry, deadline=5, batch_size=100, poll_interval=0.01)
+    stopped = []
+
+    async def stop():
+        stopped.append(len(registry))
+
+    start = time.monotonic()
+    await shutdown.run(stop=stop)
+    assert time.monotonic() - start < 1
+    assert stopped == [0]
+    assert shutdown.remaining == 0
+    assert set(shutdown.timings) == {"broadcast", "drain", "stop"}
+    assert shutdown.timings["drain"] >= 0.04
+
+async def test_closes_are_staggered_in_batches():
+    registry, consumers = make_registry(7, close_delay=0.01)
+    shutdown = GracefulShutdown(registry, deadline=5, batch_size=3, batch_interval=0.05, poll_interval=0.01)
+    await shutdown.run()
+    batches = [consumers[0:3], consumers[3:6], consumers[6:]]
+    starts = [min(consumer.closed_at for consumer in batch) for batch in batches]
+    for batch in batches:
+        assert max(consumer.closed_at for consumer in batch) - min(consumer.closed_at for consumer in batch) < 0.04
+    assert starts[1] - starts[0] >= 0.04
+    assert starts[2] - starts[1] >= 0.04
+
+async def test_deadline_bounds_the_drain():
+    registry, _ = make_registry(3, hang=True)
+    shutdown = GracefulShutdown(registry, deadline=0.2, poll_interval=0.01)
+    start = time.monotonic()
+    await shutdown.run()
+    assert 0.15 < time.monotonic() - start < 1
+    assert shutdown.remaining == 3
+
+async def test_shutdown_closes_websocket_clients():
+    communicators = []
+    for _ in range(3):
+        communicator = WebsocketCommunicator(
+            AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)),
+            "/ws/chat/"
+        )
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.receive_json_from()
+        communicators.append(communicator)
+
+    async def close_like_a_client(communicator):
+        output = await communicator.receive_output(timeout=1)
+        assert output == {"type": "websocket.close", "code": SHUTDOWN_CLOSE_CODE}
+        await communicator.disconnect(code=SHUTDOWN_CLOSE_CODE)
+
+    shutdown = GracefulShutdown(connections, deadline=5, batch_size=2, poll_interval=0.01)
+    clients = asyncio.gather(*(close_like_a_client(communicator) for communicator in communicators))
+    await shutdown.run()
+    await clients
+    assert len(connections) == 0
+    assert shutdown.remaining == 0
+
+async def test_close_does_not_overtake_queued_frames():
+    communicator = WebsocketCommunicator(AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)), "/ws/chat/")
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()
+    consumer = connections.snapshot()[-1]
+    consumer.queue_message({"type": "websocket.send", "text": "last words"})
+    await consumer.shutdown_message({"type": "shutdown_message"})
+    assert await communicator.receive_from() == "last words"
+    assert await communicator.receive_output() == {"type": "websocket.close", "code": SHUTDOWN_CLOSE_CODE}
+    await communicator.disconnect(code=SHUTDOWN_CLOSE_CODE)
+
+async def test_clients_reconnecting_during_the_drain_are_turned_away():
+    shutdown = GracefulShutdown(connections, deadline=1, poll_interval=0.01)
+    application = AdmissionControl(
+        AllowEmptyOriginValidator(URLRouter(websocket_urlpatterns)), enabled=False, shutdown=shutdown,
+    )
+    communicator = WebsocketCommunicator(application, "/ws/chat/")
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()
+
+    async def reconnect_like_a_client():
+        assert await communicator.receive_output(timeout=1) == {"type": "websocket.close", "code": SHUTDOWN_CLOSE_CODE}
+        # Reconnect before the old connection is gone, so the drain is still waiting for it
+        again = WebsocketCommunicator(application, "/ws/chat/")
+        connected, _ = await again.connect()
+        assert connected
+        frame = await again.receive_json_from()
+        assert await again.receive_output() == {"type": "websocket.close", "code": SHUTDOWN_CLOSE_CODE}
+        await again.disconnect()
+        await communicator.disconnect(code=SHUTDOWN_CLOSE_CODE)
+        return frame
+
+    client = asyncio.ensure_future(reconnect_like_a_client())
+    start = time.monotonic()
+    await shutdown.run()
+    assert await client == {"retry_after": 1}
+    assert time.monotonic() - start < 0.5
+    assert shutdown.remaining == 0